@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+timing of energy-dependent broadening of an FDMNES XANES calculation,
+comparing conv() with the sparse-matrix form conv_sparse(), for one
+spectrum and for a set of spectra
+"""
+from time import time
+import numpy as np
+from larch.math.convolution1D import conv, conv_sparse, atan_gamma
+
+dat = np.loadtxt('ZnO_FDMNES.txt', skiprows=2)
+energy, mu = dat[:, 0], dat[:, 1]
+e_cut = -1.4639996
+gammas = atan_gamma(energy, e_cut=e_cut, gamma_hole=1.5, gamma_max=15)
+
+for kernel in ('gaussian', 'lorentzian'):
+    t0 = time()
+    expected = conv(energy, mu, gammas, e_cut=e_cut, kernel=kernel)
+    t_conv = time() - t0
+
+    t0 = time()
+    out = conv_sparse(energy, mu, gammas, e_cut=e_cut, kernel=kernel)
+    t_first = time() - t0
+
+    stack = np.array([mu*(1 + 0.01*i) for i in range(100)])
+    t0 = time()
+    conv_sparse(energy, stack, gammas, e_cut=e_cut, kernel=kernel)
+    t_stack = time() - t0
+    diff = abs(out - expected).max()/abs(expected).max()
+    print(f"{kernel:10s} conv(): {1000*t_conv:8.2f} ms  conv_sparse(): {1000*t_first:8.2f} ms "
+          f" 100 spectra: {1000*t_stack:8.2f} ms   max rel diff: {diff:.2e}")
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+timing of feffit for many datasets sharing Parameters, as for a
+temperature series, comparing serial and parallel calculation
+of the residuals for the datasets in worker processes.
+"""
+import time
+from pathlib import Path
+
+from larch.io import read_ascii
+from larch.fitting import param, param_group
+from larch.xafs import (autobk, feffpath, feffit_transform,
+                        feffit_dataset, feffit)
+
+topdir = Path(__file__).parent
+ndatasets = 12
+npaths = 5
+
+data = read_ascii(Path(topdir, '..', 'xafsdata', 'cu_metal_rt.xdi').as_posix())
+data.mu = data.mutrans
+autobk(data, rbkg=1.1, kw=2)
+
+def make_fit():
+    pars = param_group(amp=param(1, vary=True),
+                       del_e0=param(3, vary=True),
+                       theta=param(250, vary=True))
+    dsets = []
+    for i in range(ndatasets):
+        setattr(pars, f'alpha_{i}', param(0, vary=True))
+        paths = []
+        for ipath in range(1, npaths+1):
+            fname = Path(topdir, 'Feff_Cu', f'feff{ipath:04d}.dat').as_posix()
+            paths.append(feffpath(fname, s02='amp', e0='del_e0',
+                                  sigma2='sigma2_eins(300, theta)',
+                                  deltar=f'alpha_{i}*reff'))
+        trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4,
+                                 window='kaiser', rmin=1.4, rmax=5.0)
+        dsets.append(feffit_dataset(data=data, paths=paths, transform=trans))
+    return pars, dsets
+
+for nworkers in (1, 2, 4):
+    pars, dsets = make_fit()
+    t0 = time.time()
+    out = feffit(pars, dsets, nworkers=nworkers, path_outputs=False)
+    print(f"nworkers={nworkers}: {time.time()-t0:.2f} sec, nfev={out.nfev}, "
+          f"chi_square={out.chi_square:.6g}")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+timing of reading a Feff folder with many paths: parsing every feff.dat
+file (cold), and reading from the binary cache written by
+read_feffdat_folder() (warm), both as one folder and with feffpath()
+"""
+import os
+import shutil
+import tempfile
+from glob import glob
+from time import time
+import larch.xafs.feffdat as feffdat
+from larch.xafs import feffpath
+from larch.xafs.feffdat import read_feffdat_folder
+
+ncopies = 20
+tmpdir = tempfile.mkdtemp()
+feffdat.FEFFDAT_CACHE_DIR = os.path.join(tmpdir, 'cache')
+
+# make a Feff folder with many feff.dat files
+folder = os.path.join(tmpdir, 'feff')
+os.mkdir(folder)
+ipath = 0
+for i in range(ncopies):
+    for fname in sorted(glob(os.path.join('Feff_Cu', 'feff0*.dat'))):
+        ipath += 1
+        shutil.copy(fname, os.path.join(folder, f'feff{ipath:04d}.dat'))
+filenames = sorted(glob(os.path.join(folder, 'feff0*.dat')))
+
+def timeit(label, func):
+    t0 = time()
+    out = func()
+    print(f"{label:40s}: {1000*(time()-t0):9.2f} ms")
+    return out
+
+print(f"Feff folder with {len(filenames)} paths")
+timeit('feffpath(), no cache', lambda: [feffpath(f) for f in filenames])
+timeit('read_feffdat_folder(), no cache',
+       lambda: read_feffdat_folder(folder, use_cache=False, write_cache=False))
+timeit('read_feffdat_folder(), writing cache',
+       lambda: read_feffdat_folder(folder))
+feffdat._feffdat_caches.clear()
+timeit('read_feffdat_folder(), from cache',
+       lambda: read_feffdat_folder(folder))
+feffdat._feffdat_caches.clear()
+timeit('feffpath(), from cache', lambda: [feffpath(f) for f in filenames])
+shutil.rmtree(tmpdir)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+timing of autobk(), comparing the residual that re-builds splines at each
+function evaluation with the residual using precomputed matrices (fast=True)
+"""
+from time import time
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import autobk, pre_edge
+
+ntimes = 20
+for fname, kws in (('../xafsdata/cu_metal_rt.xdi', dict(rbkg=1.0, kweight=2)),
+                   ('../xafsdata/feo_rt1.xdi', dict(rbkg=0.9, kweight=2)),
+                   ('../xafsdata/fe2o3_rt1.xmu', dict(rbkg=1.0, kweight=1,
+                                                     kmax=14))):
+    dat = read_ascii(fname)
+    mu = getattr(dat, 'mutrans', getattr(dat, 'mu', None))
+    # run pre_edge() once, so that only the background fits are timed
+    pre_edge(dat.energy, mu, group=dat)
+    kws.update(ek0=dat.e0, edge_step=dat.edge_step)
+    results = {}
+    for fast in (False, True):
+        t0 = time()
+        for i in range(ntimes):
+            group = Group()
+            autobk(dat.energy, mu, group=group, fast=fast, **kws)
+        results[fast] = (time() - t0)/ntimes, group
+
+    (t_slow, g_slow), (t_fast, g_fast) = results[False], results[True]
+    dchi = abs(g_fast.chi - g_slow.chi).max()/abs(g_slow.chi).max()
+    print(f"{fname:28s}: {1000*t_slow:8.2f} ms  fast: {1000*t_fast:8.2f} ms "
+          f" speedup: {t_slow/t_fast:5.1f}   max rel diff(chi): {dchi:.2e}")
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+timing of the MacLaurin series KK transform kkmclr(), comparing the
+scalar form (python loops), the vector form, and the FFT form
+"""
+from time import time
+import numpy as np
+from larch.xafs.diffkk import kkmclr_sca, kkmclr, kkmclr_fft
+
+for npts in (1000, 2000, 5000, 10000):
+    energy = np.linspace(8800, 9800, npts)
+    fpp = (1.0/(1 + np.exp(-(energy-8980)/3.0))
+           + 0.3*np.exp(-((energy-8990)/5.0)**2))
+    timings, results = {}, {}
+    forms = [('vector', kkmclr), ('fft', kkmclr_fft)]
+    if npts <= 2000:
+        forms.insert(0, ('scalar', kkmclr_sca))
+    for name, func in forms:
+        ntimes = 1 if name == 'scalar' else 10
+        t0 = time()
+        for i in range(ntimes):
+            results[name] = np.array(func(energy, fpp))
+        timings[name] = (time() - t0)/ntimes
+    diff = abs(results['fft'] - results['vector']).max()/abs(results['vector']).max()
+    tscalar = '%10.2f ms' % (1000*timings['scalar']) if 'scalar' in timings else ' '*13
+    print(f"npts={npts:6d}: scalar: {tscalar}  vector: {1000*timings['vector']:8.2f} ms "
+          f" fft: {1000*timings['fft']:8.2f} ms  max rel diff(fft): {diff:.2e}")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+timing of an XRF spectrum fit with a 20-element model, for the
+spectrum of NIST SRM 1832, and of calculating the model spectrum
+when all line shapes must be calculated and when only amplitudes
+have changed
+"""
+from time import time
+from larch.io import gsemca_group
+from larch.xrf import xrf_model
+
+ELEMENTS = ('Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca', 'Ti', 'V', 'Cr', 'Mn',
+            'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'As', 'Se', 'Br', 'Pb')
+
+def make_model():
+    model = xrf_model(xray_energy=35.0, count_time=96.36,
+                      energy_min=1.5, energy_max=30.0)
+    model.set_detector(thickness=0.4, material='Si', cal_offset=-0.0107,
+                       cal_slope=0.014655, noise=0.05)
+    model.add_scatter_peak(name='elastic', center=35.0, amplitude=1e5)
+    model.add_scatter_peak(name='compton1', center=33.0, amplitude=1e5,
+                           sigmax=1.5)
+    model.add_filter('beryllium', 0.025)
+    model.add_escape(scale=0.25, vary=True)
+    for elem in ELEMENTS:
+        model.add_element(elem, amplitude=500)
+    return model
+
+mca = gsemca_group('srm1832.mca')
+
+model = make_model()
+energy = mca.energy*1.0
+model.calc_spectrum(energy)
+t0 = time()
+for i in range(10):
+    model._basis_cache.clear()
+    model.calc_spectrum(energy)
+t_calc = (time() - t0)/10
+
+# with only amplitudes changing, the cached unit spectra are used
+t0 = time()
+for i in range(10):
+    model.params['amp_fe'].value = 500 + i
+    model.calc_spectrum(energy)
+t_amps = (time() - t0)/10
+model.params['amp_fe'].value = 500
+
+t0 = time()
+result = model.fit_spectrum(mca, energy_min=1.5, energy_max=30.0)
+t_fit = time() - t0
+print(f"calc_spectrum: {1000*t_calc:8.2f} ms,  amplitudes only: {1000*t_amps:8.2f} ms")
+print(f"fit_spectrum:  {t_fit:8.2f} s,  nfev={result.nfev}, redchi={result.redchi:.5g}")
+for name in ('Ca', 'Mn', 'Cu', 'elastic'):
+    print(f"   {name:8s}  {result.eigenvalues[name]:.6g}")
@@ -7,8 +7,7 @@ from scipy.stats import f
 
 import lmfit
 from lmfit import Parameter
-from lmfit import (Parameters, Minimizer, conf_interval,
-                   ci_report, conf_interval2d)
+from lmfit import Parameters, Minimizer, ci_report
 
 from lmfit.minimizer import MinimizerResult
 from lmfit.model import (ModelResult, save_model, load_model,
@@ -18,6 +17,8 @@ from uncertainties import ufloat, correlated_values
 from uncertainties import wrap as un_wrap
 
 from ..symboltable import Group, isgroup
+from .confidence import (FitProblem, chi2_map, confidence_intervals,
+                         fit_fixed)
 
 
 def isParameter(x):
@@ -392,59 +393,6 @@ def fit_report(fit_result, modelpars=None, show_correl=True, min_correl=0.1,
     return "Cannot make fit report with %s" % repr(fit_result)
 
 
-def confidence_intervals(fit_result, sigmas=(1, 2, 3), **kws):
-    """calculate the confidence intervals from a fit
-    for supplied sigma values
-
-    wrapper around lmfit.conf_interval
-    """
-    fitter = getattr(fit_result, 'fitter', None)
-    result = getattr(fit_result, 'fit_details', None)
-    return conf_interval(fitter, result, sigmas=sigmas, **kws)
-
-def chi2_map(fit_result, xname, yname, nx=11, ny=11, sigma=3, **kws):
-    """generate a confidence map for any two parameters for a fit
-
-    Arguments
-    ==========
-       minout   output of minimize() fit (must be run first)
-       xname    name of variable parameter for x-axis
-       yname    name of variable parameter for y-axis
-       nx       number of steps in x [11]
-       ny       number of steps in y [11]
-       sigma    scale for uncertainty range [3]
-
-    Returns
-    =======
-        xpts, ypts, map
-
-    Notes
-    =====
-     1.  sigma sets the extent of values to explore:
-              param.value +/- sigma * param.stderr
-    """
-    #
-    fitter = getattr(fit_result, 'fitter', None)
-    result = getattr(fit_result, 'fit_details', None)
-    if fitter is None or result is None:
-        raise ValueError("chi2_map needs valid fit result as first argument")
-
-    c2_scale = fit_result.chi_square / result.chisqr
-
-    def scaled_chisqr(ndata, nparas, new_chi, best_chi, nfix=1.):
-        """return scaled chi-sqaure, instead of probability"""
-        return new_chi * c2_scale
-
-    x = result.params[xname]
-    y = result.params[yname]
-    xrange = (x.value + sigma * x.stderr, x.value - sigma * x.stderr)
-    yrange = (y.value + sigma * y.stderr, y.value - sigma * y.stderr)
-
-    return conf_interval2d(fitter, result, xname, yname,
-                           limits=(xrange, yrange),
-                           prob_func=scaled_chisqr,
-                           nx=nx, ny=ny, **kws)
-
 _larch_name = '_math'
 exports = {'param': param,
            'guess': guess,
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+Confidence intervals and chi-square maps, with the fits for each probe
+value or grid point run serially or spread over a pool of processes.
+
+A FitProblem gives the Minimizer and best-fit MinimizerResult for a fit.
+With nworkers > 1, the FitProblem is sent to each worker process, which
+re-creates its own Minimizer (and for feffit(), its own prepared copies
+of the datasets) once, and then runs fits for many grid points.
+"""
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from lmfit.confidence import ConfidenceInterval, restore_vals
+
+
+class FitProblem:
+    """a fit to be re-run with some Parameters held fixed
+
+    Parameters:
+    ------------
+      minimizer:  lmfit Minimizer for the fit
+      result:     lmfit MinimizerResult of the best fit
+
+    setup() returns (minimizer, result).  Subclasses that can be
+    pickled without the Minimizer (as for feffit) re-create these
+    in setup(), allowing the fits to be run in worker processes.
+    """
+    def __init__(self, minimizer, result):
+        self.minimizer = minimizer
+        self.result = result
+
+    def setup(self):
+        "return the Minimizer and best-fit MinimizerResult"
+        return self.minimizer, self.result
+
+
+def get_fit_problem(fit_result):
+    """FitProblem for the output of minimize() or feffit()"""
+    if isinstance(fit_result, FitProblem):
+        return fit_result
+    fitter = getattr(fit_result, 'fitter', None)
+    result = getattr(fit_result, 'fit_details', None)
+    if fitter is not None and result is not None:
+        return FitProblem(fitter, result)
+    if getattr(fit_result, 'datasets', None) is not None and result is not None:
+        from ..xafs.feffit import FeffitProblem
+        return FeffitProblem(fit_result)
+    raise ValueError("needs valid fit result as first argument")
+
+
+def _can_pickle(obj):
+    try:
+        pickle.dumps(obj)
+    except Exception:
+        return False
+    return True
+
+
+# Minimizer and result held by each worker process
+_worker_fit = {}
+
+def _worker_init(problem):
+    _worker_fit['fit'] = problem.setup()
+
+def _worker_fit_fixed(fixed, start):
+    minimizer, result = _worker_fit['fit']
+    return fit_fixed(minimizer, result, fixed, start)
+
+def _worker_calc_ci(name, direction, sigmas, warm_start, kws):
+    minimizer, result = _worker_fit['fit']
+    return _calc_ci(minimizer, result, name, direction, sigmas,
+                    warm_start, kws)
+
+
+def fit_fixed(minimizer, result, fixed, start=None):
+    """re-run a fit with some Parameters held at fixed values
+
+    Parameters:
+    ------------
+      minimizer:  lmfit Minimizer for the fit
+      result:     lmfit MinimizerResult of the best fit
+      fixed:      dict of values for Parameters to hold fixed
+      start:      dict of starting values for variable Parameters [None,
+                  to start from best-fit values]
+
+    Returns:
+    ---------
+      chi-square, dict of best-fit values of the remaining variables
+    """
+    params = result.params.copy()
+    for name, val in (start or {}).items():
+        par = params[name]
+        par.value = min(par.max, max(par.min, val))
+    for name, val in fixed.items():
+        params[name].value = val
+        params[name].vary = False
+    out = minimizer.leastsq(params=params)
+    values = {name: par.value for name, par in out.params.items()
+              if par.vary}
+    return out.chisqr, values
+
+
+def chi2_map(fit_result, xname, yname, nx=11, ny=11, sigma=3, nworkers=1,
+             callback=None):
+    """generate a confidence map for any two parameters for a fit
+
+    Arguments
+    ==========
+       minout   output of minimize() or feffit() fit (must be run first)
+       xname    name of variable parameter for x-axis
+       yname    name of variable parameter for y-axis
+       nx       number of steps in x [11]
+       ny       number of steps in y [11]
+       sigma    scale for uncertainty range [3]
+       nworkers number of worker processes to run the fits [1]
+       callback function called as each grid point is done, as
+                   callback(xpts, ypts, map, ix, iy)
+                with map holding NaN for points not yet done.
+
+    Returns
+    =======
+        xpts, ypts, map
+
+    Notes
+    =====
+     1.  sigma sets the extent of values to explore:
+              param.value +/- sigma * param.stderr
+     2.  map has shape (ny, nx), and holds chi-square, scaled as for the
+         chi_square of the fit result.
+     3.  Grid points are done in rings around the point nearest the best
+         fit, with each fit started from the best-fit values for the
+         neighboring point with lowest chi-square that is already done.
+     4.  With nworkers > 1, the points of each ring are spread over a pool
+         of processes, each holding its own copy of the fit (and for feffit,
+         of the prepared datasets).  If the fit cannot be sent to other
+         processes, as for most minimize() results, the points are done
+         in this process.
+    """
+    problem = get_fit_problem(fit_result)
+    result = problem.result
+    c2_scale = getattr(fit_result, 'chi_square', result.chisqr) / result.chisqr
+
+    x = result.params[xname]
+    y = result.params[yname]
+    xpts = np.linspace(x.value - sigma * x.stderr, x.value + sigma * x.stderr, nx)
+    ypts = np.linspace(y.value - sigma * y.stderr, y.value + sigma * y.stderr, ny)
+    ix0 = np.abs(xpts - x.value).argmin()
+    iy0 = np.abs(ypts - y.value).argmin()
+    chi2 = np.full((ny, nx), np.nan)
+    values = {}
+
+    def start_values(ix, iy):
+        "best-fit values of the done neighbor with lowest chi-square"
+        best, start = np.inf, None
+        for jy in range(max(0, iy-1), min(ny, iy+2)):
+            for jx in range(max(0, ix-1), min(nx, ix+2)):
+                if (jx, jy) in values and chi2[jy, jx] < best:
+                    best, start = chi2[jy, jx], values[(jx, jy)]
+        return start
+
+    def save(ix, iy, out):
+        chi2[iy, ix] = out[0]*c2_scale
+        values[(ix, iy)] = out[1]
+        if callback is not None:
+            callback(xpts, ypts, chi2, ix, iy)
+
+    executor, minimizer = None, None
+    if nworkers > 1 and _can_pickle(problem):
+        executor = ProcessPoolExecutor(max_workers=nworkers,
+                                       initializer=_worker_init,
+                                       initargs=(problem,))
+    else:
+        minimizer, result = problem.setup()
+    try:
+        for ring in range(max(ix0, nx-1-ix0, iy0, ny-1-iy0) + 1):
+            points = [(ix, iy) for iy in range(ny) for ix in range(nx)
+                      if max(abs(ix-ix0), abs(iy-iy0)) == ring]
+            if executor is None:
+                for ix, iy in points:
+                    fixed = {xname: xpts[ix], yname: ypts[iy]}
+                    save(ix, iy, fit_fixed(minimizer, result, fixed,
+                                           start_values(ix, iy)))
+                continue
+            futures = {}
+            for ix, iy in points:
+                fixed = {xname: xpts[ix], yname: ypts[iy]}
+                fut = executor.submit(_worker_fit_fixed, fixed,
+                                      start_values(ix, iy))
+                futures[fut] = (ix, iy)
+            for fut in as_completed(futures):
+                save(*futures[fut], fut.result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return xpts, ypts, chi2
+
+
+class WarmStartCI(ConfidenceInterval):
+    """ConfidenceInterval, with each fit started from the best-fit values
+    of the previous fit for the same parameter, instead of from the
+    overall best-fit values"""
+    def calc_prob(self, para, val, offset=0., restore=False):
+        """Calculate the probability for given value."""
+        if restore:
+            restore_vals(self.org, self.params)
+        para.value = val
+        save_para = self.params[para.name]
+        self.params[para.name] = para
+        self.minimizer.prepare_fit(self.params)
+        out = self.minimizer.leastsq()
+        prob = self.prob_func(self.result, out)
+
+        if self.trace:
+            x = [i.value for i in out.params.values()]
+            self.trace_dict[para.name].append(x + [prob])
+        self.params[para.name] = save_para
+        for name, par in out.params.items():
+            if par.vary and name != para.name:
+                self.params[name].value = par.value
+        return prob - offset
+
+
+def _calc_ci(minimizer, result, name, direction, sigmas, warm_start, kws):
+    "confidence interval for one parameter in one direction"
+    ci_class = WarmStartCI if warm_start else ConfidenceInterval
+    cint = ci_class(minimizer, result, p_names=[name], sigmas=sigmas, **kws)
+    return cint.calc_ci(name, direction)
+
+
+def confidence_intervals(fit_result, sigmas=(1, 2, 3), nworkers=1,
+                         warm_start=True, callback=None, p_names=None, **kws):
+    """calculate the confidence intervals from a fit
+    for supplied sigma values
+
+    Arguments
+    ==========
+       fit_result  output of minimize() or feffit() fit
+       sigmas      sigma values for intervals [(1, 2, 3)]
+       nworkers    number of worker processes to run the fits [1]
+       warm_start  whether to start each fit from the values of the
+                   previous fit for that parameter [True]
+       callback    function called as each interval is done, as
+                      callback(name, direction, values)
+                   with direction of -1 or 1, and values a list of
+                   (probability, value) for the sigmas
+       p_names     names of parameters [None, for all variables]
+
+    Returns
+    =======
+       dict of lists of (probability, value) for each parameter, as for
+       lmfit.conf_interval (and for confidence_report()).
+
+    Notes
+    =====
+       This uses lmfit.ConfidenceInterval.  The intervals for each
+       parameter and direction are independent, and with nworkers > 1
+       are spread over a pool of processes, as for chi2_map().
+    """
+    problem = get_fit_problem(fit_result)
+    result = problem.result
+    if p_names is None:
+        p_names = [name for name, par in result.params.items() if par.vary]
+    tasks = [(name, direction) for name in p_names for direction in (-1, 1)]
+    out = {}
+
+    def save(name, direction, ret):
+        out[(name, direction)] = ret
+        if callback is not None:
+            callback(name, direction, ret)
+
+    if nworkers > 1 and _can_pickle(problem):
+        with ProcessPoolExecutor(max_workers=nworkers,
+                                 initializer=_worker_init,
+                                 initargs=(problem,)) as executor:
+            futures = {executor.submit(_worker_calc_ci, name, direction,
+                                       sigmas, warm_start, kws): (name, direction)
+                       for name, direction in tasks}
+            for fut in as_completed(futures):
+                save(*futures[fut], fut.result())
+    else:
+        minimizer, result = problem.setup()
+        for name, direction in tasks:
+            save(name, direction, _calc_ci(minimizer, result, name, direction,
+                                           sigmas, warm_start, kws))
+
+    return {name: (out[(name, -1)][::-1] + [(0., result.params[name].value)]
+                   + out[(name, 1)]) for name in p_names}
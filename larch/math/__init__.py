@@ -15,7 +15,9 @@ from .lineshapes import (gaussian, lorentzian, voigt, pvoigt, hypermet,
 
 from .fitpeak import fit_peak
 from .convolution1D import glinbroad
-from .lincombo_fitting import lincombo_fit, lincombo_fitall, groups2matrix
+from .lincombo_fitting import (lincombo_fit, lincombo_fitall, lincombo_solve,
+                               groups2matrix)
+from .nnls import nnls_batch, nnls_normal
 from .pca import pca_train, pca_fit, nmf_train, save_pca_model, read_pca_model
 from .learn_regress import pls_train, pls_predict, lasso_train, lasso_predict
 from .gridxyz import gridxyz
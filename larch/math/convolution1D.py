@@ -13,6 +13,11 @@ Description
  kernel for each convolution point, e.g. change the FWHM of the
  Gaussian kernel as a function of the energy scale.
 
+ The same convolution as `conv()` is also available as a banded sparse
+ matrix from `conv_matrix()`, which is built once for an energy array
+ and set of widths, and then applied to one or many spectra with
+ `conv_sparse()`.
+
 Resources
 ---------
 
@@ -36,7 +41,9 @@ import subprocess
 from optparse import OptionParser
 from datetime import date
 from string import Template
+from collections import OrderedDict
 import numpy as np
+from scipy import sparse
 
 from .lineshapes import gaussian, lorentzian
 from .utils import polyfit
@@ -220,12 +227,164 @@ def conv(x, y, gammas, e_cut=None, kernel="gaussian"):
     return z
 
 
-def glinbroad(e, mu, gammas=None, e_cut=None):
+CONV_MATRIX_CACHE_SIZE = 16
+_conv_matrix_cache = OrderedDict()
+
+def conv_matrix(x, gammas, e_cut=None, kernel="gaussian", kernel_range=1.5):
+    """sparse matrix for linear broadening, as done by `conv()`
+
+    Parameters
+    ----------
+    x : x-axis (energy)
+    gammas : the full width half maximum in eV for the kernel
+            broadening, an array of size 'x'
+    e_cut : starting energy for the convolution
+    kernel : convolution kernel, 'gaussian' or 'lorentzian'
+    kernel_range : the kernel extends to +/- kernel_range*gammas around
+            each point [1.5, as for `conv()`].  Lorentzian tails need a
+            much larger range than this.
+
+    Returns
+    -------
+    scipy.sparse CSR matrix M of shape (len(x), len(x)), so that
+    `M @ y` gives the same result as `conv(x, y, gammas, e_cut, kernel)`
+
+    Notes
+    -----
+    Each row holds the normalized kernel for one convolution point, so
+    that the matrix is banded with a width set by the largest gamma
+    and kernel_range.
+    The linear extrapolation of the upper part of the spectrum used by
+    `conv()` for points beyond the end of `x` is linear in `y`, and is
+    included in the last rows of the matrix.
+    """
+    assert e_cut is not None, "starting energy for the convolution not given"
+    x = np.asarray(x, dtype="float64")
+    gammas = np.asarray(gammas, dtype="float64")
+    if x.shape != gammas.shape:
+        raise ValueError("'gammas' array does not have the same shape of 'x'")
+    kname = kernel.lower()
+    if not ("gauss" in kname or "lor" in kname):
+        raise ValueError("convolution kernel '{0}' not implemented".format(kernel))
+
+    npts = len(x)
+    xstep = x[-1] - x[-2]
+    # as for conv(), with one more point so that every kernel range ends
+    # inside the extended array
+    xext = max(3.0, kernel_range) * gammas[-1]
+    xup = np.append(x, np.arange(x[-1] + xstep, x[-1] + xext, xstep))
+    xup = np.append(xup, xup[-1] + xstep)
+
+    # kernel ranges, as from get_ene_index(), made odd
+    cen, hwhm = x, kernel_range * gammas
+    imin = np.searchsorted(xup, cen - hwhm, side="left") - 1
+    imin[(cen - hwhm) <= xup.min()] = 0
+    imax = np.searchsorted(xup, cen + hwhm, side="right")
+    imax[(cen + hwhm) >= xup.max()] = len(xup) - 1
+    span = imax - imin
+    nker = np.where(span % 2 == 0, span + 1, span)
+
+    # kernel values for all points, with offsets from the convolution point
+    rows = np.repeat(np.arange(npts), nker)
+    ik = np.arange(nker.sum()) - np.repeat(np.cumsum(nker) - nker, nker)
+    dx = (xup[np.repeat(imin, nker) + ik] - cen[rows]) / (gammas[rows] / 2.0)
+    if "gauss" in kname:
+        ky = np.exp(-(dx**2) / 2.0)
+    else:
+        ky = 1.0 / (1.0 + dx**2)
+    ky = ky / np.bincount(rows, weights=ky, minlength=npts)[rows]
+    cols = rows + ik - np.repeat(nker // 2, nker)
+
+    inside = (cols >= 0) & (cols < npts)
+    mat = sparse.coo_matrix(
+        (ky[inside], (rows[inside], cols[inside])), shape=(npts, npts)
+    ).tocsr()
+
+    # points beyond x use the linear fit to the upper half of the spectrum
+    above = cols >= npts
+    if above.any():
+        lpf = int(len(x) / 2.0)
+        xfit = x[-lpf:]
+        xmid = xfit.mean()
+        fit = np.linalg.pinv(np.column_stack((np.ones(lpf), xfit - xmid)))
+        wsum = np.bincount(rows[above], weights=ky[above], minlength=npts)
+        xsum = np.bincount(
+            rows[above], weights=ky[above] * (xup[cols[above]] - xmid), minlength=npts
+        )
+        erows = np.where(wsum != 0)[0]
+        wext = wsum[erows, None] * fit[0] + xsum[erows, None] * fit[1]
+        ecols = np.arange(npts - lpf, npts)
+        mat = mat + sparse.coo_matrix(
+            (
+                wext.ravel(),
+                (np.repeat(erows, lpf), np.tile(ecols, len(erows))),
+            ),
+            shape=(npts, npts),
+        )
+
+    # no intensity below e_cut
+    ief = np.argmin(np.abs(x - e_cut))
+    mask = (np.arange(npts) >= ief).astype("float64")
+    return sparse.csr_matrix(mat @ sparse.diags(mask))
+
+
+def conv_sparse(x, y, gammas, e_cut=None, kernel="gaussian", kernel_range=1.5):
+    """linear broadening of one or many spectra, with a sparse matrix
+
+    Parameters
+    ----------
+    x : x-axis (energy)
+    y : f(x) to convolve with g(x) kernel, y(energy), or a 2-d array of
+        shape (nspectra, len(x)) for many spectra on the same x-axis
+    kernel : convolution kernel, g(x)
+             'gaussian'
+             'lorentzian'
+    gammas : the full width half maximum in eV for the kernel
+            broadening. It is an array of size 'e' with constants or
+            an energy-dependent values determined by a function as
+            'lin_gamma()' or 'atan_gamma()'
+    kernel_range : the kernel extends to +/- kernel_range*gammas around
+            each point [1.5, as for `conv()`]
+
+    Returns
+    -------
+    broadened array(s) of the same shape as y, the same as from `conv()`
+    for the default kernel_range.
+
+    Notes
+    -----
+    The matrix from `conv_matrix()` is cached for the most recently used
+    energy arrays and widths.
+    """
+    x = np.asarray(x, dtype="float64")
+    gammas = np.asarray(gammas, dtype="float64")
+    key = (x.tobytes(), gammas.tobytes(), e_cut, kernel.lower(), kernel_range)
+    mat = _conv_matrix_cache.get(key, None)
+    if mat is None:
+        mat = conv_matrix(x, gammas, e_cut=e_cut, kernel=kernel,
+                          kernel_range=kernel_range)
+        _conv_matrix_cache[key] = mat
+        while len(_conv_matrix_cache) > CONV_MATRIX_CACHE_SIZE:
+            _conv_matrix_cache.popitem(last=False)
+    else:
+        _conv_matrix_cache.move_to_end(key)
+    y = np.asarray(y, dtype="float64")
+    if y.ndim == 1:
+        return mat @ y
+    return (mat @ y.T).T
+
+
+def glinbroad(e, mu, gammas=None, e_cut=None, fast=True):
     """gaussian linear convolution in Larch"""
+    if fast:
+        return conv_sparse(e, mu, gammas=gammas, kernel="gaussian", e_cut=e_cut)
     return conv(e, mu, gammas=gammas, kernel="gaussian", e_cut=e_cut)
 
 
-glinbroad.__doc__ = conv.__doc__
+glinbroad.__doc__ = conv.__doc__ + """
+    fast : use conv_sparse() [True], which also accepts a 2-d array of
+           spectra for y, or conv() [False].
+    """
 
 ### CONVOLUTION WITH FDMNES VIA SYSTEM CALL ###
 class FdmnesConv(object):
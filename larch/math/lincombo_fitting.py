@@ -10,10 +10,13 @@ import copy
 
 from itertools import combinations
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 from numpy.random import randint
+from scipy.linalg import null_space
 import lmfit
+from lmfit.minimizer import MinimizerResult
 from .. import Group
 from .utils import interp, index_of, etok
 
@@ -212,10 +215,212 @@ def lincombo_fit(group, components, weights=None, minvals=None,
                  arrayname=arrayname, rfactor=rfactor,
                  xmin=xmin, xmax=xmax)
 
+def _lincombo_start(minvals, maxvals, sum_to_one):
+    """feasible starting weights for lincombo_solve(), or None if
+    the bounds cannot be met with weights summing to 1"""
+    ncomps = len(minvals)
+    weights = np.clip(np.ones(ncomps)/ncomps, minvals, maxvals)
+    if not sum_to_one:
+        return weights
+    excess = weights.sum() - 1.0
+    for i in range(ncomps):
+        if abs(excess) < 1.e-12:
+            break
+        step = np.clip(-excess, minvals[i]-weights[i], maxvals[i]-weights[i])
+        weights[i] += step
+        excess += step
+    if abs(excess) > 1.e-9:
+        return None
+    return weights
+
+
+def lincombo_solve(gram, ycross, minvals, maxvals, sum_to_one=True,
+                   maxiter=None):
+    """solve the bounded linear combination problem
+         minimize |ycomps @ w - ydat|^2
+         with minvals <= w <= maxvals and, optionally, sum(w) = 1
+    from the normal equations, with a primal active-set method.
+
+    Arguments
+    ---------
+      gram      (ncomps, ncomps) Gram matrix ycomps.T @ ycomps
+      ycross    (ncomps,) array ycomps.T @ ydat
+      minvals   array of min weights (-inf for no bound)
+      maxvals   array of max weights (+inf for no bound)
+      sum_to_one  bool, whether weights must sum to 1.0 [True]
+      maxiter   maximum number of iterations [10*(ncomps+1)]
+
+    Returns
+    -------
+      array of weights, or None if no weights can meet the bounds.
+    """
+    ncomps = len(ycross)
+    minvals = np.asarray(minvals, dtype='float64')
+    maxvals = np.asarray(maxvals, dtype='float64')
+    if maxiter is None:
+        maxiter = 10*(ncomps+1)
+    weights = _lincombo_start(minvals, maxvals, sum_to_one)
+    if weights is None:
+        return None
+    # components held at a bound: -1 for min, +1 for max, 0 for free
+    atbound = np.zeros(ncomps, dtype=int)
+    atbound[weights == minvals] = -1
+    atbound[weights == maxvals] = 1
+    # keep at least one component free to meet the sum
+    if sum_to_one and (atbound != 0).all():
+        atbound[0] = 0
+    neq = 1 if sum_to_one else 0
+    for _ in range(maxiter):
+        free = np.where(atbound == 0)[0]
+        nfree = len(free)
+        # minimize over the free components, with the others fixed
+        kkt = np.zeros((nfree+neq, nfree+neq))
+        kkt[:nfree, :nfree] = gram[np.ix_(free, free)]
+        rhs = np.zeros(nfree+neq)
+        rhs[:nfree] = ycross[free] - gram[free] @ np.where(atbound == 0, 0, weights)
+        if sum_to_one:
+            kkt[nfree, :nfree] = kkt[:nfree, nfree] = 1.0
+            rhs[nfree] = 1.0 - weights[atbound != 0].sum()
+        try:
+            sol = np.linalg.solve(kkt, rhs)
+        except np.linalg.LinAlgError:
+            sol = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+        target = weights.copy()
+        target[free] = sol[:nfree]
+        step = target - weights
+        # largest step toward target that stays within the bounds
+        alpha, iblock = 1.0, None
+        for i in free:
+            if step[i] < 0 and target[i] < minvals[i]:
+                frac = (minvals[i] - weights[i])/step[i]
+            elif step[i] > 0 and target[i] > maxvals[i]:
+                frac = (maxvals[i] - weights[i])/step[i]
+            else:
+                continue
+            if frac < alpha:
+                alpha, iblock = frac, i
+        weights = weights + alpha*step
+        if iblock is not None:
+            weights[iblock] = minvals[iblock] if step[iblock] < 0 else maxvals[iblock]
+            atbound[iblock] = -1 if step[iblock] < 0 else 1
+            continue
+        # at the minimum for this set of free components: release the
+        # held component with the most negative Lagrange multiplier
+        grad = gram @ weights - ycross
+        if sum_to_one:
+            if nfree > 0:
+                lagrange = sol[nfree]
+            elif (atbound == -1).any():
+                lagrange = -grad[atbound == -1].min()
+            else:
+                lagrange = -grad[atbound == 1].max()
+            grad = grad + lagrange
+        mult = grad*atbound*-1.0
+        mult[atbound == 0] = 0
+        imin = mult.argmin()
+        if mult[imin] >= -1.e-12*max(1.0, abs(ycross).max()):
+            break
+        atbound[imin] = 0
+    return np.clip(weights, minvals, maxvals)
+
+
+def _lincombo_result(xdat, ydat, ycomps, labels, weights, minvals, maxvals,
+                     sum_to_one, arrayname, xmin, xmax):
+    """results group for lincombo_fit(), from weights found with
+    lincombo_solve(), with uncertainties from the curvature of
+    chi-square for the weights not held at a bound"""
+    npts, ncomps = ycomps.shape
+    yfit = ycomps @ weights
+    resid = yfit - ydat
+    chisqr = (resid**2).sum()
+    nvarys = ncomps - 1 if sum_to_one else ncomps
+    nfree = npts - nvarys
+    redchi = chisqr / max(1, nfree)
+
+    # covariance of weights, over directions allowed by the constraints
+    atbound = (weights <= minvals) | (weights >= maxvals)
+    cons = [np.eye(ncomps)[i] for i in np.where(atbound)[0]]
+    if sum_to_one:
+        cons.append(np.ones(ncomps))
+    basis = null_space(np.array(cons)) if len(cons) > 0 else np.eye(ncomps)
+    covar = np.zeros((ncomps, ncomps))
+    if basis.shape[1] > 0:
+        hess = basis.T @ ycomps.T @ ycomps @ basis
+        covar = basis @ np.linalg.pinv(hess) @ basis.T * redchi
+    stderr = np.sqrt(np.maximum(0, np.diag(covar)))
+
+    params = lmfit.Parameters()
+    params.add('e0_shift', value=0., vary=False)
+    for i in range(ncomps):
+        params.add('c%i' % i, value=weights[i], min=minvals[i], max=maxvals[i])
+    if sum_to_one:
+        expr = ['1'] + ['c%i' % i for i in range(ncomps-1)]
+        params['c%i' % (ncomps-1)].expr = '-'.join(expr)
+    params.add('total', expr='+'.join(['c%i' % i for i in range(ncomps)]))
+    for i in range(ncomps):
+        params['c%i' % i].stderr = stderr[i]
+    params['total'].stderr = np.sqrt(max(0, covar.sum()))
+
+    var_names = ['c%i' % i for i in range(nvarys)]
+    neg2_loglikel = npts*np.log(max(chisqr, 1.e-250)/npts)
+    result = MinimizerResult(params=params, var_names=var_names,
+                             covar=covar[:nvarys, :nvarys],
+                             init_vals=list(weights[:nvarys]),
+                             residual=resid, chisqr=chisqr, redchi=redchi,
+                             ndata=npts, nvarys=nvarys, nfree=nfree,
+                             aic=neg2_loglikel + 2*nvarys,
+                             bic=neg2_loglikel + np.log(npts)*nvarys,
+                             nfev=0, success=True, errorbars=True,
+                             method='linear', message='linear solution')
+
+    ls_vals = np.linalg.lstsq(ycomps, ydat, rcond=-1)[0]
+    weights_lstsq, pars, fcomps = {}, {}, {}
+    pars['e0_shift'] = copy.deepcopy(params['e0_shift'])
+    for i, label in enumerate(labels):
+        pars[label] = copy.deepcopy(params['c%i' % i])
+        weights_lstsq[label] = ls_vals[i]
+        fcomps[label] = ycomps[:, i] * weights[i]
+    pars['total'] = copy.deepcopy(params['total'])
+    rfactor = (resid**2).sum() / (ydat**2).sum()
+    return Group(result=result, chisqr=chisqr, redchi=redchi,
+                 params=pars, weights=dict(zip(labels, weights)),
+                 weights_lstsq=weights_lstsq, xdata=xdat, ydata=ydat,
+                 yfit=yfit, ycomps=fcomps, arrayname=arrayname,
+                 rfactor=rfactor, xmin=xmin, xmax=xmax)
+
+
+# Gram matrix and bounds held by each worker process for lincombo_fitall
+_worker_state = {}
+
+def _solve_subsets(state, subsets):
+    """weights and chi-square for each subset of components, with
+    weights of None for subsets whose bounds cannot be met"""
+    gram, ycross = state['gram'], state['ycross']
+    out = []
+    for subset in subsets:
+        sub = list(subset)
+        subgram = gram[np.ix_(sub, sub)]
+        wts = lincombo_solve(subgram, ycross[sub], state['minvals'][sub],
+                             state['maxvals'][sub],
+                             sum_to_one=state['sum_to_one'])
+        chisqr = None
+        if wts is not None:
+            chisqr = max(0, state['ysqr'] - 2*wts @ ycross[sub] +
+                         wts @ subgram @ wts)
+        out.append((wts, chisqr))
+    return out
+
+def _lincombo_worker_init(state):
+    _worker_state.update(state)
+
+def _lincombo_worker_solve(subsets):
+    return _solve_subsets(_worker_state, subsets)
+
+
 def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
                     arrayname='norm', xmin=-np.inf, xmax=np.inf,
                     max_ncomps=None, sum_to_one=True, vary_e0=False,
-                    min_weight=0.0005, max_output=16):
+                    min_weight=0.0005, max_output=16, nworkers=1):
     """perform linear combination fittings for a group with all combinations
     of 2 or more of the components given
 
@@ -234,6 +439,7 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
       vary_e0     bool, whether to vary e0 for data in fit [False]
       min_weight  float, minimum weight for each component to save result [0.0005]
       max_output  int, max number of outputs, sorted by reduced chi-square [16]
+      nworkers    int, number of worker processes to solve combinations [1]
     Returns
     -------
      list of groups with resulting weights and fit statistics, ordered by
@@ -244,28 +450,136 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
      1.  The names of Group members for the components must match those of the
          group to be fitted.
      2.  arrayname can be one of `norm` or `dmude`
+     3.  Unless vary_e0 is True, each combination is solved as a bounded
+         linear least-squares problem with lincombo_solve(), from the Gram
+         matrix of all components computed once.  Combinations are done from
+         largest to smallest, and a combination is skipped when the
+         chi-square of the combinations containing it shows that it cannot
+         be among the max_output best results.  Combinations whose bounds
+         cannot be met with weights summing to 1 are fit with lincombo_fit().
+     4.  When several combinations give the same set of components with
+         weights above min_weight, the one with lowest reduced chi-square
+         is kept.
     """
-
     ncomps = len(components)
-
-    # here we save the inputs weights and bounds for each component by name
-    # so they can be imposed for the individual fits
-    _save = {}
-
-    if weights in (None, [None]*ncomps):
-        weights = [None]*ncomps
     if minvals in (None, [None]*ncomps):
         minvals = -np.inf * np.ones(ncomps)
     if maxvals in (None, [None]*ncomps):
         maxvals = np.inf * np.ones(ncomps)
-
-    for i in range(ncomps):
-        _save[get_label(components[i])] = (weights[i], minvals[i], maxvals[i])
+    minvals = np.array([-np.inf if v is None else v for v in minvals], dtype='float64')
+    maxvals = np.array([np.inf if v is None else v for v in maxvals], dtype='float64')
 
     if max_ncomps is None:
         max_ncomps = ncomps
     elif max_ncomps > 0:
         max_ncomps = int(min(max_ncomps, ncomps))
+
+    if vary_e0:
+        return _lincombo_fitall_lmfit(group, components, minvals, maxvals,
+                                      arrayname=arrayname, xmin=xmin,
+                                      xmax=xmax, max_ncomps=max_ncomps,
+                                      sum_to_one=sum_to_one, vary_e0=vary_e0,
+                                      min_weight=min_weight,
+                                      max_output=max_output)
+
+    labels = [get_label(comp) for comp in components]
+    allgroups = [group]
+    allgroups.extend(components)
+    xdat, yall = groups2matrix(allgroups, yname=arrayname,
+                               xname='energy', xmin=xmin, xmax=xmax)
+    ydat = yall[0, :]
+    ycomps = yall[1:, :].transpose()
+    npts = len(ydat)
+    state = dict(gram=ycomps.T @ ycomps, ycross=ycomps.T @ ydat,
+                 ysqr=ydat @ ydat, minvals=minvals, maxvals=maxvals,
+                 sum_to_one=sum_to_one)
+
+    # chi-square can only increase when removing a component if
+    # a weight of 0 is allowed for every component
+    prune = (minvals <= 0).all() and (maxvals >= 0).all()
+
+    executor = None
+    if nworkers > 1:
+        executor = ProcessPoolExecutor(max_workers=nworkers,
+                                       initializer=_lincombo_worker_init,
+                                       initargs=(state,))
+
+    # results by set of significant components: (redchi, subset, weights or group)
+    kept = {}
+    chi2_prev = {}
+    try:
+        for nx in range(int(max_ncomps), 1, -1):
+            nfree = max(1, npts - (nx-1 if sum_to_one else nx))
+            redchis = sorted(val[0] for val in kept.values())
+            worst = np.inf
+            if len(redchis) >= max_output:
+                worst = redchis[max_output-1]
+            chi2_this, todo = {}, []
+            for subset in combinations(range(ncomps), nx):
+                if prune and len(chi2_prev) > 0:
+                    chi2_min = max(chi2_prev.get(tuple(sorted(subset + (j,))), 0)
+                                   for j in range(ncomps) if j not in subset)
+                    if chi2_min/nfree > worst:
+                        chi2_this[subset] = chi2_min
+                        continue
+                todo.append(subset)
+
+            if executor is None:
+                solved = _solve_subsets(state, todo)
+            else:
+                nchunk = max(1, len(todo)//(4*nworkers))
+                chunks = [todo[i:i+nchunk] for i in range(0, len(todo), nchunk)]
+                solved = [out for chunk in executor.map(_lincombo_worker_solve, chunks)
+                          for out in chunk]
+
+            for subset, (wts, chisqr) in zip(todo, solved):
+                if wts is None:
+                    comps = [components[i] for i in subset]
+                    ret = lincombo_fit(group, comps, weights=[1.0/nx]*nx,
+                                       arrayname=arrayname,
+                                       minvals=list(minvals[list(subset)]),
+                                       maxvals=list(maxvals[list(subset)]),
+                                       xmin=xmin, xmax=xmax,
+                                       sum_to_one=sum_to_one, vary_e0=False)
+                    chi2_this[subset] = 0
+                    redchi, weights = ret.redchi, ret.weights
+                else:
+                    chi2_this[subset] = chisqr
+                    redchi, ret = chisqr/nfree, wts
+                    weights = {labels[i]: wt for i, wt in zip(subset, wts)}
+                sig_comps = tuple(sorted(key for key, wt in weights.items()
+                                         if wt > min_weight))
+                if sig_comps not in kept or redchi < kept[sig_comps][0]:
+                    kept[sig_comps] = (redchi, subset, ret)
+            chi2_prev = chi2_this
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    out = []
+    for redchi, subset, ret in sorted(kept.values(), key=lambda x: x[0])[:max_output]:
+        if not isinstance(ret, Group):
+            sub = list(subset)
+            ret = _lincombo_result(xdat, ydat, ycomps[:, sub],
+                                   [labels[i] for i in sub], ret,
+                                   minvals[sub], maxvals[sub], sum_to_one,
+                                   arrayname, xmin, xmax)
+        out.append(ret)
+    return sorted(out, key=lambda x: x.redchi)
+
+
+def _lincombo_fitall_lmfit(group, components, minvals, maxvals,
+                           arrayname='norm', xmin=-np.inf, xmax=np.inf,
+                           max_ncomps=None, sum_to_one=True, vary_e0=False,
+                           min_weight=0.0005, max_output=16):
+    """lincombo_fitall() with lincombo_fit() for each combination,
+    as needed when varying e0"""
+    # here we save the bounds for each component by name
+    # so they can be imposed for the individual fits
+    _save = {}
+    for i, comp in enumerate(components):
+        _save[get_label(comp)] = (minvals[i], maxvals[i])
+
     out = []
     nrejected = 0
     comps_kept = []
@@ -273,8 +587,8 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
         for comps in combinations(components, nx):
             labs = [get_label(c) for c in comps]
             _wts = [1.0/nx for lab in labs]
-            _min = [_save[lab][1] for lab in labs]
-            _max = [_save[lab][2] for lab in labs]
+            _min = [_save[lab][0] for lab in labs]
+            _max = [_save[lab][1] for lab in labs]
 
             ret = lincombo_fit(group, comps, weights=_wts,
                                arrayname=arrayname, minvals=_min,
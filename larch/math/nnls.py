@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Non-negative least-squares for many right-hand sides at once.
+
+This uses the fast combinatorial active-set method of Van Benthem and
+Keenan (J. Chemometrics 18, p441, 2004): the Lawson-Hanson active-set
+algorithm is run for all columns of B together, working with the normal
+equations (A^T A) x = A^T b, and with all columns that have the same set
+of passive (non-zero) variables solved with a single factorization.
+"""
+from warnings import warn
+import numpy as np
+
+
+def _passive_solve(AtA, AtB, passive):
+    """solve AtA[p,p] x[p] = AtB[p] for each column, with p = passive
+    set for that column, and x = 0 outside the passive set"""
+    nvar, ncol = AtB.shape
+    out = np.zeros((nvar, ncol))
+    if ncol == 0:
+        return out
+    # group columns with identical passive sets
+    patterns, index = np.unique(passive.T, axis=0, return_inverse=True)
+    index = index.ravel()
+    for ipat, pattern in enumerate(patterns):
+        if not pattern.any():
+            continue
+        cols = np.where(index == ipat)[0]
+        sub = AtA[np.ix_(pattern, pattern)]
+        rhs = AtB[pattern][:, cols]
+        try:
+            sol = np.linalg.solve(sub, rhs)
+        except np.linalg.LinAlgError:
+            sol = np.linalg.lstsq(sub, rhs, rcond=None)[0]
+        out[np.ix_(pattern, cols)] = sol
+    return out
+
+
+def nnls_normal(AtA, AtB, maxiter=None, tol=None):
+    """non-negative least-squares solutions x >= 0 of (A^T A) x = A^T b,
+    for all columns b of B.
+
+    Parameters:
+    -----------
+      AtA:      (nvar, nvar) array A^T A
+      AtB:      (nvar,) or (nvar, ncol) array A^T B
+      maxiter:  maximum number of iterations [10*nvar]
+      tol:      tolerance for optimality of solution [estimated from AtA]
+
+    Returns:
+    --------
+      x: array of shape of AtB, with solutions for each column
+
+    Notes:
+    ------
+      If maxiter is reached before all solutions are optimal, a
+      RuntimeWarning is issued, and the returned values (clipped to be
+      non-negative) are not least-squares solutions for those columns.
+    """
+    AtA = np.asarray(AtA, dtype='float64')
+    AtB = np.asarray(AtB, dtype='float64')
+    vector = AtB.ndim == 1
+    if vector:
+        AtB = AtB.reshape((-1, 1))
+    nvar, ncol = AtB.shape
+    if maxiter is None:
+        maxiter = 10*nvar
+    if tol is None:
+        tol = 10*np.finfo(float).eps*np.abs(AtA).sum(axis=0).max()*nvar
+
+    # start with the unconstrained solution, keeping positive variables
+    x = _passive_solve(AtA, AtB, np.ones((nvar, ncol), dtype=bool))
+    passive = x > 0
+    x[~passive] = 0
+    d = x.copy()
+    # columns that may not be optimal yet
+    fset = np.where(~passive.all(axis=0))[0]
+    hset = fset[:0]
+    niter = 0
+    while len(fset) > 0 and niter < maxiter:
+        niter += 1
+        x[:, fset] = _passive_solve(AtA, AtB[:, fset], passive[:, fset])
+        # inner loop: move infeasible solutions back to the feasible region
+        hset = fset[(x[:, fset] < 0).any(axis=0)]
+        while len(hset) > 0 and niter < maxiter:
+            niter += 1
+            xh, dh = x[:, hset], d[:, hset]
+            neg = passive[:, hset] & (xh < 0)
+            alpha = np.full(xh.shape, np.inf)
+            alpha[neg] = dh[neg] / (dh[neg] - xh[neg])
+            imin = alpha.argmin(axis=0)
+            amin = alpha[imin, np.arange(len(hset))]
+            d[:, hset] = dh - amin*(dh - xh)
+            d[imin, hset] = 0
+            passive[imin, hset] = False
+            x[:, hset] = _passive_solve(AtA, AtB[:, hset], passive[:, hset])
+            hset = hset[(x[:, hset] < 0).any(axis=0)]
+
+        # check optimality with the gradient (Lagrange multipliers)
+        grad = AtB[:, fset] - AtA @ x[:, fset]
+        grad[passive[:, fset]] = -np.inf
+        optimal = (grad <= tol).all(axis=0)
+        fset, grad = fset[~optimal], grad[:, ~optimal]
+        if len(fset) > 0:
+            passive[grad.argmax(axis=0), fset] = True
+            d[:, fset] = x[:, fset]
+    unfinished = np.union1d(fset, hset)
+    if len(unfinished) > 0:
+        warn('nnls_normal: maximum number of iterations (%d) reached, '
+             'solutions for %d of %d columns are not optimal'
+             % (maxiter, len(unfinished), ncol), RuntimeWarning, stacklevel=2)
+    x[~passive] = 0
+    x = np.maximum(x, 0)
+    return x[:, 0] if vector else x
+
+
+def nnls_batch(A, B, maxiter=None, tol=None):
+    """non-negative least-squares solutions x >= 0 of A x = b, for all
+    columns b of B, as scipy.optimize.nnls() does for a single b.
+
+    Parameters:
+    -----------
+      A:        (m, nvar) array
+      B:        (m,) or (m, ncol) array
+      maxiter:  maximum number of iterations [10*nvar]
+      tol:      tolerance for optimality of solution [estimated from A]
+
+    Returns:
+    --------
+      x: (nvar,) or (nvar, ncol) array of solutions
+    """
+    A = np.asarray(A, dtype='float64')
+    return nnls_normal(A.T @ A, A.T @ np.asarray(B, dtype='float64'),
+                       maxiter=maxiter, tol=tol)
@@ -110,9 +110,9 @@ class XRFAnalysisPanel(scrolled.ScrolledPanel):
                         f"overwrite group '{workname:s}'?", style=wx.YES_NO)
             if ret != wx.ID_YES: return
 
-        cmd = """weights = _xrfresults[{cfit:d}].decompose_map({groupname:s}.xrmmap['mcasum/counts'],
-        scale={scale:.6f}, pixel_time={ptime:.5f},method='{method:s}')
-{groupname:s}.add_work_arrays(weights, parent='{workname:s}')
+        cmd = """_xrfresults[{cfit:d}].decompose_mapfile({groupname:s}, scale={scale:.6f},
+        pixel_time={ptime:.5f}, method='{method:s}', parent='{workname:s}',
+        overwrite=True)
         """
         cmd = cmd.format(cfit=cfit, groupname=xrmfile.groupname, ptime=xrmfile.pixeltime,
                          workname=workname, scale=scale, method=method)
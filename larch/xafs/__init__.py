@@ -6,12 +6,15 @@ The functions here include (but are not limited to):
 function         description
 ------------     ------------------------------
 pre_edge         pre_edge subtraction, normalization
+pre_edge_batch   pre_edge subtraction, normalization for a set of spectra
 autobk           XAFS background subtraction (mu(E) to chi(k))
+autobk_batch     XAFS background subtraction for a set of spectra
 xftf             forward XAFS Fourier transform (k -> R)
 xftr             backward XAFS Fourier transform, Filter (R -> q)
 ftwindow         create XAFS Fourier transform window
 
 feffpath         create a Feff Path from a feffNNNN.dat file
+read_feffdat_folder  read all feffNNNN.dat files in a Feff folder, with caching
 path2chi         convert a single Feff Path to chi(k)
 ff2chi           sum a set of Feff Paths to chi(k)
 
@@ -24,20 +27,23 @@ feffit_report    create a report from feffit() results
 
 from .xafsutils import KTOE, ETOK, set_xafsGroup, etok, ktoe, guess_energy_units
 from .xafsft import xftf, xftr, xftf_fast, xftr_fast, ftwindow, xftf_prep
-from .pre_edge import pre_edge, preedge, find_e0, energy_align, find_energy_step
+from .pre_edge import (pre_edge, preedge, find_e0, energy_align, find_energy_step,
+                       pre_edge_batch, preedge_batch, find_e0_batch)
 from .prepeaks import prepeaks_setup, pre_edge_baseline, prepeaks_fit
-from .feffdat import FeffDatFile, FeffPathGroup, feffpath, path2chi, ff2chi, use_feffpath
+from .feffdat import (FeffDatFile, FeffPathGroup, feffpath, path2chi, ff2chi,
+                      use_feffpath, read_feffdat_folder)
 from .feffit import (FeffitDataSet, TransformGroup, feffit,
                      feffit_dataset, feffit_transform, feffit_report)
 
-from .autobk import autobk, autobk_lmfit, autobk_delta_chi
+from .autobk import autobk, autobk_batch, autobk_lmfit, autobk_delta_chi
 from .mback import mback, mback_norm
 from .diffkk import diffkk, diffKKGroup
 from .fluo import fluo_corr
 
 ## from .cif2feff import cif_sites, cif2feff6l
 
-from .feffrunner import FeffRunner, feffrunner, feff6l, feff8l, find_exe
+from .feffrunner import (FeffRunner, FeffJobFarm, feffrunner, feff6l, feff8l,
+                         find_exe, run_feff_jobs)
 from .feff8lpath import feff8_xafs
 from .feffutils import get_feff_pathinfo
 
@@ -58,7 +64,8 @@ def _larch_init(_larch):
 _larch_groups = (diffKKGroup, FeffRunner, FeffDatFile, FeffPathGroup,
                  TransformGroup, FeffitDataSet)
 
-_larch_builtins = {'_xafs': dict(autobk=autobk, autobk_lmfit=autobk_lmfit,
+_larch_builtins = {'_xafs': dict(autobk=autobk, autobk_batch=autobk_batch,
+                                 autobk_lmfit=autobk_lmfit,
                                  autobk_delta_chi=autobk_delta_chi,
                                  etok=etok, ktoe=ktoe,
                                  guess_energy_units=guess_energy_units,
@@ -66,6 +73,8 @@ _larch_builtins = {'_xafs': dict(autobk=autobk, autobk_lmfit=autobk_lmfit,
                                  xftf_prep=xftf_prep, xftf_fast=xftf_fast,
                                  xftr_fast=xftr_fast, ftwindow=ftwindow,
                                  find_e0=find_e0, pre_edge=pre_edge,
+                                 find_e0_batch=find_e0_batch,
+                                 pre_edge_batch=pre_edge_batch,
                                  find_energy_step=find_energy_step,
                                  energy_align=energy_align,
                                  prepeaks_setup=prepeaks_setup,
@@ -86,9 +95,10 @@ _larch_builtins = {'_xafs': dict(autobk=autobk, autobk_lmfit=autobk_lmfit,
                                  feffit_transform=feffit_transform,
                                  feffit_report=feffit_report,
                                  feffrunner=feffrunner, feff6l=feff6l,
-                                 feff8l=feff8l,
+                                 feff8l=feff8l, run_feff_jobs=run_feff_jobs,
                                  feffpath= feffpath,
                                  use_feffpath= use_feffpath,
+                                 read_feffdat_folder=read_feffdat_folder,
                                  path2chi=path2chi, ff2chi=ff2chi,
                                  feff8_xafs=feff8_xafs,
                                  get_feff_pathinfo=get_feff_pathinfo)}
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from scipy.interpolate import splrep, splev, UnivariateSpline
+from scipy.interpolate import (splrep, splev, UnivariateSpline, BSpline,
+                               make_interp_spline)
 from scipy.stats import t
 from scipy.special import erf
 from scipy.optimize import leastsq
@@ -34,6 +36,22 @@ def _resid(vcoefs, ncoef, kraw, mu, chi_std, knots, order, kout,
     coefs = np.ones(ncoef)*vcoefs[-1]
     coefs[:nspl] = vcoefs
     bkg, chi = spline_eval(kraw, mu, knots, coefs, order, kout)
+    return _chi_resid(chi, chi_std, ftwin, nfft, irbkg,
+                      nclamp, clamp_lo, clamp_hi)
+
+def _resid_linear(vcoefs, chi_mu, chi_basis, chi_std,
+                  ftwin, nfft, irbkg, nclamp, clamp_lo, clamp_hi):
+    """autobk residual, using precomputed arrays for chi(k):
+    with fixed knots, both bkg(kraw) and the interpolation of mu-bkg
+    onto kout are linear, so that chi = chi_mu - chi_basis @ coefs"""
+    global NFEV
+    NFEV += 1
+    chi = chi_mu - chi_basis@vcoefs
+    return _chi_resid(chi, chi_std, ftwin, nfft, irbkg,
+                      nclamp, clamp_lo, clamp_hi)
+
+def _chi_resid(chi, chi_std, ftwin, nfft, irbkg, nclamp, clamp_lo, clamp_hi):
+    """low-R part of chi(R) and end-point clamps, for the autobk residual"""
     if chi_std is not None:
         chi = chi - chi_std
     out =  realimag(xftf_fast(chi*ftwin, nfft=nfft)[:irbkg])
@@ -45,12 +63,40 @@ def _resid(vcoefs, ncoef, kraw, mu, chi_std, knots, order, kout,
                             abs(clamp_hi)*scale*chi[-nclamp:]))
 
 
+def _autobk_edge(energy, mu, group, ek0=None, edge_step=None,
+                 pre_edge_kws=None, _larch=None):
+    """ek0 and edge_step for autobk: either as given, from the group,
+    or from running pre_edge()"""
+    if edge_step is None and isgroup(group, 'edge_step'):
+        edge_step = group.edge_step
+    if ek0 is None and isgroup(group, 'ek0'):
+        ek0 = group.ek0
+    if ek0 is None and isgroup(group, 'e0'):
+        ek0 = group.e0
+
+    if ek0 is not None and (ek0 < energy.min() or ek0 > energy.max()):
+        ek0 = None
+    if ek0 is None or edge_step is None:
+        # need to run pre_edge:
+        pre_kws = dict(nnorm=None, nvict=0, pre1=None,
+                       pre2=None, norm1=None, norm2=None)
+        if pre_edge_kws is not None:
+            pre_kws.update(pre_edge_kws)
+        pre_edge(energy, mu, group=group, _larch=_larch, **pre_kws)
+        if ek0 is None:
+            ek0 = group.e0
+        if edge_step is None:
+            edge_step = group.edge_step
+    return ek0, edge_step
+
+
 @Make_CallArgs(["energy" ,"mu"])
 def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
            edge_step=None, kmin=0, kmax=None, kweight=1, dk=0.1,
            win='hanning', k_std=None, chi_std=None, nfft=2048, kstep=0.05,
            pre_edge_kws=None, nclamp=3, clamp_lo=0, clamp_hi=1,
-           calc_uncertainties=False, err_sigma=1, _larch=None, **kws):
+           calc_uncertainties=False, err_sigma=1, fast=True, _larch=None,
+           **kws):
     """Use Autobk algorithm to remove XAFS background
 
     Parameters:
@@ -80,6 +126,8 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
       calc_uncertaintites:  Flag to calculate uncertainties in
                             mu_0(E) and chi(k) [True]
       err_sigma: sigma level for uncertainties in mu_0(E) and chi(k) [1]
+      fast:      Flag to use precomputed matrices for bkg(k) and chi(k) in
+                 the fit residual, instead of re-building splines [True]
 
     Output arrays are written to the provided group.
 
@@ -106,32 +154,38 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
     # passed-in group or from running pre_edge()
     group = set_xafsGroup(group, _larch=_larch)
 
-    if edge_step is None and isgroup(group, 'edge_step'):
-        edge_step = group.edge_step
     if e0 is not None and ek0 is None:  # command-line e0 still valid
         ek0 = e0
-    if ek0 is None and isgroup(group, 'ek0'):
-        ek0 = group.ek0
-    if ek0 is None and isgroup(group, 'e0'):
-        ek0 = group.e0
-
-    if ek0 is not None and (ek0 < energy.min() or ek0 > energy.max()):
-        ek0 = None
-    if ek0 is None or edge_step is None:
-        # need to run pre_edge:
-        pre_kws = dict(nnorm=None, nvict=0, pre1=None,
-                       pre2=None, norm1=None, norm2=None)
-        if pre_edge_kws is not None:
-            pre_kws.update(pre_edge_kws)
-        pre_edge(energy, mu, group=group, _larch=_larch, **pre_kws)
-        if ek0 is None:
-            ek0 = group.e0
-        if edge_step is None:
-            edge_step = group.edge_step
+    ek0, edge_step = _autobk_edge(energy, mu, group, ek0=ek0,
+                                  edge_step=edge_step,
+                                  pre_edge_kws=pre_edge_kws, _larch=_larch)
     if ek0 is None or edge_step is None:
         msg('autobk() could not determine ek0 or edge_step!: trying running pre_edge first\n')
         return
 
+    grid = _autobk_grid(energy, ek0, rbkg=rbkg, nknots=nknots, kmin=kmin,
+                        kmax=kmax, kweight=kweight, dk=dk, win=win,
+                        nfft=nfft, kstep=kstep)
+    # interpolate provided chi(k) onto the kout grid
+    if chi_std is not None and k_std is not None:
+        chi_std = np.interp(grid.kout, k_std, chi_std)
+
+    fit = _autobk_fit(grid, mu, chi_std=chi_std, nclamp=nclamp,
+                      clamp_lo=clamp_lo, clamp_hi=clamp_hi, fast=fast)
+
+    group = set_xafsGroup(group, _larch=_larch)
+    _autobk_output(group, grid, fit, mu, edge_step)
+    if  calc_uncertainties and fit.covar is not None:
+        autobk_delta_chi(group, err_sigma=err_sigma)
+
+
+def _autobk_grid(energy, ek0, rbkg=1, nknots=None, kmin=0, kmax=None,
+                 kweight=1, dk=0.1, win='hanning', nfft=2048, kstep=0.05):
+    """k grids, FT window, spline knots and B-spline basis for autobk.
+
+    These depend only on the energy array and the background parameters,
+    not on mu(E), and so can be shared by spectra on the same energy grid.
+    """
     # get array indices for rkbg and ek0: irbkg, iek0
     iek0 = index_of(energy, ek0)
     rgrid = np.pi/(kstep*nfft)
@@ -148,53 +202,75 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
     kout  = kstep * np.arange(int(1.01+kmax/kstep), dtype='float64')
     iemax = min(len(energy), 2+index_of(energy, ek0+kmax*kmax/ETOK)) - 1
 
-    # interpolate provided chi(k) onto the kout grid
-    if chi_std is not None and k_std is not None:
-        chi_std = np.interp(kout, k_std, chi_std)
     # pre-load FT window
     ftwin = kout**kweight * ftwindow(kout, xmin=kmin, xmax=kmax,
                                      window=win, dx=dk, dx2=dk)
-    # calc k-value and initial guess for y-values of spline params
+    # calc k-value and indices for initial guess for y-values of spline params
     nspl = 1 + int(2*rbkg*(kmax-kmin)/np.pi)
     irbkg = int(1 + (nspl-1)*np.pi/(2*rgrid*(kmax-kmin)))
     if nknots is not None:
         nspl = nknots
     nspl = max(5, min(128, nspl))
-    spl_y, spl_k  = np.ones(nspl), np.zeros(nspl)
-
+    spl_k = np.zeros(nspl)
+    spl_index = np.zeros((3, nspl), dtype=int)
     for i in range(nspl):
         q  = kmin + i*(kmax-kmin)/(nspl - 1)
         ik = index_nearest(kraw, q)
         i1 = min(len(kraw)-1, ik + 5)
         i2 = max(0, ik - 5)
         spl_k[i] = kraw[ik]
-        spl_y[i] = (2*mu[ik+iek0] + mu[i1+iek0] + mu[i2+iek0] ) / 4.0
+        spl_index[:, i] = (ik+iek0, i1+iek0, i2+iek0)
 
+    # for an interpolating spline, the knots depend only on spl_k
     order = 3
-    qmin, qmax  = spl_k[0], spl_k[nspl-1]
-    knots = [spl_k[0] - 1.e-4*(order-i) for i in range(order)]
+    knots = splrep(spl_k, np.ones(nspl), k=order)[0]
+
+    # bkg(kraw) = bkg_basis @ coefs[:nspl].  As the interpolating spline
+    # onto kout is linear in the data, the spline of bkg onto kout is
+    # chi_basis @ coefs[:nspl]
+    kraw_ = kraw[:iemax-iek0+1]
+    bkg_basis = BSpline(knots, np.eye(nspl), order)(kraw_)
+    chi_basis = make_interp_spline(kraw_, bkg_basis, k=order)(kout)
+
+    return Group(iek0=iek0, iemax=iemax, ek0=ek0, rbkg=rbkg, kmin=kmin,
+                 kmax=kmax, kraw=kraw, kout=kout, ftwin=ftwin, nfft=nfft,
+                 nspl=nspl, irbkg=irbkg, spl_k=spl_k, spl_index=spl_index,
+                 knots=knots, order=order, bkg_basis=bkg_basis,
+                 chi_basis=chi_basis)
 
-    for i in range(order, nspl):
-        knots.append((i-order)*(qmax - qmin)/(nspl-order+1))
-    qlast = knots[-1]
-    for i in range(order+1):
-        knots.append(qlast + 1.e-4*(i+1))
+
+def _autobk_fit(grid, mu, chi_std=None, nclamp=3, clamp_lo=0, clamp_hi=1,
+                fast=False):
+    """fit spline coefficients for mu(E) on a grid from _autobk_grid(),
+    using the precomputed matrices for chi(k) if fast is True"""
+    nspl, order, iek0, iemax = grid.nspl, grid.order, grid.iek0, grid.iemax
+    i0, i1, i2 = grid.spl_index
+    spl_y = (2*mu[i0] + mu[i1] + mu[i2]) / 4.0
 
     # coefs = [mu[index_nearest(energy, ek0 + q**2/ETOK)] for q in knots]
-    knots, coefs, order = splrep(spl_k, spl_y, k=order)
+    knots, coefs, order = splrep(grid.spl_k, spl_y, k=order)
     coefs[nspl:] = coefs[nspl-1]
     ncoefs = len(coefs)
-    kraw_ = kraw[:iemax-iek0+1]
+    kraw_ = grid.kraw[:iemax-iek0+1]
     mu_  = mu[iek0:iemax+1]
-    initbkg, initchi = spline_eval(kraw_, mu_, knots, coefs, order, kout)
+    initbkg, initchi = spline_eval(kraw_, mu_, knots, coefs, order, grid.kout)
     global NFEV
     NFEV = 0
 
     vcoefs = 1.0*coefs[:nspl]
-    userargs = (len(coefs), kraw_, mu_, chi_std, knots, order, kout,
-               ftwin, nfft, irbkg, nclamp, clamp_lo, clamp_hi)
+    if fast:
+        resid = _resid_linear
+        chi_mu = UnivariateSpline(kraw_, mu_, s=0)(grid.kout)
+        userargs = (chi_mu, grid.chi_basis, chi_std,
+                    grid.ftwin, grid.nfft, grid.irbkg, nclamp,
+                    clamp_lo, clamp_hi)
+    else:
+        resid = _resid
+        userargs = (len(coefs), kraw_, mu_, chi_std, knots, order, grid.kout,
+                    grid.ftwin, grid.nfft, grid.irbkg, nclamp,
+                    clamp_lo, clamp_hi)
 
-    lsout = leastsq(_resid, vcoefs, userargs, maxfev=2000*(ncoefs+1),
+    lsout = leastsq(resid, vcoefs, userargs, maxfev=2000*(ncoefs+1),
                     gtol=0.0, ftol=1.e-6, xtol=1.e-6, epsfcn=1.e-6,
                     full_output=1, col_deriv=0, factor=100, diag=None)
 
@@ -203,40 +279,142 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
     final_coefs[:nspl] = best[:]
     final_coefs[nspl:] = best[-1]
 
-    chisqr = ((_resid(best, *userargs))**2).sum()
-    redchi = chisqr / (2*irbkg+2*nclamp - nspl)
+    chisqr = ((resid(best, *userargs))**2).sum()
+    redchi = chisqr / (2*grid.irbkg+2*nclamp - nspl)
 
     coefs_std = np.array([np.sqrt(redchi*covar[i, i]) for i in range(nspl)])
-    bkg, chi = spline_eval(kraw[:iemax-iek0+1], mu[iek0:iemax+1],
-                           knots, final_coefs, order, kout)
+    bkg, chi = spline_eval(kraw_, mu_, knots, final_coefs, order, grid.kout)
+    return Group(bkg=bkg, chi=chi, initbkg=initbkg, initchi=initchi,
+                 spl_y=spl_y, knots=knots, coefs=final_coefs,
+                 coefs_std=coefs_std, covar=covar, chisqr=chisqr,
+                 redchi=redchi)
+
+
+def _autobk_output(group, grid, fit, mu, edge_step):
+    """write autobk results for mu(E) to group"""
+    iek0, bkg = grid.iek0, fit.bkg
     obkg = mu[:]*1.0
     obkg[iek0:iek0+len(bkg)] = bkg
 
     # outputs to group
-    group = set_xafsGroup(group, _larch=_larch)
     group.bkg  = obkg
     group.chie = (mu-obkg)/edge_step
-    group.k    = kout
-    group.chi  = chi/edge_step
-    group.ek0  = ek0
-    group.rbkg = rbkg
+    group.k    = grid.kout
+    group.chi  = fit.chi/edge_step
+    group.ek0  = grid.ek0
+    group.rbkg = grid.rbkg
 
-    knots_y  = np.array([coefs[i] for i in range(nspl)])
+    knots_y  = np.array([fit.coefs[i] for i in range(grid.nspl)])
     init_bkg = mu[:]*1.0
-    init_bkg[iek0:iek0+len(bkg)] = initbkg
+    init_bkg[iek0:iek0+len(bkg)] = fit.initbkg
     # now fill in 'autobk_details' group
 
-    group.autobk_details = Group(kmin=kmin, kmax=kmax, irbkg=irbkg,
-                                 nknots=len(spl_k), knots=knots, order=order,
-                                 init_knots_y=spl_y, nspl=nspl,
-                                 init_chi=initchi/edge_step, coefs=final_coefs,
-                                 coefs_std=coefs_std, iek0=iek0, iemax=iemax,
-                                 ek0=ek0, covar=covar, chisqr=chisqr,
-                                 redchi=redchi, init_bkg=init_bkg,
-                                 knots_y=knots_y, kraw=kraw, mu=mu)
+    group.autobk_details = Group(kmin=grid.kmin, kmax=grid.kmax,
+                                 irbkg=grid.irbkg, nknots=len(grid.spl_k),
+                                 knots=fit.knots, order=grid.order,
+                                 init_knots_y=fit.spl_y, nspl=grid.nspl,
+                                 init_chi=fit.initchi/edge_step,
+                                 coefs=fit.coefs, coefs_std=fit.coefs_std,
+                                 iek0=iek0, iemax=grid.iemax, ek0=grid.ek0,
+                                 covar=fit.covar, chisqr=fit.chisqr,
+                                 redchi=fit.redchi, init_bkg=init_bkg,
+                                 knots_y=knots_y, kraw=grid.kraw, mu=mu)
+
+
+def _autobk_batch_fit(args):
+    """fit one spectrum for autobk_batch(), in this or a worker process"""
+    grid, mu, chi_std, nclamp, clamp_lo, clamp_hi = args
+    return _autobk_fit(grid, mu, chi_std=chi_std, nclamp=nclamp,
+                       clamp_lo=clamp_lo, clamp_hi=clamp_hi, fast=True)
+
+
+def autobk_batch(energy, mu, groups=None, rbkg=1, nknots=None, e0=None,
+                 ek0=None, edge_step=None, kmin=0, kmax=None, kweight=1,
+                 dk=0.1, win='hanning', k_std=None, chi_std=None, nfft=2048,
+                 kstep=0.05, pre_edge_kws=None, nclamp=3, clamp_lo=0,
+                 clamp_hi=1, calc_uncertainties=False, err_sigma=1,
+                 nworkers=1, _larch=None, **kws):
+    """Use Autobk algorithm to remove XAFS background for a set of spectra
 
-    if  calc_uncertainties and covar is not None:
-        autobk_delta_chi(group, err_sigma=err_sigma)
+    Parameters:
+    -----------
+      energy:    1-d array of x-ray energies, in eV, for all spectra, or
+                 list (or 2-d array) of energy arrays, one per spectrum.
+      mu:        2-d array (nspectra, npts) or list of 1-d arrays of mu(E)
+      groups:    list of output groups (and input groups for e0 and
+                 edge_step), one per spectrum.  If None, new groups
+                 will be created.
+      ek0:       edge energy, in eV, or list of edge energies, one per
+                 spectrum.  If None, they will be determined.
+      edge_step: edge step or list of edge steps.  If None, they will be
+                 determined.
+      nworkers:  number of worker processes to use for the fits [1]
+
+      all other arguments are as for autobk().
+
+    Returns:
+    --------
+      list of groups, with outputs written as by autobk().
+
+    Notes:
+    ------
+      The k grids, FT window, and B-spline basis for the background are
+      calculated once for each distinct energy array and ek0, and shared
+      by all spectra with those values.
+    """
+    if 'kw' in kws:
+        kweight = kws.pop('kw')
+    if len(kws) > 0:
+        raise TypeError('Unrecognized arguments for autobk_batch(): %s'
+                        % (', '.join(kws.keys())))
+
+    mu = [np.asarray(m).squeeze() for m in mu]
+    nspectra = len(mu)
+    if isinstance(energy, np.ndarray) and energy.ndim == 1:
+        energy = [energy]*nspectra
+    if groups is None:
+        groups = [None]*nspectra
+    if len(energy) != nspectra or len(groups) != nspectra:
+        raise ValueError('autobk_batch() needs one energy array and one group per spectrum')
+    if e0 is not None and ek0 is None:
+        ek0 = e0
+
+    def _value(val, i):
+        return val[i] if isinstance(val, (list, tuple, np.ndarray)) else val
+
+    grids, edge_steps, tasks = {}, [], []
+    for i in range(nspectra):
+        en = remove_dups(np.asarray(energy[i]).squeeze(), tiny=TINY_ENERGY)
+        groups[i] = group = set_xafsGroup(groups[i], _larch=_larch)
+        _ek0, _step = _autobk_edge(en, mu[i], group, ek0=_value(ek0, i),
+                                   edge_step=_value(edge_step, i),
+                                   pre_edge_kws=pre_edge_kws, _larch=_larch)
+        if _ek0 is None or _step is None:
+            raise ValueError('autobk_batch() could not determine ek0 or edge_step for spectrum %d' % i)
+        key = (en.tobytes(), _ek0)
+        if key not in grids:
+            grids[key] = _autobk_grid(en, _ek0, rbkg=rbkg, nknots=nknots,
+                                      kmin=kmin, kmax=kmax, kweight=kweight,
+                                      dk=dk, win=win, nfft=nfft, kstep=kstep)
+        grid = grids[key]
+        _chi_std = chi_std
+        if chi_std is not None and k_std is not None:
+            _chi_std = np.interp(grid.kout, k_std, chi_std)
+        edge_steps.append(_step)
+        tasks.append((grid, mu[i], _chi_std, nclamp, clamp_lo, clamp_hi))
+
+    if nworkers > 1 and nspectra > 1:
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            fits = list(executor.map(_autobk_batch_fit, tasks,
+                                     chunksize=max(1, nspectra//(4*nworkers))))
+    else:
+        fits = [_autobk_batch_fit(task) for task in tasks]
+
+    for group, task, fit, _step in zip(groups, tasks, fits, edge_steps):
+        _autobk_output(group, task[0], fit, task[1], _step)
+        if calc_uncertainties and fit.covar is not None:
+            autobk_delta_chi(group, err_sigma=err_sigma)
+    return groups
 
 
 def autobk_delta_chi(group, err_sigma=1):
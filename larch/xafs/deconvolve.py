@@ -3,12 +3,13 @@
 #
 
 import numpy as np
-from scipy.signal import deconvolve
+from scipy.signal import deconvolve, fftconvolve
 from larch import parse_group_args, Make_CallArgs
 
 from larch.math import (gaussian, lorentzian, interp,
                         index_of, index_nearest, remove_dups,
                         savitzky_golay)
+from larch.math.convolution1D import conv_sparse
 
 from .xafsutils import set_xafsGroup, TINY_ENERGY
 
@@ -112,7 +113,9 @@ def xas_convolve(energy, norm=None, group=None, form='lorentzian',
     group:    output group
     form:     form of deconvolution function. One of
               'lorentzian' or  'gaussian' ['lorentzian']
-    esigma    energy sigma (in eV) to pass to gaussian() or lorentzian() [1.0]
+    esigma    energy sigma (in eV) to pass to gaussian() or lorentzian() [1.0],
+              or array of energy-dependent sigma values, one per energy
+              point (see Note 2).
     eshift    energy shift (in eV) to apply to result [0]
 
     Returns
@@ -122,34 +125,58 @@ def xas_convolve(energy, norm=None, group=None, form='lorentzian',
 
     Notes
     -----
-       Follows the First Argument Group convention, using group members named
-       'energy' and 'norm'
+      1. Follows the First Argument Group convention, using group members
+         named 'energy' and 'norm'
+      2. With an array for esigma, for example from lin_gamma() or
+         atan_gamma() (with FWHM = 2*esigma), the broadening is done with
+         a symmetric kernel of varying width, using conv_sparse(), and
+         with no added energy shift.  Lorentzian kernels extend to
+         +/- 50*esigma.  For a single value (or an array with a single
+         repeated value), the kernel is instead one-sided (zero below
+         its center), and the result is shifted by 0.5*esigma, so that
+         a constant width does not give the same result as a slightly
+         varying width.
     """
 
     energy, mu, group = parse_group_args(energy, members=('energy', 'norm'),
                                          defaults=(norm,), group=group,
                                          fcn_name='xas_convolve')
-    eshift = eshift + 0.5 * esigma
+    varwidth = np.ndim(esigma) > 0
+    if varwidth:
+        esigma = np.asarray(esigma, dtype='float64')
+        if np.ptp(esigma) == 0:
+            varwidth, esigma = False, float(esigma[0])
+    if not varwidth:
+        eshift = eshift + 0.5 * esigma
 
     en  = remove_dups(energy, tiny=TINY_ENERGY)
     en  = en - en[0]
     estep = max(0.001, 0.001*int(min(en[1:]-en[:-1])*1000.0))
 
-    npad = 1 + int(max(estep*2.01, 50*esigma)/estep)
+    npad = 1 + int(max(estep*2.01, 50*np.max(esigma))/estep)
 
     npts = npad  + int(max(en) / estep)
 
     x = np.arange(npts)*estep
     y = interp(en, mu, x, kind='cubic')
 
+    group = set_xafsGroup(group, _larch=_larch)
+    if varwidth:
+        sigma = np.interp(x, en, np.asarray(esigma, dtype='float64'))
+        # Lorentzian tails extend to 25*FWHM, as for the padding
+        krange = 1.5 if form.lower().startswith('g') else 25.0
+        ret = conv_sparse(x, y, 2*sigma, e_cut=x[0], kernel=form,
+                          kernel_range=krange)
+        group.conv = interp(x-eshift, ret, en, kind='cubic')
+        return
+
     kernel = lorentzian
     if form.lower().startswith('g'):
         kernel = gaussian
 
     k = kernel(x, center=0, sigma=esigma)
-    ret = np.convolve(y, k, mode='full')
+    ret = fftconvolve(y, k, mode='full')
 
     out = interp(x-eshift, ret[:len(x)], en, kind='cubic')
 
-    group = set_xafsGroup(group, _larch=_larch)
     group.conv = out / k.sum()
@@ -1,6 +1,7 @@
 import time
 import numpy as np
 from scipy.special import erfc
+from scipy.signal import fftconvolve
 
 from larch import Group
 from larch.math import interp
@@ -37,6 +38,8 @@ MAXORDER = 6
 ##
 ## I got 7.6 seconds and 76.1 seconds for 10 iterations of each.  Awesome!
 ##
+## see examples/xafs/diffkk_benchmark.py for timings of the vector and FFT forms.
+##
 
 
 ###
@@ -70,7 +73,7 @@ def kkmclf_sca(e, finp):
     fout = [0.0]*npts
     if npts >= 2:
         factor = FOPI * (e[npts-1] - e[0]) / (npts - 1)
-        nptsk = npts / 2
+        nptsk = npts // 2
         for i in range(npts):
             fout[i] = 0.0
             ei2 = e[i]*e[i]
@@ -105,7 +108,7 @@ def kkmclr_sca(e, finp):
     fout = [0.0]*npts
 
     factor = -FOPI * (e[npts-1] - e[0]) / (npts - 1)
-    nptsk  = npts / 2
+    nptsk  = npts // 2
     for i in range(npts):
         fout[i] = 0.0
         ei2 = e[i]*e[i]
@@ -120,9 +123,33 @@ def kkmclr_sca(e, finp):
     return fout
 
 ###
-###  These are vector forms of the MacLaurin series algorithm, adapted from Matt's code by Bruce
-###  They are about an order of magnitude faster.
+###  These are vector forms of the MacLaurin series algorithm, adapted from Matt's code by Bruce,
+###  now computed for blocks of energy points at a time.  They give the same sums as the
+###  scalar forms, and are much faster.
 ###
+KK_BLOCKSIZE = 256
+
+def _kkmcl_vector(e, finp, forward=True):
+    """MacLaurin series sums for the forward or reverse KK transform:
+    for each point i, the sum over all points j with parity opposite
+    to i of finp[j]*e[i]/(e[j]**2-e[i]**2) (forward) or
+    finp[j]*e[j]/(e[j]**2-e[i]**2) (reverse)"""
+    npts = len(e)
+    e = np.asarray(e, dtype='float64')
+    finp = np.asarray(finp, dtype='float64')
+    fout = np.zeros(npts)
+    e2 = e**2
+    for ipar in (0, 1):
+        irows = np.arange(ipar, npts, 2)
+        jcols = np.arange(1-ipar, npts, 2)
+        fcol = finp[jcols] if forward else e[jcols]*finp[jcols]
+        for i0 in range(0, len(irows), KK_BLOCKSIZE):
+            rows = irows[i0:i0+KK_BLOCKSIZE]
+            de2 = e2[jcols][np.newaxis, :] - e2[rows][:, np.newaxis]
+            fout[rows] = (fcol/de2).sum(axis=1)
+    if forward:
+        fout = fout * e
+    return fout
 
 def kkmclf(e, finp):
     """
@@ -130,8 +157,8 @@ def kkmclf(e, finp):
 
     arguments:
       e      energy array *must be on an even grid with an even number of points* [npts] (in)
-      finp   f'' array [npts] (in)
-      fout   f' array [npts] (out)
+      finp   f' array [npts] (in)
+      fout   f'' array [npts] (out)
     """
     npts = len(e)
     if npts != len(finp):
@@ -141,21 +168,8 @@ def kkmclf(e, finp):
     if npts % 2:
         Exception("Array has an odd number of elements for diff KK transform in kkmclr")
 
-    fout   = np.zeros(npts)
     factor = FOPI * (e[-1] - e[0]) / (npts-1)
-    ei2    = e**2
-    ioff   = np.mod(np.arange(npts), 2) - 1
-
-    nptsk  = int(npts/2)
-    k      = np.arange(nptsk)
-
-    for i in range(npts):
-        j    = 2*k + ioff[i]
-        de2  = e[j]**2 - ei2[i]
-        fout[i] = sum(finp[j]/de2)
-
-    fout = fout * factor
-    return fout
+    return factor * _kkmcl_vector(e, finp, forward=True)
 
 
 def kkmclr(e, finp):
@@ -164,8 +178,8 @@ def kkmclr(e, finp):
 
     arguments:
       e      energy array *must be on an even grid with an even number of points* [npts] (in)
-      finp   f' array [npts] (in)
-      fout   f'' array [npts] (out)
+      finp   f'' array [npts] (in)
+      fout   f' array [npts] (out)
     """
     npts = len(e)
     if npts != len(finp):
@@ -175,21 +189,77 @@ def kkmclr(e, finp):
     if npts % 2:
         Exception("Array has an odd number of elements for diff KK transform in kkmclr")
 
-    fout   = np.zeros(npts)
     factor = -FOPI * (e[-1] - e[0]) / (npts-1)
-    ei2    = e**2
-    ioff   = np.mod(np.arange(npts), 2) - 1
+    return factor * _kkmcl_vector(e, finp, forward=False)
 
-    nptsk  = int(npts/2)
-    k      = np.arange(nptsk)
+###
+###  FFT forms of the MacLaurin series algorithm.  On an even grid, e[j] = e[0] + j*de, the
+###  terms of the series separate into
+###      e[j]/(e[j]**2-e[i]**2) = (1/(e[j]-e[i]) + 1/(e[j]+e[i]))/2
+###      e[i]/(e[j]**2-e[i]**2) = (1/(e[j]-e[i]) - 1/(e[j]+e[i]))/2
+###  The first is the discrete Hilbert transform kernel 1/((j-i)*de), non-zero only for
+###  odd j-i, and the second depends only on i+j, so that both sums are convolutions that
+###  are done with FFTs in O(N log N) operations.
+###
 
-    for i in range(npts):
-        j    = 2*k + ioff[i]
-        de2  = e[j]**2 - ei2[i]
-        fout[i] = sum(e[j]*finp[j]/de2)
+def _kkmcl_fft(e, finp, forward=True):
+    """MacLaurin series sums for the forward or reverse KK transform,
+    as from _kkmcl_vector(), with FFT convolutions"""
+    npts = len(e)
+    e = np.asarray(e, dtype='float64')
+    finp = np.asarray(finp, dtype='float64')
+    de = (e[-1] - e[0]) / (npts-1)
+    if not np.allclose(np.diff(e), de, rtol=1.e-6, atol=0):
+        return _kkmcl_vector(e, finp, forward=forward)
+
+    # Hilbert kernel for j-i = -(npts-1), ..., npts-1, reversed for convolution
+    diff = np.arange(-(npts-1), npts)
+    hilb = np.zeros(len(diff))
+    odd = (diff % 2) == 1
+    hilb[odd] = -1.0/(diff[odd]*de)
+    terms = fftconvolve(finp, hilb)[npts-1:2*npts-1]
+
+    # kernel for i+j = 0, ..., 2*npts-2
+    isum = np.arange(2*npts-1)
+    hank = np.zeros(len(isum))
+    odd = (isum % 2) == 1
+    hank[odd] = 1.0/(2*e[0] + isum[odd]*de)
+    sums = fftconvolve(finp[::-1], hank)[npts-1:2*npts-1]
+    if forward:
+        return (terms - sums)/2.0
+    return (terms + sums)/2.0
+
+def kkmclf_fft(e, finp):
+    """
+    forward (f'->f'') kk transform, using maclaurin series algorithm,
+    with the sums done as FFT convolutions.
 
-    fout = fout * factor
-    return fout
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f' array [npts] (in)
+      fout   f'' array [npts] (out)
+
+    notes: the results are the same as from kkmclf(), to numerical precision.
+    """
+    npts = len(e)
+    factor = FOPI * (e[-1] - e[0]) / (npts-1)
+    return factor * _kkmcl_fft(e, finp, forward=True)
+
+def kkmclr_fft(e, finp):
+    """
+    reverse (f''->f') kk transform, using maclaurin series algorithm,
+    with the sums done as FFT convolutions.
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f'' array [npts] (in)
+      fout   f' array [npts] (out)
+
+    notes: the results are the same as from kkmclr(), to numerical precision.
+    """
+    npts = len(e)
+    factor = -FOPI * (e[-1] - e[0]) / (npts-1)
+    return factor * _kkmcl_fft(e, finp, forward=False)
 
 
 class diffKKGroup(Group):
@@ -211,7 +281,7 @@ class diffKKGroup(Group):
 
 
 # e0=None, z=None, edge=None, order=3, form='mback', whiteline=False, how=None
-    def kk(self, energy=None, mu=None, z=None, edge='K', how='scalar', mback_kws=None):
+    def kk(self, energy=None, mu=None, z=None, edge='K', how='fft', mback_kws=None):
         """
         Convert mu(E) data into f'(E) and f"(E).  f"(E) is made by
         matching mu(E) to the tabulated values of the imaginary part
@@ -225,6 +295,11 @@ class diffKKGroup(Group):
             z:          Z number of absorber
             edge:       absorption edge, usually 'K' or 'L3'
             mback_kws:  arguments for the mback algorithm
+            how:        method for the KK transform, one of
+                         'fft'      MacLaurin series, with sums done by FFT [default]
+                         'vector'   MacLaurin series, vectorized sums
+                         'scalar'   MacLaurin series, with python loops (slow!)
+                        all give the same results, to numerical precision.
 
           Returns
             self.f1, self.f2:  CL values over on the input energy grid
@@ -266,8 +341,11 @@ class diffKKGroup(Group):
         fpp = interp(self.energy, self.f2-self.fpp, self.grid, fill_value=0.0)
 
         ## do difference KK
-        if repr(how).startswith('sca'):
-            fp = kkmclr_sca(self.grid, fpp)
+        how = 'fft' if how is None else how.lower()
+        if how.startswith('sca'):
+            fp = np.array(kkmclr_sca(self.grid, fpp))
+        elif how.startswith('fft') or how.startswith('hil'):
+            fp = kkmclr_fft(self.grid, fpp)
         else:
             fp = kkmclr(self.grid, fpp)
 
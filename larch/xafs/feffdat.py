@@ -11,38 +11,179 @@ the path represented by the feffNNNN.dat
   group  = ff2chi(paths)
 
 creates a group that contains the chi(k) for the sum of paths.
+
+  out = read_feffdat_folder('feff_folder')
+
+reads all the feffNNNN.dat files in a Feff folder, using and updating
+a binary cache of the data so that later reads are fast.
 """
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 from copy import deepcopy
-from scipy.interpolate import UnivariateSpline
+from scipy.interpolate import CubicSpline, PPoly
 from lmfit import Parameters, Parameter
 
 from xraydb import atomic_mass, atomic_symbol
 
 from larch import Group, isNamedClass
+from larch.site_config import user_larchdir
 from larch.utils.strutils import fix_varname, b32hash
 from larch.fitting import group2params, dict2params, isParameter, param_value
 from .xafsutils import ETOK, ktoe, set_xafsGroup, gfmt
 from .sigma2_models import add_sigma2funcs
+from .pathparams import PATH_PARS, FEFFDAT_VALUES, eval_pathparams
 
 SMALL_ENERGY = 1.e-6
 
-PATH_PARS = ('degen', 's02', 'e0', 'ei', 'deltar', 'sigma2', 'third', 'fourth')
 FDAT_ARRS = ('real_phc', 'mag_feff', 'pha_feff', 'red_fact',
              'lam', 'rep', 'pha', 'amp', 'k')
+SPLINE_ARRS = ('pha', 'amp', 'rep', 'lam')
+
+# columns of data in feff.dat files
+FDAT_COLUMNS = ('k', 'real_phc', 'mag_feff', 'pha_feff', 'red_fact',
+                'lam', 'rep')
+
+# binary cache of feff.dat files, one cache file per Feff folder
+FEFFDAT_CACHE_DIR = os.path.join(user_larchdir, 'feffdat_cache')
+FEFFDAT_CACHE_VERSION = 2
+# FeffDatFile attributes stored by name in the cache, with the arrays
+# in FDAT_COLUMNS.  'pha' and 'amp' are calculated from those arrays.
+FEFFDAT_CACHE_ATTRS = ('title', 'version', 'shell', 'absorber', 'degen',
+                       'reff', 'nleg', 'rnorman', 'edge', 'gam_ch', 'exch',
+                       'vmu', 'vfermi', 'vint', 'rs_int', 'potentials', 'geom')
+_feffdat_caches = {}
+
+# FeffDataStores kept for re-use: at most FEFFDATA_STORES k grids, each
+# with at most FEFFDATA_STORE_ROWS rows.  A store that is full or removed
+# remains valid for the paths using it, but is not used for new paths.
+FEFFDATA_STORES = 16
+FEFFDATA_STORE_ROWS = 4096
+
+class FeffDataStore:
+    """Feff.dat data (pha, amp, rep, lam) for many paths on one k grid.
+
+    Data for all paths are held in `values`, an array of shape
+    (len(SPLINE_ARRS), npaths, nk), with the coefficients of cubic splines
+    through the data (not-a-knot, the same as UnivariateSpline with s=0)
+    in `coefs`, an array of shape (4, len(SPLINE_ARRS), npaths, nk-1).
+    Paths with identical data share a row.  Rows are never changed
+    or removed once added.
+
+    Use feffdata_store(k) to get the store for a k grid.
+    """
+    def __init__(self, k, size=8):
+        self.k = np.array(k, dtype='float64')
+        self.k.flags.writeable = False
+        self.nrows = 0
+        self._rows = {}
+        nk, nspl = len(self.k), len(SPLINE_ARRS)
+        # arrays with room for `size` rows, doubled when full
+        self._values = np.zeros((nspl, size, nk), dtype='float64')
+        self._coefs = np.zeros((4, nspl, size, nk-1), dtype='float64')
+        self._lock = threading.Lock()
+
+    def add(self, fdat):
+        """add the data for a FeffDatFile, returning its row"""
+        vals = np.array([getattr(fdat, attr) for attr in SPLINE_ARRS],
+                        dtype='float64')
+        key = hashlib.sha1(vals.tobytes()).hexdigest()
+        with self._lock:
+            row = self._rows.get(key, None)
+            if row is None:
+                row = self.nrows
+                if row >= self._values.shape[1]:
+                    self._grow()
+                self._values[:, row] = vals
+                coefs = CubicSpline(self.k, vals, axis=1).c
+                self._coefs[:, :, row] = coefs.transpose(0, 2, 1)
+                self._rows[key] = row
+                self.nrows += 1
+        return row
+
+    def _grow(self):
+        "double the number of rows allocated"
+        size = 2*self._values.shape[1]
+        values = np.zeros(self._values.shape[:1] + (size,) + self._values.shape[2:])
+        coefs = np.zeros(self._coefs.shape[:2] + (size,) + self._coefs.shape[3:])
+        values[:, :self.nrows] = self._values[:, :self.nrows]
+        coefs[:, :, :self.nrows] = self._coefs[:, :, :self.nrows]
+        self._values, self._coefs = values, coefs
 
-# values that will be available in calculations of Path Parameter values
-FEFFDAT_VALUES = ('reff', 'nleg', 'degen', 'rmass', 'rnorman',
-                  'gam_ch', 'rs_int', 'vint', 'vmu', 'vfermi')
+    @property
+    def values(self):
+        with self._lock:
+            return self._values[:, :self.nrows]
+
+    @property
+    def coefs(self):
+        with self._lock:
+            return self._coefs[:, :, :self.nrows]
+
+    def interp(self, rows, q, nu=0):
+        """cubic spline interpolation of the data for rows at values q
+
+        Parameters:
+        ------------
+          rows:  list of rows
+          q:     array of shape (nq,) or (len(rows), nq) of k values
+          nu:    order of derivative, 0 or 1 [0]
+
+        Returns:
+        ---------
+          array of shape (len(SPLINE_ARRS), len(rows), nq)
+        """
+        coefs = self.coefs
+        rows = np.asarray(rows).reshape(-1, 1)
+        q = np.atleast_2d(q)
+        idx = np.searchsorted(self.k, q, side='right') - 1
+        idx = np.clip(idx, 0, len(self.k)-2)
+        dx = q - self.k[idx]
+        c0, c1, c2, c3 = coefs[:, :, rows, idx]
+        if nu == 1:
+            return (3*c0*dx + 2*c1)*dx + c2
+        return ((c0*dx + c1)*dx + c2)*dx + c3
+
+    def splines(self, row):
+        """dict of scipy PPoly cubic splines for the data of a row"""
+        coefs = self.coefs
+        return {attr: PPoly(coefs[:, i, row], self.k)
+                for i, attr in enumerate(SPLINE_ARRS)}
+
+_feffdata_stores = OrderedDict()
+
+def feffdata_store(k):
+    """get the FeffDataStore for Feff.dat data on a k grid"""
+    key = np.asarray(k, dtype='float64').tobytes()
+    store = _feffdata_stores.get(key, None)
+    if store is None or store.nrows >= FEFFDATA_STORE_ROWS:
+        store = _feffdata_stores[key] = FeffDataStore(k)
+        while len(_feffdata_stores) > FEFFDATA_STORES:
+            _feffdata_stores.popitem(last=False)
+    _feffdata_stores.move_to_end(key)
+    return store
+
+def feffdata_stores_clear():
+    """clear the FeffDataStores kept for new paths.  Paths already
+    created keep their data"""
+    _feffdata_stores.clear()
 
 class FeffDatFile(Group):
-    def __init__(self, filename=None,  **kws):
+    def __init__(self, filename=None, use_cache=True, **kws):
         kwargs = dict(name='feff.dat: %s' % filename)
         kwargs.update(kws)
         Group.__init__(self,  **kwargs)
         if filename not in ('', None) and os.path.exists(filename):
-            self._read(filename)
+            attrs = None
+            if use_cache:
+                attrs = feffdat_cache_lookup(filename)
+            if attrs is None:
+                self._read(filename)
+            else:
+                self._set_from_dict(**attrs)
 
     def __repr__(self):
         if self.filename is not None:
@@ -212,6 +353,179 @@ class FeffDatFile(Group):
         self.__rmass = None  # reduced mass of path
 
 
+def _feffdat_cachefile(folder):
+    "name of cache file for a Feff folder"
+    folder = os.path.abspath(folder)
+    fhash = hashlib.sha1(folder.encode('utf-8')).hexdigest()[:24]
+    return os.path.join(FEFFDAT_CACHE_DIR, f'{fhash}.npz')
+
+def _file_signature(filename):
+    "(size, mtime) for a file, to check for changes"
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _file_hash(filename):
+    "hash of the contents of a file"
+    with open(filename, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+def _read_feffdat_cache(cachefile):
+    """read a feff.dat cache file, returning dict of entries keyed by
+    file name, with the data for each entry, or None"""
+    try:
+        sig = _file_signature(cachefile)
+    except OSError:
+        return None
+    cached = _feffdat_caches.get(cachefile, None)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    try:
+        with np.load(cachefile, allow_pickle=False) as npz:
+            index = json.loads(str(npz['index']))
+            data = npz['data']
+    except Exception:
+        return None
+    if index.get('version', None) != FEFFDAT_CACHE_VERSION:
+        return None
+    entries = {}
+    for entry in index['files']:
+        i0, i1 = entry['offset'], entry['offset'] + entry['npts']
+        entry['data'] = data[:, i0:i1]
+        entries[entry['name']] = entry
+    _feffdat_caches[cachefile] = (sig, entries)
+    return entries
+
+def _entry_valid(entry, filename):
+    "whether a cache entry is valid for a file, by size and mtime or hash"
+    try:
+        if entry['signature'] == _file_signature(filename):
+            return True
+        return entry['hash'] == _file_hash(filename)
+    except OSError:
+        return False
+
+def _entry_attrs(entry, filename):
+    "dict of FeffDatFile attributes, for _set_from_dict(), from a cache entry"
+    attrs = dict(entry['header'])
+    attrs['filename'] = filename
+    # potentials and geom are lists of tuples
+    attrs['potentials'] = [tuple(x) for x in attrs['potentials']]
+    attrs['geom'] = [tuple(x) for x in attrs['geom']]
+    attrs.update(zip(FDAT_COLUMNS, entry['data']))
+    attrs['pha'] = attrs['real_phc'] + attrs['pha_feff']
+    attrs['amp'] = attrs['mag_feff'] * attrs['red_fact']
+    return attrs
+
+def feffdat_cache_lookup(filename):
+    """look up a feff.dat file in the binary cache for its folder,
+    as written by read_feffdat_folder().
+
+    Returns dict of attributes for FeffDatFile, or None if the file
+    is not in the cache, or has changed since it was cached.
+    """
+    folder, fname = os.path.split(os.path.abspath(filename))
+    entries = _read_feffdat_cache(_feffdat_cachefile(folder))
+    if entries is None or fname not in entries:
+        return None
+    entry = entries[fname]
+    if not _entry_valid(entry, filename):
+        return None
+    return _entry_attrs(entry, filename)
+
+def read_feffdat_folder(folder, use_cache=True, write_cache=True):
+    """read all feffNNNN.dat files and paths.dat from a Feff folder.
+
+    Parameters:
+    ------------
+      folder:       name of Feff folder
+      use_cache:    whether to use cached data for files that have not
+                    changed [True]
+      write_cache:  whether to write the cache of data [True]
+
+    Returns:
+    ---------
+      group with `folder`, `feffdat` - a dict of {filename: FeffDatFile}
+      for the feffNNNN.dat files, and `paths_dat` - the text of paths.dat.
+
+    Notes:
+    ------
+      The cache is a single .npz file for each folder, in FEFFDAT_CACHE_DIR.
+      Entries for each file are checked by file size and modification time
+      or, if those have changed, by a hash of the file contents.  The cache
+      is also used by FeffDatFile() and so by feffpath().
+    """
+    cachefile = _feffdat_cachefile(folder)
+    entries = None
+    if use_cache:
+        entries = _read_feffdat_cache(cachefile)
+    if entries is None:
+        entries = {}
+
+    out = Group(folder=os.path.abspath(folder), feffdat={}, paths_dat='')
+    new_entries, changed = {}, False
+    fnames = sorted(os.listdir(folder))
+    for fname in fnames:
+        filename = os.path.join(folder, fname)
+        if fname == 'paths.dat':
+            with open(filename, 'r') as fh:
+                out.paths_dat = fh.read()
+            continue
+        if not (fname.startswith('feff') and fname.endswith('.dat')):
+            continue
+        entry = entries.get(fname, None)
+        if entry is not None and _entry_valid(entry, filename):
+            signature = _file_signature(filename)
+            changed = changed or signature != entry['signature']
+            entry = dict(entry, signature=signature)
+            fdat = FeffDatFile(name=f'feff.dat: {filename}')
+            fdat._set_from_dict(**_entry_attrs(entry, filename))
+        else:
+            fdat = FeffDatFile(filename=filename, use_cache=False)
+            if not hasattr(fdat, 'k'):
+                continue
+            try:
+                header = {attr: getattr(fdat, attr)
+                          for attr in FEFFDAT_CACHE_ATTRS}
+            except AttributeError:
+                out.feffdat[fname] = fdat
+                continue
+            entry = dict(name=fname, hash=_file_hash(filename),
+                         signature=_file_signature(filename), header=header,
+                         data=np.array([getattr(fdat, a) for a in FDAT_COLUMNS]))
+            changed = True
+        new_entries[fname] = entry
+        out.feffdat[fname] = fdat
+    changed = changed or len(new_entries) != len(entries)
+
+    if write_cache and changed and len(new_entries) > 0:
+        _write_feffdat_cache(cachefile, new_entries)
+    return out
+
+def _write_feffdat_cache(cachefile, entries):
+    "write a feff.dat cache file"
+    files, data, offset = [], [], 0
+    for name, entry in entries.items():
+        npts = entry['data'].shape[1]
+        files.append(dict(name=name, hash=entry['hash'], npts=npts,
+                          signature=entry['signature'], offset=offset,
+                          header=entry['header']))
+        data.append(entry['data'])
+        offset += npts
+    index = json.dumps(dict(version=FEFFDAT_CACHE_VERSION, files=files))
+    os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+    tmpfile = f'{cachefile[:-4]}_{os.getpid()}.tmp.npz'
+    try:
+        np.savez(tmpfile, index=np.array(index),
+                 data=np.concatenate(data, axis=1))
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        print(f"could not write Feff data cache file '{cachefile}'")
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        return
+    _feffdat_caches.pop(cachefile, None)
+
+
 class FeffPathGroup(Group):
     def __init__(self, filename=None, label='', feffrun='', s02=None, degen=None,
                  e0=None, ei=None, deltar=None, sigma2=None, third=None,
@@ -225,7 +539,8 @@ class FeffPathGroup(Group):
         self.label = label
         self.use = use
         self.params = None
-        self.spline_coefs = None
+        self.datastore = None
+        self.datarow = None
         self.geom  = []
         self.shell = 'K'
         self.absorber = None
@@ -289,7 +604,8 @@ class FeffPathGroup(Group):
 
 
     def __setstate__(self, state):
-        self.params = self.spline_coefs = self.k = self.chi = None
+        self.params = self.k = self.chi = None
+        self.datastore = self.datarow = None
         self.use = True
         if len(state) == 12:  # "use" was added after paths states were being saved
             (self.filename, self.label, self.feffrun, self.degen,
@@ -331,14 +647,18 @@ class FeffPathGroup(Group):
         return f'{parname}_{self.hashkey}'
 
     def __copy__(self):
-        newpath = FeffPathGroup()
-        newpath.__setstate__(self.__getstate__())
+        # copies share the (read-only) Feff.dat data
+        newpath = FeffPathGroup(label=self.label, feffrun=self.feffrun,
+                                use=self.use, _feffdat=self._feffdat)
+        newpath.filename = self.filename
+        newpath.init_path_params(degen=self.degen, s02=self.s02, e0=self.e0,
+                                 ei=self.ei, deltar=self.deltar,
+                                 sigma2=self.sigma2, third=self.third,
+                                 fourth=self.fourth)
         return newpath
 
     def __deepcopy__(self, memo):
-        newpath = FeffPathGroup()
-        newpath.__setstate__(self.__getstate__())
-        return newpath
+        return self.__copy__()
 
 
     @property
@@ -359,6 +679,17 @@ class FeffPathGroup(Group):
     @rmass.setter
     def rmass(self, val):  pass
 
+    @property
+    def spline_coefs(self):
+        """dict of cubic splines (scipy PPoly) for 'pha', 'amp', 'rep', 'lam',
+        made from the FeffDataStore for the path"""
+        if self.datastore is None:
+            return None
+        return self.datastore.splines(self.datarow)
+
+    @spline_coefs.setter
+    def spline_coefs(self, val):  pass
+
     def __repr__(self):
         return f'<FeffPath Group label={self.label:s}, filename={self.filename:s}, use={self.use}>'
 
@@ -385,19 +716,22 @@ class FeffPathGroup(Group):
             attr = 'value'
             if isinstance(val, str):
                 attr = 'expr'
-            kws =  {'vary': False, attr: val}
             parname = self.pathpar_name(pname)
+            # no need to re-create an unchanged Path Parameter
+            par = self.params.get(parname, None)
+            if (getattr(par, 'is_pathparam', False) and not par.vary and
+                ((attr == 'expr' and par.expr == val) or
+                 (attr == 'value' and par.expr is None and par.value == val))):
+                continue
+            kws =  {'vary': False, attr: val}
             self.params.add(parname, **kws)
             self.params[parname].is_pathparam = True
 
     def create_spline_coefs(self):
-        """pre-calculate spline coefficients for feff data"""
-        self.spline_coefs = {}
-        fdat = self._feffdat
-        self.spline_coefs['pha'] = UnivariateSpline(fdat.k, fdat.pha, s=0)
-        self.spline_coefs['amp'] = UnivariateSpline(fdat.k, fdat.amp, s=0)
-        self.spline_coefs['rep'] = UnivariateSpline(fdat.k, fdat.rep, s=0)
-        self.spline_coefs['lam'] = UnivariateSpline(fdat.k, fdat.lam, s=0)
+        """put feff data into the FeffDataStore for its k grid,
+        which holds spline coefficients for all paths"""
+        self.datastore = feffdata_store(self._feffdat.k)
+        self.datarow = self.datastore.add(self._feffdat)
 
     def store_feffdat(self):
         """stores data about this Feff path in the Parameters
@@ -551,10 +885,7 @@ class FeffPathGroup(Group):
             rep = np.interp(q, fdat.k, fdat.rep)
             lam = np.interp(q, fdat.k, fdat.lam)
         else:
-            pha = self.spline_coefs['pha'](q)
-            amp = self.spline_coefs['amp'](q)
-            rep = self.spline_coefs['rep'](q)
-            lam = self.spline_coefs['lam'](q)
+            pha, amp, rep, lam = self.datastore.interp([self.datarow], q)[:, 0]
 
         if debug:
             self.debug_k   = q
@@ -606,8 +937,158 @@ def path2chi(path, paramgroup=None, **kws):
     path.calc_chi_from_params(paramgroup, **kws)
 
 
+def calc_chi_paths(pathlist, k=None, kmax=None, kstep=None, with_derivs=False,
+                   pathvals=None):
+    """calculate chi(k) for a list of FeffPath Groups at once.
+
+    This gives the same results as calling FeffPathGroup._calc_chi() for
+    each path, but evaluates the XAFS equation on 2-D (npaths, nk) arrays.
+    Paths on the same Feff k grid have their pha, amp, rep, and lam
+    looked up with a single interpolation from their FeffDataStore.
+
+    Path Parameters must already be set up with create_path_params().
+    Outputs k, p, chi, and chi_imag are written to each path group.
+
+    With `with_derivs=True`, the analytic derivatives of chi(k) with respect
+    to each of the Path Parameters are also written to each path group as
+    `chi_derivs`, an array of shape (len(PATH_PARS), nk).
+
+    Values of the Path Parameters can be given as `pathvals`, an array of
+    shape (len(pathlist), len(PATH_PARS)), as from eval_pathparams().
+    Otherwise, they are evaluated for each path.
+    """
+    if k is None:
+        fdat = pathlist[0]._feffdat
+        if kmax is None:
+            kmax = 30.0
+        kmax = min(max(fdat.k), kmax)
+        if kstep is None: kstep = 0.05
+        k = kstep * np.arange(int(1.01 + kmax/kstep), dtype='float64')
+
+    active, iactive = [], []
+    for ipath, path in enumerate(pathlist):
+        path.k = k
+        if path.use and path._feffdat.reff >= 0.05:
+            if path.datastore is None:
+                path.create_spline_coefs()
+            active.append(path)
+            iactive.append(ipath)
+        else:
+            if path.use:
+                print('reff is too small to calculate chi(k)')
+            path.p = k
+            path.chi = 0.0 * k
+            path.chi_imag = 0.0 * k
+            if with_derivs:
+                path.chi_derivs = np.zeros((len(PATH_PARS), len(k)))
+    if len(active) == 0:
+        return
+
+    npaths, nk = len(active), len(k)
+    pvals = np.zeros((len(PATH_PARS), npaths), dtype='float64')
+    reff = np.zeros((npaths, 1), dtype='float64')
+    for i, path in enumerate(active):
+        if pathvals is None:
+            vals = path.path_paramvals()
+            pvals[:, i] = [vals[pname] for pname in PATH_PARS]
+        else:
+            pvals[:, i] = pathvals[iactive[i]]
+        reff[i] = path._feffdat.reff
+    (degen, s02, e0, ei, deltar, sigma2,
+     third, fourth) = [v.reshape(npaths, 1) for v in pvals]
+
+    # create e0-shifted energy and k, careful to look for |e0| ~= 0.
+    en = k*k - e0*ETOK
+    small = abs(en) < 1.5*SMALL_ENERGY
+    small &= (abs(en).min(axis=1) < SMALL_ENERGY).reshape(npaths, 1)
+    en[small] = SMALL_ENERGY
+    # q is the e0-shifted wavenumber
+    q = np.sign(en)*np.sqrt(abs(en))
+
+    # lookup Feff.dat values (pha, amp, rep, lam), with one
+    # interpolation for all paths on each Feff k grid
+    groups = {}
+    for i, path in enumerate(active):
+        key = id(path.datastore)
+        if key not in groups:
+            groups[key] = (path.datastore, [])
+        groups[key][1].append(i)
+
+    nspl = len(SPLINE_ARRS)
+    fdvals = np.zeros((nspl, npaths, nk), dtype='float64')
+    if with_derivs:
+        fdderivs = np.zeros((nspl, npaths, nk), dtype='float64')
+    for store, ipaths in groups.values():
+        rows = [active[i].datarow for i in ipaths]
+        fdvals[:, ipaths, :] = store.interp(rows, q[ipaths])
+        if with_derivs:
+            fdderivs[:, ipaths, :] = store.interp(rows, q[ipaths], nu=1)
+    pha, amp, rep, lam = fdvals
+
+    # p = complex wavenumber, and its square:
+    pp   = (rep + 1j/lam)**2 + 1j * ei * ETOK
+    p    = np.sqrt(pp)
+
+    # the xafs equation:
+    cexp = np.exp(-2*reff*p.imag - 2*pp*(sigma2 - pp*fourth/3) +
+                  1j*(2*q*reff + pha +
+                      2*p*(deltar - 2*sigma2/reff - 2*pp*third/3) ))
+
+    cchi = degen * s02 * amp * cexp / (q*(reff + deltar)**2)
+
+    if with_derivs:
+        echi = cexp / (q*(reff + deltar)**2)
+        derivs = _chi_path_derivs(cchi, echi, q, reff, pp, p, amp, rep, lam,
+                                  fdderivs, degen, s02, deltar, sigma2,
+                                  third, fourth)
+        derivs[:, :, 0] = 2*derivs[:, :, 1] - derivs[:, :, 2]
+
+    cchi[:, 0] = 2*cchi[:, 1] - cchi[:, 2]
+    # outputs:
+    for i, path in enumerate(active):
+        path.p = p[i]
+        path.chi = cchi[i].imag
+        path.chi_imag = -cchi[i].real
+        if with_derivs:
+            path.chi_derivs = derivs[i]
+
+
+def _chi_path_derivs(cchi, echi, q, reff, pp, p, amp, rep, lam, fdderivs,
+                     degen, s02, deltar, sigma2, third, fourth):
+    """analytic derivatives of chi(k) with respect to Path Parameters,
+    returned as array of shape (npaths, len(PATH_PARS), nk), for the
+    arrays and values used in calc_chi_paths(), with
+    cchi = degen * s02 * amp * echi
+    """
+    dpha, damp, drep, dlam = fdderivs
+
+    def dexponent(dq, dpha, dpp, dp):
+        "change in the XAFS exponent for changes in q, pha, pp, and p"
+        return (-2*reff*dp.imag - 2*dpp*sigma2 + 4*pp*dpp*fourth/3 +
+                1j*(2*reff*dq + dpha - 4*p*dpp*third/3 +
+                    2*dp*(deltar - 2*sigma2/reff - 2*pp*third/3)))
+
+    # E0 enters through q: the Feff arrays, 2*q*reff, and 1/q
+    cp = rep + 1j/lam
+    dpp = 2*cp*(drep - 1j*dlam/lam**2)
+    dq_de0 = -ETOK/(2*abs(q))
+    dchi_dq = cchi*(dexponent(1.0, dpha, dpp, dpp/(2*p)) - 1/q)
+    dchi_dq += degen*s02*damp*echi
+    # Ei enters through the imaginary part of pp
+    dpp = 1j*ETOK*np.ones_like(pp)
+
+    out = {'degen': s02*amp*echi, 's02': degen*amp*echi,
+           'e0': dchi_dq*dq_de0,
+           'ei': cchi*dexponent(0.0, 0.0, dpp, dpp/(2*p)),
+           'deltar': cchi*(2j*p - 2/(reff + deltar)),
+           'sigma2': cchi*(-2*pp - 4j*p/reff),
+           'third': cchi*(-4j*p*pp/3),
+           'fourth': cchi*(2*pp*pp/3)}
+    return np.array([out[pname].imag for pname in PATH_PARS]).transpose(1, 0, 2)
+
+
 def ff2chi(paths, group=None, paramgroup=None, k=None, kmax=None,
-            kstep=0.05,  **kws):
+            kstep=0.05, vectorize=False, compiled=True, **kws):
     """sum chi(k) for a list of FeffPath Groups.
 
     Parameters:
@@ -617,6 +1098,11 @@ def ff2chi(paths, group=None, paramgroup=None, k=None, kmax=None,
       kmax:        maximum k value for chi calculation [20].
       kstep:       step in k value for chi calculation [0.05].
       k:           explicit array of k values to calculate chi.
+      vectorize:   whether to calculate all paths together with
+                   calc_chi_paths() [False]
+      compiled:    whether to evaluate Path Parameters for all paths
+                   together with eval_pathparams(), instead of with
+                   asteval for each path [True]
     Returns:
     ---------
        group contain arrays for k and chi
@@ -647,7 +1133,20 @@ def ff2chi(paths, group=None, paramgroup=None, k=None, kmax=None,
             print(f"{path} is not a valid Feff Path")
             return
         path.create_path_params(params=params)
-        path._calc_chi(k=k, kstep=kstep, kmax=kmax)
+
+    pathvals = None
+    if compiled:
+        pathvals = eval_pathparams(pathlist, params)
+
+    if vectorize:
+        calc_chi_paths(pathlist, k=k, kstep=kstep, kmax=kmax,
+                       pathvals=pathvals)
+    else:
+        for ipath, path in enumerate(pathlist):
+            pvals = {}
+            if pathvals is not None:
+                pvals = dict(zip(PATH_PARS, pathvals[ipath]))
+            path._calc_chi(k=k, kstep=kstep, kmax=kmax, **pvals)
     k = pathlist[0].k[:]*1.0
     out = np.zeros_like(k)
     for path in pathlist:
@@ -8,6 +8,7 @@ except ImportError:
     from collections import Iterable
 from copy import copy, deepcopy
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import ast
 import numpy as np
 from numpy import array, arange, interp, pi, zeros, sqrt, concatenate
@@ -15,6 +16,7 @@ from numpy import array, arange, interp, pi, zeros, sqrt, concatenate
 from scipy.optimize import leastsq as scipy_leastsq
 
 from lmfit import Parameters, Parameter, Minimizer, fit_report
+from lmfit.minimizer import MinimizerResult
 
 from larch import Group, isNamedClass
 from larch.utils import fix_varname, gformat
@@ -22,11 +24,13 @@ from larch.utils.strutils import b32hash, random_varname
 from ..math import index_of, realimag, complex_phase, remove_nans
 from ..fitting import (correlated_values, eval_stderr, ParameterGroup,
                        group2params, params2group, isParameter)
+from ..fitting.confidence import FitProblem
 
 from .xafsutils import set_xafsGroup, gfmt
 from .xafsft import xftf_fast, xftr_fast, ftwindow
 from .autobk import autobk_delta_chi
-from .feffdat import FeffPathGroup, ff2chi
+from .feffdat import FeffPathGroup, ff2chi, calc_chi_paths, PATH_PARS
+from .pathparams import eval_pathparams
 
 class TransformGroup(Group):
     """A Group of transform parameters.
@@ -372,7 +376,7 @@ class FeffitDataSet(Group):
             params = group2params(params)
         for label, path in self.paths.items():
             path.create_path_params(params=params)
-            if path.spline_coefs is None:
+            if path.datastore is None:
                 path.create_spline_coefs()
 
         self._generate_hashkey(other_hashkeys=other_hashkeys)
@@ -460,7 +464,8 @@ class FeffitDataSet(Group):
 
 
 
-    def _residual(self, paramgroup, data_only=False, **kws):
+    def _residual(self, paramgroup, data_only=False, vectorize_paths=False,
+                  **kws):
         """return the residual for this data set
         residual = self.transform.apply(data_chi - model_chi)
         where model_chi is the result of ff2chi(paths)
@@ -471,15 +476,45 @@ class FeffitDataSet(Group):
             self.prepare_fit(paramgroup)
 
         ff2chi(self.paths, paramgroup=paramgroup, k=self.model.k,
-                _larch=self._larch, group=self.model)
+               vectorize=vectorize_paths, _larch=self._larch,
+               group=self.model)
 
+        diff  = (self.__chi - self.model.chi)
+        if data_only:  # for extracting transformed data separately from residual
+            diff  = self.__chi
+        return self._transform_diff(diff)
+
+    def _jacobian(self, params, var_names, **kws):
+        """return the Jacobian of the residual for this data set with
+        respect to the variables in `var_names`, shape (nresid, nvars).
+
+        This uses the analytic derivatives of chi(k) with respect to Path
+        Parameters from calc_chi_paths(), the derivatives of the Path
+        Parameters with respect to the variables, and the linearity of
+        the transform applied in _residual().
+        """
+        if not self.__prepared:
+            self.prepare_fit(params)
+        pathlist = list(self.paths.values())
+        for path in pathlist:
+            path.create_path_params(params=params)
+        calc_chi_paths(pathlist, k=self.model.k, with_derivs=True,
+                       pathvals=eval_pathparams(pathlist, params))
+
+        dpars = pathpar_derivs(params, pathlist, var_names)
+        dchi = np.zeros((len(var_names), len(self.model.k)), dtype='float64')
+        for ipath, path in enumerate(pathlist):
+            dchi += np.dot(dpars[ipath], path.chi_derivs)
+        return np.array([self._transform_diff(-dchi_) for dchi_ in dchi]).T
+
+    def _transform_diff(self, diff):
+        """apply the fit transform to a difference in chi(k),
+        giving the residual array for the fit.   This is linear in diff.
+        """
         eps_k = self.epsilon_k
         if isinstance(eps_k, np.ndarray):
             eps_k[np.where(eps_k<1.e-12)[0]] = 1.e-12
 
-        diff  = (self.__chi - self.model.chi)
-        if data_only:  # for extracting transformed data separately from residual
-            diff  = self.__chi
         trans = self.transform
         k     = trans.k_[:len(diff)]
 
@@ -535,6 +570,252 @@ class FeffitDataSet(Group):
             for p in self.paths.values():
                 xft(p.chi, group=p, rmax_out=rmax_out)
 
+def _eval_constraints(params, names):
+    "evaluate constraint Parameters in `names`, in order of dependencies"
+    done = set()
+    def _eval(name):
+        if name in done:
+            return
+        done.add(name)
+        par = params[name]
+        for dep in getattr(par, '_expr_deps', []):
+            if dep in names:
+                _eval(dep)
+        par._getval()
+    for name in names:
+        _eval(name)
+
+# datasets and Parameters held by each worker process for feffit(nworkers>1)
+_worker_state = {}
+
+def _param_values(params):
+    "values of Parameters that are not constraints or Path Parameters"
+    return {name: par.value for name, par in params.items()
+            if par.expr is None and not getattr(par, 'is_pathparam', False)}
+
+def _worker_dataset(ds):
+    """picklable arguments to re-create a FeffitDataSet in a worker process"""
+    data = Group(k=ds.data.k, chi=ds.data.chi,
+                 delta_chi=getattr(ds.data, 'delta_chi', None),
+                 epsilon_k=getattr(ds.data, 'epsilon_k', None),
+                 filename=getattr(ds.data, 'filename', None),
+                 groupname=getattr(ds.data, 'groupname', None))
+    trans = copy(ds.transform)
+    trans._larch = None
+    return (data, list(ds.paths.values()), trans, ds.refine_bkg, ds.hashkey)
+
+def _prepare_datasets(param_specs, dataset_args):
+    """create Parameters and prepared copies of the datasets from
+    the arguments made with _worker_dataset()"""
+    params = Parameters()
+    params.add_many(*[Parameter(*spec) for spec in param_specs])
+    params.update_constraints()
+    datasets = []
+    for data, paths, trans, refine_bkg, hashkey in dataset_args:
+        ds = FeffitDataSet(data=data, paths=paths, transform=trans,
+                           refine_bkg=refine_bkg)
+        ds.hashkey = hashkey
+        ds.prepare_fit(params)
+        datasets.append(ds)
+    return params, datasets
+
+def _feffit_worker_init(param_specs, dataset_args):
+    """initialize a feffit worker process, with its own Parameters
+    and prepared copies of all the datasets"""
+    params, datasets = _prepare_datasets(param_specs, dataset_args)
+    _worker_state['params'] = params
+    _worker_state['datasets'] = datasets
+
+class FeffitProblem(FitProblem):
+    """a feffit() fit to be re-run with some Parameters held fixed, as
+    for chi2_map() and confidence_intervals().
+
+    This holds the data, paths, and transforms of the datasets and the
+    best-fit Parameter values, and can be sent to worker processes.
+    setup() creates the Parameters, prepared datasets, and Minimizer.
+    The degrees of freedom of the best-fit result are taken from the
+    number of independent points, not the number of data points.
+    """
+    def __init__(self, fit_result, **fit_kws):
+        result = fit_result.fit_details
+        self.param_specs = [(name, par.value, par.vary, par.min, par.max,
+                             par.expr)
+                            for name, par in result.params.items()
+                            if not getattr(par, 'is_pathparam', False)]
+        self.stderrs = {name: par.stderr for name, par in result.params.items()
+                        if par.vary}
+        self.dataset_args = [_worker_dataset(ds) for ds in fit_result.datasets]
+        self.stats = {attr: getattr(result, attr) for attr in
+                      ('chisqr', 'redchi', 'ndata', 'nvarys', 'nfree')}
+        # F-tests use the number of independent points, as for the
+        # uncertainties from feffit()
+        self.stats['nfree'] = fit_result.n_independent - result.nvarys
+        self.fit_kws = dict(gtol=1.e-6, ftol=1.e-6, xtol=1.e-6, epsfcn=1.e-10)
+        self.fit_kws.update(fit_kws)
+        self.minimizer = None
+        self.result = result
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['result'] = None
+        return state
+
+    def setup(self):
+        "return the Minimizer and best-fit MinimizerResult"
+        params, datasets = _prepare_datasets(self.param_specs,
+                                             self.dataset_args)
+        for name, stderr in self.stderrs.items():
+            params[name].stderr = stderr
+
+        def _resid(params):
+            return concatenate([d._residual(params) for d in datasets])
+
+        minimizer = Minimizer(_resid, params, scale_covar=False,
+                              **self.fit_kws)
+        result = MinimizerResult(params=params, **self.stats)
+        return minimizer, result
+
+def _feffit_worker_call(idset, values, jacobian=False, **kws):
+    """calculate residual or Jacobian for a dataset in a worker process,
+    using Parameter values from the main process"""
+    params = _worker_state['params']
+    for name, val in values.items():
+        params[name].value = val
+    _eval_constraints(params, [name for name, par in params.items()
+                               if par.expr is not None and
+                               not getattr(par, 'is_pathparam', False)])
+    dset = _worker_state['datasets'][idset]
+    if jacobian:
+        return dset._jacobian(params, **kws)
+    return dset._residual(params, **kws)
+
+def pathpar_derivs(params, pathlist, var_names, step=1.e-7):
+    """derivatives of Path Parameter values with respect to fit variables
+
+    Parameters:
+    ------------
+      params:     lmfit Parameters, with Path Parameters for all paths
+      pathlist:   list of FeffPath Groups
+      var_names:  list of names of variable Parameters
+      step:       relative step size for central differences [1.e-7]
+
+    Returns:
+    ---------
+      array of shape (npaths, nvars, len(PATH_PARS))
+
+    Path Parameters given as constraint expressions are differentiated by
+    central differences of the expressions, with each variable stepped in
+    the Parameters symbol table.  Path Parameters with numerical values
+    have derivatives of zero.
+    """
+    out = np.zeros((len(pathlist), len(var_names), len(PATH_PARS)))
+    pathexprs = []
+    for path in pathlist:
+        pexprs = []
+        if path.use:
+            for ipar, pname in enumerate(PATH_PARS):
+                par = params[path.pathpar_name(pname)]
+                if par.expr is not None:
+                    pexprs.append((ipar, par))
+        pathexprs.append(pexprs)
+    if sum([len(pexprs) for pexprs in pathexprs]) == 0:
+        return out
+
+    constraints = [name for name, par in params.items()
+                   if par.expr is not None and
+                   not getattr(par, 'is_pathparam', False)]
+
+    def pathpar_values():
+        _eval_constraints(params, constraints)
+        return eval_pathparams(pathlist, params)
+
+    # note: calling asteval procedures such as sigma2_eins() replaces
+    # the symbol table, so it must be looked up each time
+    for ivar, vname in enumerate(var_names):
+        value = params[vname].value
+        delta = step*max(1.0, abs(value))
+        params._asteval.symtable[vname] = value + delta
+        vals_plus = pathpar_values()
+        params._asteval.symtable[vname] = value - delta
+        vals_minus = pathpar_values()
+        params._asteval.symtable[vname] = value
+        out[:, ivar, :] = (vals_plus - vals_minus)/(2*delta)
+    # restore constraint and path parameter values
+    pathpar_values()
+    return out
+
+def propagate_stderr(params, var_names, covar, datasets=None, step=1.e-7):
+    """propagate uncertainties of variables to constraints and Path Parameters
+
+    Parameters:
+    ------------
+      params:     lmfit Parameters with best-fit values, including constraints
+      var_names:  list of names of variable Parameters
+      covar:      covariance matrix for the variables
+      datasets:   list of Feffit Datasets [None]
+      step:       relative step size for central differences [1.e-7]
+
+    Notes:
+    ------
+      The derivatives of all constraint Parameters and Path Parameters
+      with respect to the variables are found by central differences,
+      with each variable stepped once for all constraints and for all
+      Path Parameters (using compiled expressions, see pathpar_derivs()).
+      With the Jacobian J, uncertainties are then sqrt(diag(J C J^T)),
+      for covariance C.  The `stderr` is set for constraint Parameters
+      in `params` and for the Path Parameters of each path.
+
+      Path Parameters are named by the hashkey of the Feff.dat file, so
+      that a path used in several datasets (as for data at several
+      temperatures) has different Path Parameters with the same name.
+      These are created in `params` and differentiated for one dataset
+      at a time.
+    """
+    constraints = [name for name, par in params.items()
+                   if par.expr is not None and
+                   not getattr(par, 'is_pathparam', False)]
+    covar = np.asarray(covar)
+
+    def _stderr(jac):
+        "sqrt(diag(J C J^T)) for a (nderived, nvars) Jacobian"
+        return np.sqrt(np.maximum(0, np.einsum('ij,jk,ik->i', jac, covar, jac)))
+
+    if len(constraints) > 0:
+        jac = np.zeros((len(constraints), len(var_names)))
+        for ivar, vname in enumerate(var_names):
+            value = params[vname].value
+            delta = step*max(1.0, abs(value))
+            vals = []
+            for sign in (1, -1):
+                params._asteval.symtable[vname] = value + sign*delta
+                _eval_constraints(params, constraints)
+                vals.append(np.array([params[name].value for name in constraints]))
+            params._asteval.symtable[vname] = value
+            jac[:, ivar] = (vals[0] - vals[1])/(2*delta)
+        _eval_constraints(params, constraints)
+        for name, stderr in zip(constraints, _stderr(jac)):
+            params[name].stderr = stderr
+
+    for ds in (datasets or []):
+        pathlist = list(ds.paths.values())
+        if len(pathlist) < 1:
+            continue
+        # keep the Path Parameters used for each dataset after the fit
+        pathparams = [path.params for path in pathlist]
+        for path in pathlist:
+            path.create_path_params(params=params)
+        jac = pathpar_derivs(params, pathlist, var_names, step=step)
+        npaths, nvars, npars = jac.shape
+        stderr = _stderr(jac.transpose(0, 2, 1).reshape((-1, nvars)))
+        stderr = stderr.reshape((npaths, npars))
+        for ipath, path in enumerate(pathlist):
+            if pathparams[ipath] is not None:
+                path.params = pathparams[ipath]
+            for ipar, pname in enumerate(PATH_PARS):
+                par = path.params[path.pathpar_name(pname)]
+                if par.expr is not None:
+                    par.stderr = stderr[ipath, ipar]
+
 def feffit_dataset(data=None, paths=None, transform=None,
                    epsilon_k=None, pathlist=None, _larch=None):
     """create a Feffit Dataset group.
@@ -585,7 +866,9 @@ def feffit_transform(_larch=None, **kws):
     return TransformGroup(_larch=_larch, **kws)
 
 def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
-           fix_unused_variables=True,  _larch=None, **kws):
+           fix_unused_variables=True, vectorize_paths=False,
+           analytic_jacobian=False, nworkers=1, exact_uncertainties=False,
+           _larch=None, **kws):
     """execute a Feffit fit: a fit of feff paths to a list of datasets
 
     Parameters:
@@ -596,6 +879,17 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
       path_output:  Flag to set whether all Path outputs should be written.
       fix_unused_variables: Flag for whether to set `vary=False` for unused
                     variable parameters.  Otherwise, a warning will be printed.
+      vectorize_paths: Flag for whether to calculate chi(k) for all paths
+                    of a dataset together, with vectorized array operations.
+      analytic_jacobian: Flag for whether to use analytic derivatives of
+                    chi(k) with respect to the Path Parameters to calculate
+                    the Jacobian, instead of finite differences of the residual.
+      nworkers:     number of worker processes to use to calculate the
+                    residuals for multiple datasets concurrently [1].
+      exact_uncertainties: Flag for whether to propagate uncertainties to
+                    constraints and Path Parameters by evaluating each of them
+                    with the uncertainties package, instead of with derivatives
+                    for all of them found together (see propagate_stderr()).
     Returns:
     ---------
       a fit results group.  This will contain subgroups of:
@@ -633,9 +927,27 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
 
     params = group2params(work_paramgroup)
 
+    # with nworkers > 1, residuals for the datasets are calculated in
+    # worker processes, each with their own prepared datasets
+    executor = None
+
     def _resid(params, datasets=None, pargroup=None, **kwargs):
         """ this is the residual function"""
-        return concatenate([d._residual(params) for d in datasets])
+        if executor is None:
+            return concatenate([d._residual(params, **kwargs) for d in datasets])
+        values = _param_values(params)
+        func = partial(_feffit_worker_call, values=values, **kwargs)
+        return concatenate(list(executor.map(func, range(len(datasets)))))
+
+    def _jacobian(params, datasets=None, pargroup=None, **kwargs):
+        """ this is the Jacobian function"""
+        var_names = [name for name, par in params.items() if par.vary]
+        if executor is None:
+            return np.vstack([d._jacobian(params, var_names) for d in datasets])
+        values = _param_values(params)
+        func = partial(_feffit_worker_call, values=values, jacobian=True,
+                       var_names=var_names)
+        return np.vstack(list(executor.map(func, range(len(datasets)))))
 
     if isNamedClass(datasets, FeffitDataSet):
         datasets = [datasets]
@@ -669,14 +981,33 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
             vlist = ', '.join(vars)
             print(f"Feffit Warning: unused variables: {vlist}")
 
+    if analytic_jacobian:
+        fit_kws['Dfun'] = _jacobian
+
+    if nworkers > 1 and len(datasets) > 1:
+        param_specs = [(name, par.value, par.vary, par.min, par.max, par.expr)
+                       for name, par in params.items()
+                       if not getattr(par, 'is_pathparam', False)]
+        dataset_args = [_worker_dataset(ds) for ds in datasets]
+        executor = ProcessPoolExecutor(max_workers=nworkers,
+                                       initializer=_feffit_worker_init,
+                                       initargs=(param_specs, dataset_args))
+
     # run fit
     fit = Minimizer(_resid, params,
-                    fcn_kws=dict(datasets=datasets, pargroup=work_paramgroup),
+                    fcn_kws=dict(datasets=datasets, pargroup=work_paramgroup,
+                                 vectorize_paths=vectorize_paths),
                     scale_covar=False, **fit_kws)
 
-    result = fit.leastsq()
+    try:
+        result = fit.leastsq()
+    finally:
+        if executor is not None:
+            executor.shutdown()
     params2group(result.params, work_paramgroup)
-    dat = concatenate([d._residual(work_paramgroup, data_only=True) for d in datasets])
+    dat = concatenate([d._residual(work_paramgroup, data_only=True,
+                                   vectorize_paths=vectorize_paths)
+                       for d in datasets])
 
     n_idp = 0
     for ds in datasets:
@@ -711,20 +1042,25 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
             par = result.params[vname]
             vsave[vname] = par
             vbest.append(par.value)
-        # 2. get correlated uncertainties, set params accordingly
-        uvars = correlated_values(vbest, result.covar)
-        # 3. evaluate constrained params, save stderr
-        for nam, obj in result.params.items():
-            eval_stderr(obj, uvars,  result.var_names, result.params)
-
-        # 3. evaluate path_ params, save stderr
-        for ds in datasets:
-            for label, path in ds.paths.items():
-                path.store_feffdat()
-                for pname in ('degen', 's02', 'e0', 'ei',
-                              'deltar', 'sigma2', 'third', 'fourth'):
-                    obj = path.params[path.pathpar_name(pname)]
-                    eval_stderr(obj, uvars,  result.var_names, result.params)
+        if exact_uncertainties:
+            # 2. get correlated uncertainties, set params accordingly
+            uvars = correlated_values(vbest, result.covar)
+            # 3. evaluate constrained params, save stderr
+            for nam, obj in result.params.items():
+                eval_stderr(obj, uvars,  result.var_names, result.params)
+
+            # 3. evaluate path_ params, save stderr
+            for ds in datasets:
+                for label, path in ds.paths.items():
+                    path.store_feffdat()
+                    for pname in ('degen', 's02', 'e0', 'ei',
+                                  'deltar', 'sigma2', 'third', 'fourth'):
+                        obj = path.params[path.pathpar_name(pname)]
+                        eval_stderr(obj, uvars,  result.var_names, result.params)
+        else:
+            # 2. propagate the covariance to constraints and path params
+            propagate_stderr(result.params, result.var_names, result.covar,
+                             datasets=datasets)
         # restore saved parameters again
         for vname in result.var_names:
             # setattr(params, vname, vsave[vname])
@@ -2,15 +2,25 @@ import sys
 import os
 from os.path import realpath, isdir, isfile, join, basename, dirname, abspath
 import glob
-from shutil import copy, move
+import json
+import hashlib
+import tempfile
+import threading
+from shutil import copy, move, rmtree
 import subprocess
 import time
 import re
 from optparse import OptionParser
 from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from larch import Group, isNamedClass
 from larch.utils import isotime, bytes2str, uname, bindir, get_cwd
+from larch.site_config import user_larchdir
+
+# folder for results of FeffJobFarm, one folder per feff.inp
+FEFF_CACHE_DIR = join(user_larchdir, 'feff_cache')
+FEFFJOB_FILE = 'feffjob.json'
 
 def find_exe(exename):
     if uname == 'win' and not exename.endswith('.exe'):
@@ -103,21 +113,17 @@ class FeffRunner(Group):
         if self.feffinp is None:
             raise Exception("no feff.inp file was specified")
 
-        savefile = '.save_.inp'
-        here = abspath(get_cwd())
-        os.chdir(abspath(self.folder))
-
+        # run in the folder of the feff.inp file, without changing the
+        # working directory, so that several runs can be done at once
         feffinp_dir, feffinp_file = os.path.split(self.feffinp)
-        feffinp_dir = dirname(self.feffinp)
-        if len(feffinp_dir) > 0:
-            os.chdir(feffinp_dir)
+        workdir = abspath(join(self.folder, feffinp_dir))
+        savefile = join(workdir, '.save_.inp')
 
-        if not isfile(feffinp_file):
+        if not isfile(join(workdir, feffinp_file)):
             raise Exception("feff.inp file '%s' could not be found" % feffinp_file)
 
         if exe in (None, 'feff8l'):
             for module in self.Feff8l_modules:
-                os.chdir(here)
                 self.run(exe=module)
             return
 
@@ -132,7 +138,7 @@ class FeffRunner(Group):
         if resolved_exe is not None:
             program = resolved_exe
 
-        else:
+        elif self._larch is not None:
             getsym = self._larch.symtable.get_symbol
             try:
                 program = getsym('_xafs._feff8_executable')
@@ -147,20 +153,19 @@ class FeffRunner(Group):
                 program = None
 
         if program is None:  # Give up!
-            os.chdir(here)
             raise Exception("'%s' executable cannot be found" % exe)
 
         ## preserve an existing feff.inp file if this is not called feff.inp
         if feffinp_file != 'feff.inp':
-            if isfile('feff.inp'):
-                copy('feff.inp', savefile)
-            copy(feffinp_file, 'feff.inp')
+            if isfile(join(workdir, 'feff.inp')):
+                copy(join(workdir, 'feff.inp'), savefile)
+            copy(join(workdir, feffinp_file), join(workdir, 'feff.inp'))
 
         _, logname = os.path.split(program)
         if logname.endswith('.exe'):
             logname = logname[:4]
 
-        log = 'feffrun_%s.log' % logname
+        log = join(workdir, 'feffrun_%s.log' % logname)
 
         if isfile(log):
             os.unlink(log)
@@ -179,7 +184,7 @@ class FeffRunner(Group):
         if self.verbose:
             write(header)
         f.write(header)
-        process=subprocess.Popen(program, shell=False,
+        process=subprocess.Popen(program, shell=False, cwd=workdir,
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.STDOUT)
         flag = False
@@ -215,13 +220,158 @@ class FeffRunner(Group):
                 this = line.split()
                 thislist.append(this[1])
             f.write(line)
-        f.close
+        f.close()
 
         if isfile(savefile):
-            move(savefile, 'feff.inp')
-        os.chdir(here)
+            move(savefile, join(workdir, 'feff.inp'))
         return None
 
+def feffinp_hashkey(feffinp, exe='feff8l'):
+    """hash of the text of a feff.inp file and the Feff version used,
+    ignoring blank lines, comment lines, and differences in whitespace
+    """
+    lines = [basename(exe)]
+    for line in feffinp.replace('\r', '').split('\n'):
+        line = ' '.join(line.split())
+        if len(line) > 0 and not line.startswith('*'):
+            lines.append(line)
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class FeffJobFarm:
+    """
+    Run many Feff calculations with a pool of workers, with results kept
+    in a cache of folders keyed by a hash of the feff.inp text.
+
+        farm = FeffJobFarm(nworkers=4)
+        jobs = [farm.submit(text) for text in feffinp_texts]
+        results = [job.result() for job in jobs]
+        farm.shutdown()
+
+    Each calculation runs in its own folder, without changing the working
+    directory of the process.  Submitting a feff.inp that has already been
+    calculated (with only differences in comments or whitespace) returns
+    the cached result immediately, and submitting a feff.inp that is
+    being calculated returns the job that is already running.
+
+    Arguments:
+    ----------
+      nworkers (int): number of calculations to run at once [4]
+      cachedir (str or None): folder for results [FEFF_CACHE_DIR]
+      exe (str): Feff version to run, 'feff8l' or 'feff6l' ['feff8l']
+
+    The result of each job is a group with `folder`, the folder with all
+    Feff outputs, `feffinp`, `paths`, a list of feffNNNN.dat files,
+    `hashkey` and `cached`, whether the result was from the cache.
+    """
+    def __init__(self, nworkers=4, cachedir=None, exe='feff8l', _larch=None):
+        if cachedir is None:
+            cachedir = FEFF_CACHE_DIR
+        self.cachedir = abspath(cachedir)
+        self.exe = exe
+        self.nworkers = nworkers
+        self._larch = _larch
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=nworkers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, feffinp):
+        """submit a Feff calculation, returning a concurrent.futures.Future
+
+        Arguments:
+        ----------
+          feffinp (str): text of feff.inp, or name of a feff.inp file
+        """
+        if '\n' not in feffinp and isfile(feffinp):
+            with open(feffinp, 'r') as fh:
+                feffinp = fh.read()
+        hashkey = feffinp_hashkey(feffinp, exe=self.exe)
+        folder = join(self.cachedir, hashkey)
+        with self._lock:
+            job = self._jobs.get(hashkey, None)
+            if job is not None and not (job.done() and job.exception()):
+                return job
+            if isfile(join(folder, FEFFJOB_FILE)):
+                job = Future()
+                job.set_result(self._result(hashkey, folder, cached=True))
+            else:
+                job = self._executor.submit(self._run, hashkey, feffinp)
+            self._jobs[hashkey] = job
+        return job
+
+    def map(self, feffinps):
+        """run Feff calculations for a list of feff.inp texts or files,
+        returning the list of results, in order"""
+        return [job.result() for job in [self.submit(f) for f in feffinps]]
+
+    def shutdown(self, wait=True):
+        "shut down the pool of workers"
+        self._executor.shutdown(wait=wait)
+
+    def _result(self, hashkey, folder, cached=False):
+        paths = sorted(glob.glob(join(folder, 'feff[0-9]*.dat')))
+        return Group(name=f'Feff job {hashkey[:12]}', folder=folder,
+                     feffinp=join(folder, 'feff.inp'), paths=paths,
+                     hashkey=hashkey, cached=cached)
+
+    def _run(self, hashkey, feffinp):
+        """run Feff in a new working folder, which is moved to the
+        cache folder for the hashkey when the calculation succeeds"""
+        os.makedirs(self.cachedir, exist_ok=True)
+        folder = join(self.cachedir, hashkey)
+        workdir = tempfile.mkdtemp(prefix=f'_{hashkey[:12]}_', dir=self.cachedir)
+        try:
+            with open(join(workdir, 'feff.inp'), 'w') as fh:
+                fh.write(feffinp)
+            runner = FeffRunner(folder=workdir, feffinp='feff.inp',
+                                verbose=False, _larch=self._larch)
+            exe = self.exe
+            if exe not in (None, 'feff8l'):
+                exe = find_exe(exe) or exe
+            runner.run(exe=exe)
+            if len(glob.glob(join(workdir, 'feff[0-9]*.dat'))) == 0:
+                raise Exception("Feff calculation gave no paths, see %s" % workdir)
+            with open(join(workdir, FEFFJOB_FILE), 'w') as fh:
+                json.dump({'hashkey': hashkey, 'exe': self.exe,
+                           'datetime': isotime()}, fh)
+            try:
+                os.rename(workdir, folder)
+            except OSError:
+                # the same calculation was finished by another process
+                rmtree(workdir, ignore_errors=True)
+        except:
+            rmtree(workdir, ignore_errors=True)
+            raise
+        return self._result(hashkey, folder, cached=False)
+
+
+def run_feff_jobs(feffinps, nworkers=4, cachedir=None, exe='feff8l', _larch=None):
+    """
+    run Feff calculations for many feff.inp texts, with a pool of workers
+    and a cache of results keyed by a hash of the feff.inp text
+
+    Arguments:
+    ----------
+      feffinps (list): list of feff.inp texts or files
+      nworkers (int): number of calculations to run at once [4]
+      cachedir (str or None): folder for results [FEFF_CACHE_DIR]
+      exe (str): Feff version to run, 'feff8l' or 'feff6l' ['feff8l']
+
+    Returns:
+    --------
+      list of result groups, as from FeffJobFarm, with `folder`
+      and `paths` for each calculation
+    """
+    with FeffJobFarm(nworkers=nworkers, cachedir=cachedir, exe=exe,
+                     _larch=_larch) as farm:
+        return farm.map(feffinps)
+
 ######################################################################
 def feffrunner(folder=None, feffinp=None, verbose=True, _larch=None, **kws):
     """
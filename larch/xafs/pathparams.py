@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""
+Compiled evaluation of Path Parameters for lists of Feff Paths.
+
+Path Parameters are normally evaluated one at a time with the asteval
+interpreter of the lmfit Parameters, after putting values such as `reff`
+for each path into the symbol table.  Here, the expressions for all
+Path Parameters of a list of paths are instead compiled once to Python
+code objects.  Each distinct expression is evaluated only once, with
+arrays of the Feff.dat values (`reff`, `rmass`, ...) for all paths that
+use it, and expressions are evaluated in order of their dependencies.
+
+Expressions that cannot be compiled (for example, those using names or
+functions that are only defined in the asteval symbol table, or using
+`feffpath` directly), or that fail to evaluate, are evaluated with
+asteval as before.
+
+   vals = eval_pathparams(pathlist, params)
+
+gives an array of shape (len(pathlist), len(PATH_PARS)) of values.
+"""
+import ast
+from collections import OrderedDict
+import numpy as np
+
+from .sigma2_models import EINS_FACTOR, sigma2_debye as _sigma2_debye_path
+
+PATH_PARS = ('degen', 's02', 'e0', 'ei', 'deltar', 'sigma2', 'third', 'fourth')
+
+# values that will be available in calculations of Path Parameter values
+FEFFDAT_VALUES = ('reff', 'nleg', 'degen', 'rmass', 'rnorman',
+                  'gam_ch', 'rs_int', 'vint', 'vmu', 'vfermi')
+
+PATHPARAMS_CACHE_SIZE = 64
+_pathparams_cache = OrderedDict()
+
+# functions allowed in compiled expressions.
+# sigma2_eins and sigma2_debye are added for each set of paths
+FUNCTIONS = {'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log,
+             'log10': np.log10, 'sin': np.sin, 'cos': np.cos,
+             'tan': np.tan, 'arcsin': np.arcsin, 'arccos': np.arccos,
+             'arctan': np.arctan, 'arctan2': np.arctan2, 'sinh': np.sinh,
+             'cosh': np.cosh, 'tanh': np.tanh, 'abs': np.abs,
+             'fabs': np.fabs, 'float': np.float64,
+             'max': np.maximum, 'min': np.minimum}
+
+CONSTANTS = {'pi': np.pi, 'e': np.e, 'EINS_FACTOR': EINS_FACTOR}
+
+_AST_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load,
+              ast.Constant, ast.Call, ast.Add, ast.Sub, ast.Mult, ast.Div,
+              ast.Pow, ast.Mod, ast.FloorDiv, ast.USub, ast.UAdd)
+
+
+def _compile_expr(expr):
+    """compile an expression to a code object, returning (code, names)
+    or None if the expression uses unsupported syntax or functions"""
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError:
+        return None
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _AST_NODES):
+            return None
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or len(node.keywords) > 0
+                or node.func.id not in FUNCTIONS and
+                node.func.id not in ('sigma2_eins', 'sigma2_debye')):
+                return None
+            if node.func.id in ('max', 'min') and len(node.args) != 2:
+                return None
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                return None
+    return compile(tree, '<pathparam>', 'eval'), names
+
+
+def _eins_rmass(fdat):
+    "reduced mass of a path as used by sigma2_eins()"
+    rmass = 0.
+    for sym, iz, ipot, amass, x, y, z in fdat.geom:
+        rmass = rmass + 1.0/max(0.1, amass)
+    return 1.0/max(1.e-12, rmass)
+
+
+class _ExprGroup:
+    """one compiled expression, and the (path, parameter) entries using it"""
+    def __init__(self, expr, code, names, entries):
+        self.expr = expr
+        self.code = code
+        self.entries = entries
+        self.ipaths = np.array([ipath for ipath, ipar in entries])
+        self.ipars = np.array([ipar for ipath, ipar in entries])
+        self.names = names
+        self.deps = set()
+        self.scalar_names = set()
+        self.failed = False
+
+
+class PathParamEvaluator:
+    """evaluate Path Parameters for a list of FeffPath Groups, with
+    expressions for the Path Parameters compiled once.
+
+    Parameters:
+    ------------
+      pathlist:  list of FeffPath Groups
+      params:    lmfit Parameters holding the Path Parameters, as
+                 created with FeffPathGroup.create_path_params()
+
+    Calling the evaluator with the Parameters returns an array of shape
+    (len(pathlist), len(PATH_PARS)) with values of the Path Parameters.
+    Current values of other Parameters are taken from the symbol table
+    of the Parameters, as they are for asteval.
+    """
+    def __init__(self, pathlist, params):
+        self.pathlist = list(pathlist)
+        self.fdats = [path._feffdat for path in self.pathlist]
+        self.key = pathparams_key(self.pathlist, params)
+        npaths = len(self.pathlist)
+        self.constants = np.zeros((npaths, len(PATH_PARS)))
+
+        self.fdat_values = {}
+        for attr in FEFFDAT_VALUES:
+            self.fdat_values[attr] = np.array([getattr(fdat, attr, 0)
+                                               for fdat in self.fdats])
+        self.eins_rmass = np.array([_eins_rmass(fdat) for fdat in self.fdats])
+
+        # names of all path parameters, for dependencies between them
+        pathpar_names = {}
+        for ipath, path in enumerate(self.pathlist):
+            for ipar, pname in enumerate(PATH_PARS):
+                pathpar_names[path.pathpar_name(pname)] = (ipath, ipar)
+
+        exprs = OrderedDict()
+        self.fallback = []
+        for ipath, pathexprs in enumerate(self.key):
+            for ipar, (isexpr, val) in enumerate(pathexprs[1]):
+                if not isexpr:
+                    self.constants[ipath, ipar] = val
+                    continue
+                if val not in exprs:
+                    exprs[val] = []
+                exprs[val].append((ipath, ipar))
+
+        groups = []
+        for expr, entries in exprs.items():
+            compiled = _compile_expr(expr)
+            if compiled is None:
+                self.fallback.extend(entries)
+                continue
+            code, names = compiled
+            group = _ExprGroup(expr, code, names, entries)
+            for name in names:
+                if name in pathpar_names:
+                    group.deps.add(pathpar_names[name])
+                elif (name not in FEFFDAT_VALUES and name not in FUNCTIONS
+                      and name not in CONSTANTS
+                      and name not in ('sigma2_eins', 'sigma2_debye')):
+                    group.scalar_names.add(name)
+            groups.append(group)
+        self.groups = self._order_groups(groups)
+
+    def _order_groups(self, groups):
+        """put expression groups in order of dependencies, with
+        groups depending on fallback or circular entries using asteval"""
+        owner = {}
+        for igroup, group in enumerate(groups):
+            for entry in group.entries:
+                owner[entry] = igroup
+        fallback = set(self.fallback)
+        ordered, state = [], {}
+
+        def visit(igroup):
+            if igroup in state:
+                # False for groups being visited: a circular dependency
+                return state[igroup] is True
+            state[igroup] = None
+            group = groups[igroup]
+            ok = True
+            for dep in group.deps:
+                if dep in fallback:
+                    ok = False
+                elif dep in owner:
+                    ok = visit(owner[dep]) and ok
+            state[igroup] = ok
+            if ok:
+                ordered.append(group)
+            else:
+                self.fallback.extend(group.entries)
+                fallback.update(group.entries)
+            return ok
+
+        for igroup in range(len(groups)):
+            visit(igroup)
+        return ordered
+
+    def _namespace(self, group, symtable, values):
+        "names for evaluating the expression of a group of entries"
+        ipaths = group.ipaths
+        ns = {}
+        for name in group.names:
+            if name in FEFFDAT_VALUES:
+                ns[name] = self.fdat_values[name][ipaths]
+            elif name in CONSTANTS:
+                ns[name] = CONSTANTS[name]
+            elif name in FUNCTIONS:
+                ns[name] = FUNCTIONS[name]
+            elif name == 'sigma2_eins':
+                rmass = self.eins_rmass[ipaths]
+                def sigma2_eins(t, theta):
+                    theta = np.maximum(theta, 1.e-5)
+                    t = np.maximum(t, 1.e-5)
+                    return EINS_FACTOR/(theta*rmass*np.tanh(theta/(2.0*t)))
+                ns[name] = sigma2_eins
+            elif name == 'sigma2_debye':
+                paths = [self.pathlist[i] for i in ipaths]
+                def sigma2_debye(t, theta):
+                    t, theta = np.broadcast_arrays(t, theta, np.zeros(len(paths)))[:2]
+                    return np.array([_sigma2_debye_path(t_, theta_, path)
+                                     for t_, theta_, path in zip(t, theta, paths)])
+                ns[name] = sigma2_debye
+        for name in group.scalar_names:
+            val = symtable[name]
+            if not isinstance(val, (int, float, np.number)):
+                raise TypeError(f"'{name}' is not a number")
+            ns[name] = val
+        for dep in group.deps:
+            ipath, ipar = dep
+            ns[self.pathlist[ipath].pathpar_name(PATH_PARS[ipar])] = values[dep]
+        return ns
+
+    def __call__(self, params):
+        values = self.constants.copy()
+        symtable = params._asteval.symtable
+        for group in self.groups:
+            if group.failed:
+                self._eval_asteval(params, group.entries, values)
+                continue
+            try:
+                ns = self._namespace(group, symtable, values)
+                with np.errstate(all='ignore'):
+                    val = eval(group.code, {'__builtins__': {}}, ns)
+                val = np.broadcast_to(np.asarray(val, dtype='float64'),
+                                      group.ipaths.shape)
+            except Exception:
+                group.failed = True
+                self._eval_asteval(params, group.entries, values)
+                continue
+            values[group.ipaths, group.ipars] = val
+        self._eval_asteval(params, self.fallback, values)
+        return values
+
+    def _eval_asteval(self, params, entries, values):
+        "evaluate entries with asteval"
+        for ipath, ipar in entries:
+            path = self.pathlist[ipath]
+            path.store_feffdat()
+            par = params[path.pathpar_name(PATH_PARS[ipar])]
+            values[ipath, ipar] = par._getval()
+
+
+def pathparams_key(pathlist, params):
+    """key describing the Path Parameters for a list of paths: for each path,
+    the Feff.dat object and a tuple of (is_expression, expression or value)
+    for each Path Parameter"""
+    key = []
+    for path in pathlist:
+        pvals = []
+        for pname in PATH_PARS:
+            par = params[path.pathpar_name(pname)]
+            if par.expr is None:
+                pvals.append((False, par.value))
+            else:
+                pvals.append((True, par.expr))
+        key.append((id(path._feffdat), tuple(pvals)))
+    return tuple(key)
+
+
+def eval_pathparams(pathlist, params):
+    """evaluate Path Parameters for a list of FeffPath Groups.
+
+    Parameters:
+    ------------
+      pathlist:  list of FeffPath Groups
+      params:    lmfit Parameters holding the Path Parameters, as
+                 created with FeffPathGroup.create_path_params()
+
+    Returns:
+    ---------
+      array of shape (len(pathlist), len(PATH_PARS)) of values,
+      with values of 0 for paths that are not in use.
+
+    The compiled evaluator for a set of paths and Path Parameter
+    expressions is cached, so that expressions are compiled only
+    once for a fit.
+    """
+    out = np.zeros((len(pathlist), len(PATH_PARS)))
+    use = np.array([path.use for path in pathlist], dtype=bool)
+    if not use.any():
+        return out
+    active = [path for path in pathlist if path.use]
+    key = pathparams_key(active, params)
+    evaluator = _pathparams_cache.get(key, None)
+    if evaluator is None:
+        evaluator = PathParamEvaluator(active, params)
+        _pathparams_cache[key] = evaluator
+        while len(_pathparams_cache) > PATHPARAMS_CACHE_SIZE:
+            _pathparams_cache.popitem(last=False)
+    else:
+        _pathparams_cache.move_to_end(key)
+        evaluator.pathlist = active
+    out[use] = evaluator(params)
+    return out
+
+
+def pathparams_cache_clear():
+    "clear the cache of compiled Path Parameter evaluators"
+    _pathparams_cache.clear()
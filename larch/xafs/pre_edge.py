@@ -3,13 +3,14 @@
   XAFS pre-edge subtraction, normalization algorithms
 """
 import numpy as np
+from scipy.signal import fftconvolve
 
 from lmfit import Parameters, Minimizer, report_fit
 from xraydb import guess_edge
 from larch import Group, Make_CallArgs, parse_group_args
 
 from larch.math import (index_of, index_nearest, remove_dups, remove_nans2,
-                        interp, smooth, polyfit)
+                        interp, smooth, polyfit, lorentzian)
 from .xafsutils import set_xafsGroup, TINY_ENERGY
 
 MODNAME = '_xafs'
@@ -107,6 +108,58 @@ def _finde0(energy, mu, estep=None, use_smooth=True):
 def flat_resid(pars, en, mu):
     return pars['c0'] + en * (pars['c1'] + en * pars['c2']) - mu
 
+def _preedge_ranges(energy, e0, pre1=None, pre2=None, norm1=None,
+                    norm2=None, nnorm=None):
+    """energy ranges, polynomial degree, and index ranges for the pre-edge
+    and post-edge fits of preedge(), for e0 on the energy array"""
+    ie0 = index_nearest(energy, e0)
+    if pre1 is None:
+        # skip first energy point, often bad
+        if ie0 > 20:
+            pre1  = 5.0*round((energy[1] - e0)/5.0)
+        else:
+            pre1  = 2.0*round((energy[1] - e0)/2.0)
+
+    pre1 = max(pre1,  (min(energy) - e0))
+    if pre2 is None:
+        pre2 = 5.0*round(pre1/15.0)
+    if pre1 > pre2:
+        pre1, pre2 = pre2, pre1
+
+    if norm2 is None:
+        norm2 = 5.0*round((max(energy) - e0)/5.0)
+    if norm2 < 0:
+        norm2 = max(energy) - e0 - norm2
+    norm2 = min(norm2, (max(energy) - e0))
+    if norm1 is None:
+        norm1 = min(25, 5.0*round(norm2/15.0))
+
+    if norm1 > norm2+5:
+        norm1, norm2 = norm2, norm1
+
+    norm1 = min(norm1, norm2 - 10)
+
+    if nnorm is None:
+        nnorm = 2
+        if norm2-norm1 < 350: nnorm = 1
+        if norm2-norm1 <  50: nnorm = 0
+    nnorm = max(min(nnorm, MAX_NNORM), 0)
+    # preedge
+    p1 = index_of(energy, pre1+e0)
+    p2 = index_nearest(energy, pre2+e0)
+    if p2-p1 < 2:
+        p2 = min(len(energy), p1 + 2)
+
+    pslice = (p1, p2)
+    # normalization
+    p1 = index_of(energy, norm1+e0)
+    p2 = index_nearest(energy, norm2+e0)
+    if p2-p1 < 2:
+        p2 = min(len(energy), p1 + 2)
+    if p2-p1 < 2:
+        p1 = p1-2
+    return pre1, pre2, norm1, norm2, nnorm, pslice, (p1, p2)
+
 def preedge(energy, mu, e0=None, step=None, nnorm=None, nvict=0, pre1=None,
             pre2=None, norm1=None, norm2=None):
     """pre edge subtraction, normalization for XAFS (straight python)
@@ -163,55 +216,16 @@ def preedge(energy, mu, e0=None, step=None, nnorm=None, nvict=0, pre1=None,
     ie0 = index_nearest(energy, e0)
     e0 = energy[ie0]
 
-    if pre1 is None:
-        # skip first energy point, often bad
-        if ie0 > 20:
-            pre1  = 5.0*round((energy[1] - e0)/5.0)
-        else:
-            pre1  = 2.0*round((energy[1] - e0)/2.0)
-
-    pre1 = max(pre1,  (min(energy) - e0))
-    if pre2 is None:
-        pre2 = 5.0*round(pre1/15.0)
-    if pre1 > pre2:
-        pre1, pre2 = pre2, pre1
-
-    if norm2 is None:
-        norm2 = 5.0*round((max(energy) - e0)/5.0)
-    if norm2 < 0:
-        norm2 = max(energy) - e0 - norm2
-    norm2 = min(norm2, (max(energy) - e0))
-    if norm1 is None:
-        norm1 = min(25, 5.0*round(norm2/15.0))
-
-    if norm1 > norm2+5:
-        norm1, norm2 = norm2, norm1
-
-    norm1 = min(norm1, norm2 - 10)
-
-    if nnorm is None:
-        nnorm = 2
-        if norm2-norm1 < 350: nnorm = 1
-        if norm2-norm1 <  50: nnorm = 0
-    nnorm = max(min(nnorm, MAX_NNORM), 0)
-    # preedge
-    p1 = index_of(energy, pre1+e0)
-    p2 = index_nearest(energy, pre2+e0)
-    if p2-p1 < 2:
-        p2 = min(len(energy), p1 + 2)
-
+    pre1, pre2, norm1, norm2, nnorm, pslice, nslice = _preedge_ranges(
+        energy, e0, pre1=pre1, pre2=pre2, norm1=norm1, norm2=norm2,
+        nnorm=nnorm)
+    p1, p2 = pslice
     omu  = mu*energy**nvict
     ex, mx = remove_nans2(energy[p1:p2], omu[p1:p2])
     precoefs = polyfit(ex, mx, 1)
     pre_edge = (precoefs[0] + energy*precoefs[1]) * energy**(-nvict)
     # normalization
-    p1 = index_of(energy, norm1+e0)
-    p2 = index_nearest(energy, norm2+e0)
-    if p2-p1 < 2:
-        p2 = min(len(energy), p1 + 2)
-    if p2-p1 < 2:
-        p1 = p1-2
-
+    p1, p2 = nslice
     presub = (mu-pre_edge)[p1:p2]
     coefs = polyfit(energy[p1:p2], presub, nnorm)
     post_edge = 1.0*pre_edge
@@ -391,6 +405,348 @@ def pre_edge(energy, mu=None, group=None, e0=None, step=None, nnorm=None,
         if group.edge is None:  group.edge = _edge
     return
 
+def _interp_rows(x, y, xnew):
+    """linear interpolation of each row of y(x) onto xnew, as np.interp()"""
+    idx = np.clip(np.searchsorted(x, xnew, side='right') - 1, 0, len(x)-2)
+    frac = np.clip((xnew - x[idx])/(x[idx+1] - x[idx]), 0.0, 1.0)
+    return y[:, idx]*(1.0-frac) + y[:, idx+1]*frac
+
+def _smooth_rows(x, y, xstep, sigma, npad=5):
+    """smooth each row of y(x) with a lorentzian, as smooth() does for one
+    array, with the convolutions for all rows done together"""
+    xmin = xstep * int( (min(x) - npad*xstep)/xstep)
+    xmax = xstep * int( (max(x) + npad*xstep)/xstep)
+    npts1 = 1 + int(abs(xmax-xmin+xstep*0.1)/xstep)
+    npts = min(npts1, 50*len(x))
+    x0  = np.linspace(xmin, xmax, npts)
+    y0  = _interp_rows(x, y, x0)
+    win = lorentzian(np.arange(2*npts), center=npts, sigma=sigma/xstep)
+    y1 = np.concatenate((y0[:, npts:0:-1], y0, y0[:, -1:-npts-1:-1]), axis=1)
+    y2 = fftconvolve(y1, (win/win.sum())[np.newaxis, :], mode='valid', axes=1)
+    if y2.shape[1] > len(x0):
+        nex = int((y2.shape[1] - len(x0))/2)
+        y2 = (y2[:, nex:])[:, :len(x0)]
+    return _interp_rows(x0, y2, x)
+
+def _finde0_rows(en, mu, estep, use_smooth=True):
+    """index of e0 for each row of mu(en), as _finde0() for one spectrum"""
+    nmin = max(2, int(len(en)*0.01))
+    dmu = np.gradient(mu, axis=1)/np.gradient(en)
+    if use_smooth:
+        dmu = _smooth_rows(en, dmu, estep, 3*estep)
+    dmu[np.where(~np.isfinite(dmu))] = -1.0
+    dm_min = dmu[:, nmin:-nmin].min(axis=1)
+    dm_ptp = np.maximum(1.e-10, np.ptp(dmu[:, nmin:-nmin], axis=1))
+    dmu = (dmu - dm_min[:, np.newaxis])/dm_ptp[:, np.newaxis]
+
+    # threshold for high derivative, lowered for rows with too few points
+    dhigh = 0.60 if len(en) > 20 else 0.30
+    nhigh = [(dmu > dhigh*scale).sum(axis=1) for scale in (1, 0.5, 0.25)]
+    thresh = np.where(nhigh[0] >= 3, dhigh,
+                      np.where(nhigh[1] > 3, dhigh*0.5, dhigh*0.25))
+    high = dmu > thresh[:, np.newaxis]
+    high[(high.sum(axis=1) < 3)] = True
+
+    # points with both neighbors also of high derivative
+    ok = np.zeros(high.shape, dtype=bool)
+    ok[:, 1:-1] = high[:, 1:-1] & high[:, :-2] & high[:, 2:]
+    ok[:, :nmin] = False
+    ok[:, len(en)-nmin+1:] = False
+    dcand = np.where(ok, dmu, 0.0)
+    imax = dcand.argmax(axis=1)
+    imax[dcand.max(axis=1) <= 0] = 0
+    return imax
+
+def find_e0_batch(energy, mu):
+    """calculate :math:`E_0` for each spectrum of a set of spectra
+    sharing one energy array, as find_e0() does for one spectrum.
+
+    Arguments:
+        energy (ndarray):  1-d array of x-ray energies, in eV
+        mu (ndarray):      2-d array (nspectra, npts) of mu(E) values
+
+    Returns:
+        1-d array of e0 values, one per spectrum.
+    """
+    energy = remove_dups(np.asarray(energy, dtype='float64').squeeze(),
+                         tiny=TINY_ENERGY)
+    mu = np.atleast_2d(np.asarray(mu, dtype='float64'))
+    estep = find_energy_step(energy)/2.0
+    ie0 = _finde0_rows(energy, mu, estep, use_smooth=False)
+    # refine with smoothing, over windows around the first estimates
+    istart = np.maximum(2, ie0-75)
+    istop = np.minimum(ie0+75, len(energy)-2)
+    e0 = np.zeros(len(mu))
+    windows, index = np.unique(np.column_stack((istart, istop)), axis=0,
+                               return_inverse=True)
+    index = index.ravel()
+    for iwin, (i1, i2) in enumerate(windows):
+        rows = np.where(index == iwin)[0]
+        en = remove_dups(energy[i1:i2], tiny=TINY_ENERGY)
+        ix = _finde0_rows(en, mu[rows, i1:i2], estep, use_smooth=True)
+        e0[rows] = np.where(ix < 1, energy[i1+2], en[ix])
+    return e0
+
+def _polyfit_rows(x, y, deg):
+    """polynomial fits of degree deg to each row of y(x), with coefficients
+    as from polyfit(), with one least-squares solution for all rows"""
+    deg = int(deg)
+    dom = np.polynomial.polyutils.getdomain(x)
+    off, scl = np.polynomial.polyutils.mapparms(dom, [-1, 1])
+    coefs = np.polynomial.polynomial.polyfit(off + scl*x, y.T, deg)
+    # matrix converting from scaled to unscaled x for each power
+    convert = np.zeros((deg+1, deg+1))
+    for i in range(deg+1):
+        basis = np.zeros(deg+1)
+        basis[i] = 1.0
+        cval = np.polynomial.Polynomial(basis, domain=dom).convert().coef
+        convert[:len(cval), i] = cval
+    return (convert @ coefs.reshape((deg+1, -1))).T
+
+def preedge_batch(energy, mu, e0=None, step=None, nnorm=None, nvict=0,
+                  pre1=None, pre2=None, norm1=None, norm2=None):
+    """pre edge subtraction, normalization for a set of XAFS spectra
+    sharing one energy array, as from preedge() for each spectrum.
+
+    Arguments
+    ----------
+    energy:  1-d array of x-ray energies, in eV
+    mu:      2-d array (nspectra, npts) of mu(E)
+    e0:      edge energy or array of edge energies, one per spectrum.
+             If None, they will be determined here.
+    step:    edge jump or array of edge jumps. If None, they will be
+             determined here.
+
+    all other arguments are as for preedge().
+
+    Returns
+    -------
+      dictionary with the elements of preedge(), as arrays with one value
+      or row per spectrum.  `norm_coefs` has shape (nspectra, max(nnorm)+1),
+      with coefficients of 0 for spectra with smaller nnorm.
+
+    Notes
+    -----
+      Spectra with the same e0 use the same fit ranges, and the pre-edge
+      lines and post-edge polynomials for these are found with a single
+      least-squares solution.  Spectra with NaNs or Infs are processed
+      one at a time with preedge().
+    """
+    energy = remove_dups(np.asarray(energy, dtype='float64').squeeze(),
+                         tiny=TINY_ENERGY)
+    if energy.size <= 1:
+        raise ValueError("energy array must have at least 2 points")
+    mu = np.atleast_2d(np.asarray(mu, dtype='float64'))
+    nspec, npts = mu.shape
+    if npts != len(energy):
+        raise ValueError("mu must have shape (nspectra, len(energy))")
+
+    e0s = np.full(nspec, np.nan)
+    if e0 is not None:
+        e0s[:] = np.asarray(e0, dtype='float64')
+    steps = np.full(nspec, np.nan)
+    if step is not None:
+        steps[:] = np.asarray(step, dtype='float64')
+
+    out = {'e0': np.zeros(nspec), 'edge_step': np.zeros(nspec),
+           'norm': np.zeros((nspec, npts)),
+           'pre_edge': np.zeros((nspec, npts)),
+           'post_edge': np.zeros((nspec, npts)),
+           'precoefs': np.zeros((nspec, 2)), 'nvict': nvict,
+           'nnorm': np.zeros(nspec, dtype=int),
+           'norm_coefs': np.zeros((nspec, MAX_NNORM+1))}
+    for attr in ('pre1', 'pre2', 'norm1', 'norm2'):
+        out[attr] = np.zeros(nspec)
+
+    def _save(rows, dat):
+        for attr in ('e0', 'edge_step', 'norm', 'pre_edge', 'post_edge',
+                     'precoefs', 'nnorm', 'pre1', 'pre2', 'norm1', 'norm2'):
+            out[attr][rows] = dat[attr]
+        coefs = np.atleast_2d(dat['norm_coefs'])
+        out['norm_coefs'][rows, :coefs.shape[1]] = coefs
+
+    finite = np.isfinite(mu).all(axis=1)
+    for i in np.where(~finite)[0]:
+        _save(i, preedge(energy, mu[i], e0=None if np.isnan(e0s[i]) else e0s[i],
+                         step=None if np.isnan(steps[i]) else steps[i],
+                         nnorm=nnorm, nvict=nvict, pre1=pre1, pre2=pre2,
+                         norm1=norm1, norm2=norm2))
+
+    find = finite & ~((e0s >= energy[1]) & (e0s <= energy[-2]))
+    if find.any():
+        e0s[find] = find_e0_batch(energy, mu[find])
+
+    # spectra with the same e0 share fit ranges
+    e0vals, index = np.unique(e0s[finite], return_inverse=True)
+    index = index.ravel()
+    rows_finite = np.where(finite)[0]
+    for ie, e0val in enumerate(e0vals):
+        rows = rows_finite[index == ie]
+        ie0 = index_nearest(energy, e0val)
+        e0val = energy[ie0]
+        pre_1, pre_2, norm_1, norm_2, n_norm, pslice, nslice = _preedge_ranges(
+            energy, e0val, pre1=pre1, pre2=pre2, norm1=norm1, norm2=norm2,
+            nnorm=nnorm)
+        mus = mu[rows]
+        p1, p2 = pslice
+        omu = mus[:, p1:p2]*energy[p1:p2]**nvict
+        precoefs = _polyfit_rows(energy[p1:p2], omu, 1)
+        pre_edge = ((precoefs[:, 0:1] + energy*precoefs[:, 1:2])
+                    * energy**(-nvict))
+        p1, p2 = nslice
+        coefs = _polyfit_rows(energy[p1:p2], (mus-pre_edge)[:, p1:p2], n_norm)
+        post_edge = 1.0*pre_edge
+        for n in range(coefs.shape[1]):
+            post_edge += coefs[:, n:n+1] * energy**(n)
+        edge_step = steps[rows]
+        unset = np.isnan(edge_step)
+        edge_step[unset] = (post_edge[:, ie0] - pre_edge[:, ie0])[unset]
+        edge_step = np.maximum(1.e-12, abs(edge_step))
+        _save(rows, {'e0': e0val, 'edge_step': edge_step,
+                     'norm': (mus - pre_edge)/edge_step[:, np.newaxis],
+                     'pre_edge': pre_edge, 'post_edge': post_edge,
+                     'precoefs': precoefs, 'norm_coefs': coefs,
+                     'nnorm': n_norm, 'pre1': pre_1, 'pre2': pre_2,
+                     'norm1': norm_1, 'norm2': norm_2})
+    out['norm_coefs'] = out['norm_coefs'][:, :out['nnorm'].max()+1]
+    return out
+
+def pre_edge_batch(energy, mu, groups=None, e0=None, step=None, nnorm=None,
+                   nvict=0, pre1=None, pre2=None, norm1=None, norm2=None,
+                   make_flat=True, _larch=None):
+    """pre edge subtraction, normalization for a set of XAFS spectra
+    sharing one energy array, as from pre_edge() for each spectrum.
+
+    Arguments
+    ----------
+    energy:  1-d array of x-ray energies, in eV
+    mu:      2-d array (nspectra, npts) of mu(E)
+    groups:  list of output groups (and input groups for e0), one per
+             spectrum.  If None, new groups with `energy` and `mu` will
+             be created.
+    e0:      edge energy or array of edge energies, one per spectrum.
+             If None, they will be determined here.
+    step:    edge jump or array of edge jumps. If None, they will be
+             determined here.
+
+    all other arguments are as for pre_edge().
+
+    Returns
+    -------
+      list of groups, with outputs written as by pre_edge().
+
+    Notes
+    -----
+      1. The normalization is done with preedge_batch().
+      2. The quadratic for `flat_alt` is found by linear least-squares for
+         all spectra with the same e0 together, and agrees with the fit
+         done in pre_edge() to the precision of that fit.
+      3. Spectra with NaNs or Infs are processed one at a time with
+         pre_edge().
+    """
+    energy = np.asarray(energy, dtype='float64').squeeze()
+    mu = np.atleast_2d(np.asarray(mu, dtype='float64'))
+    nspec, npts = mu.shape
+    if groups is None:
+        groups = [Group(energy=energy, mu=mu[i]) for i in range(nspec)]
+    if len(groups) != nspec:
+        raise ValueError('pre_edge_batch() needs one group per spectrum')
+
+    e0s = np.full(nspec, np.nan)
+    if e0 is not None:
+        e0s[:] = np.asarray(e0, dtype='float64')
+    else:
+        for i, grp in enumerate(groups):
+            if getattr(grp, 'e0', None) is not None:
+                e0s[i] = grp.e0
+    steps = np.full(nspec, np.nan)
+    if step is not None:
+        steps[:] = np.asarray(step, dtype='float64')
+
+    finite = np.isfinite(mu).all(axis=1)
+    for i in np.where(~finite)[0]:
+        pre_edge(energy, mu[i], group=groups[i],
+                 e0=None if np.isnan(e0s[i]) else e0s[i],
+                 step=None if np.isnan(steps[i]) else steps[i],
+                 nnorm=nnorm, nvict=nvict, pre1=pre1, pre2=pre2,
+                 norm1=norm1, norm2=norm2, make_flat=make_flat, _larch=_larch)
+    rows = np.where(finite)[0]
+    if len(rows) == 0:
+        return groups
+
+    pre_dat = preedge_batch(energy, mu[rows], e0=e0s[rows], step=steps[rows],
+                            nnorm=nnorm, nvict=nvict, pre1=pre1, pre2=pre2,
+                            norm1=norm1, norm2=norm2)
+    norm = pre_dat['norm']
+    flat = 1.0*norm
+    flat_alt, flat_coefs = None, None
+    en = remove_dups(energy, tiny=TINY_ENERGY)
+    e0vals, index = np.unique(pre_dat['e0'], return_inverse=True)
+    index = index.ravel()
+    if make_flat:
+        flat_alt, flat_coefs = 1.0*norm, np.zeros((len(rows), 3))
+        for ie, e0val in enumerate(e0vals):
+            sel = np.where(index == ie)[0]
+            isel = sel[0]
+            ie0 = index_nearest(en, e0val)
+            p1 = index_of(en, pre_dat['norm1'][isel]+e0val)
+            p2 = index_nearest(en, pre_dat['norm2'][isel]+e0val)
+            if p2-p1 < 2:
+                p2 = min(len(en), p1 + 2)
+            residue = ((pre_dat['post_edge'][sel] - pre_dat['pre_edge'][sel])
+                       / pre_dat['edge_step'][sel, np.newaxis])
+            fsel = norm[sel] - residue + residue[:, ie0:ie0+1]
+            fsel[:, :ie0] = norm[sel, :ie0]
+            flat[sel] = fsel
+
+            # flat_resid() is linear in its coefficients
+            deg = min(2, pre_dat['nnorm'][isel])
+            coefs = _polyfit_rows(en[p1:p2], norm[sel, p1:p2], deg)
+            flat_coefs[sel, :deg+1] = coefs
+            fc0, fc1, fc2 = (flat_coefs[sel, i:i+1] for i in range(3))
+            flat_diff = fc0 + en * (fc1 + en * fc2)
+            fsel = norm[sel] - flat_diff + flat_diff[:, ie0:ie0+1]
+            fsel[:, :ie0] = norm[sel, :ie0]
+            flat_alt[sel] = fsel
+
+    dmude = np.gradient(norm, axis=1)/np.gradient(energy)
+    d2mude = np.gradient(dmude, axis=1)/np.gradient(energy)
+    edges = {e0val: guess_edge(e0val) for e0val in e0vals}
+    for j, i in enumerate(rows):
+        group = groups[i]
+        group.e0 = pre_dat['e0'][j]
+        group.norm = norm[j]
+        group.flat = flat[j]
+        group.norm_poly = 1.0*norm[j]
+        if make_flat:
+            group.flat_coefs = tuple(flat_coefs[j])
+            group.flat_alt = flat_alt[j]
+        group.dmude = dmude[j]
+        group.d2mude = d2mude[j]
+        group.edge_step = pre_dat['edge_step'][j]
+        group.edge_step_poly = pre_dat['edge_step'][j]
+        group.pre_edge = pre_dat['pre_edge'][j]
+        group.post_edge = pre_dat['post_edge'][j]
+
+        nnorm_j = int(pre_dat['nnorm'][j])
+        group.pre_edge_details = details = Group()
+        for attr in ('pre1', 'pre2', 'norm1', 'norm2'):
+            setattr(details, attr, pre_dat[attr][j])
+        details.nnorm = nnorm_j
+        details.nvict = nvict
+        details.pre_slope = pre_dat['precoefs'][j, 0]
+        details.pre_offset = pre_dat['precoefs'][j, 1]
+        for n in range(nnorm_j+1):
+            setattr(details, 'norm_c%i' % n, pre_dat['norm_coefs'][j, n])
+
+        group.atsym = getattr(group, 'atsym', None)
+        group.edge = getattr(group, 'edge', None)
+        if group.atsym is None or group.edge is None:
+            _atsym, _edge = edges[pre_dat['e0'][j]]
+            if group.atsym is None: group.atsym = _atsym
+            if group.edge is None:  group.edge = _edge
+    return groups
+
 def energy_align(group, reference, array='dmude', emin=-15, emax=35):
     """
     align XAFS data group to a reference group
@@ -17,6 +17,7 @@ mu_elam         X-ray attenuation coefficients from Elam etal
 mu_chantler     X-ray attenuation coefficients from Chantler
 xray_edges      X-ray absorption edges for an element
 xray_lines      X-ray emission lines for an element
+xraydb_cache_clear  clear cache of X-ray data used for XRF models
 """
 
 from larch.utils.physical_constants import ATOM_SYMS
@@ -35,6 +36,8 @@ from xraydb.materials import (get_material, add_material, material_mu,
 material_add = add_material
 material_get = get_material
 
+from .xraydb_cache import xraydb_cache_clear
+
 # from .cromer_liberman import f1f2 as f1f2_cl
 from .background import XrayBackground
 
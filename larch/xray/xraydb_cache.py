@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Cached lookups of X-ray data from xraydb.
+
+The functions here take the same arguments and give the same values as
+the xraydb functions of the same name, but keep the results in a single
+process-wide cache, so that building the same XRF_Element or XRF_Material
+again (as for GUI sessions and batch fits) does not query the xraydb
+database.  Results are keyed by the function, the element or material
+formula, the energies (with arrays keyed by their shape and contents),
+and any other arguments such as `kind`.
+
+The cache holds at most XRAYDB_CACHE_SIZE results, with the least
+recently used results removed first, and is cleared with
+
+   xraydb_cache_clear()
+
+Arrays returned from the cache are read-only.
+"""
+from collections import OrderedDict
+import numpy as np
+import xraydb
+
+XRAYDB_CACHE_SIZE = 512
+_xraydb_cache = OrderedDict()
+
+
+def _energy_key(energy):
+    "key for an energy value or array of energies"
+    energy = np.asarray(energy, dtype='float64')
+    if energy.ndim == 0:
+        return float(energy)
+    return (energy.shape, energy.tobytes())
+
+
+def _cached(func, key, *args, **kws):
+    "value of func(*args, **kws), from the cache if available"
+    key = (func.__name__,) + key
+    out = _xraydb_cache.get(key, None)
+    if out is None:
+        out = func(*args, **kws)
+        if isinstance(out, np.ndarray):
+            out.setflags(write=False)
+        _xraydb_cache[key] = out
+        while len(_xraydb_cache) > XRAYDB_CACHE_SIZE:
+            _xraydb_cache.popitem(last=False)
+    else:
+        _xraydb_cache.move_to_end(key)
+    if isinstance(out, dict):
+        out = out.copy()
+    return out
+
+
+def mu_elam(element, energy, kind='total'):
+    """X-ray mass attenuation coefficient, mu/rho, in cm^2/gr for an
+    element, as xraydb.mu_elam"""
+    return _cached(xraydb.mu_elam, (element, _energy_key(energy), kind),
+                   element, energy, kind=kind)
+
+
+def material_mu(name, energy, density=None, kind='total'):
+    """X-ray attenuation length, in 1/cm, for a material (name or
+    formula), as xraydb.material_mu"""
+    return _cached(xraydb.material_mu, (name, _energy_key(energy), kind, density),
+                   name, energy, density=density, kind=kind)
+
+
+def xray_edges(element):
+    """dict of X-ray absorption edges for an element, as xraydb.xray_edges"""
+    return _cached(xraydb.xray_edges, (element,), element)
+
+
+def xray_edge(element, edge, energy_only=False):
+    """X-ray absorption edge for an element, as xraydb.xray_edge"""
+    return _cached(xraydb.xray_edge, (element, edge, energy_only),
+                   element, edge, energy_only=energy_only)
+
+
+def xray_lines(element, initial_level=None, excitation_energy=None):
+    """dict of X-ray emission lines for an element, as xraydb.xray_lines"""
+    key = (element, initial_level, excitation_energy)
+    return _cached(xraydb.xray_lines, key, element,
+                   initial_level=initial_level,
+                   excitation_energy=excitation_energy)
+
+
+def xray_line(element, line):
+    """X-ray emission line for an element, as xraydb.xray_line"""
+    return _cached(xraydb.xray_line, (element, line), element, line)
+
+
+def ck_probability(element, initial, final, total=True):
+    """Coster-Kronig transition probability for an element,
+    as xraydb.ck_probability"""
+    return _cached(xraydb.ck_probability, (element, initial, final, total),
+                   element, initial, final, total=total)
+
+
+def xraydb_cache_clear():
+    "clear the cache of X-ray data lookups"
+    _xraydb_cache.clear()
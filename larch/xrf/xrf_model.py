@@ -1,21 +1,28 @@
-from collections import namedtuple
+from collections import namedtuple, deque, OrderedDict
 import time
 import json
+import pickle
+import warnings
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
 import numpy as np
 from numpy.linalg import lstsq
 from scipy.optimize import nnls
+from scipy.signal import fftconvolve
 
 
 from lmfit import  Parameters, minimize, fit_report
 
-from xraydb import (material_mu, mu_elam, ck_probability, xray_edge,
-                    xray_edges, xray_lines, xray_line)
 from xraydb.xray import XrayLine
 
 from .. import Group
-from ..math import index_of, interp, savitzky_golay, hypermet, erfc
+from ..xray.xraydb_cache import (material_mu, mu_elam, ck_probability,
+                                 xray_edge, xray_edges, xray_lines, xray_line)
+from ..math import index_of, savitzky_golay, hypermet, erfc
+from ..math.nnls import nnls_normal
 from ..xafs import ftwindow
-from ..utils import group2dict, json_dump, json_load, gformat, unixpath
+from ..utils import (group2dict, json_dump, json_load, gformat, unixpath,
+                     fix_varname)
 
 xrf_prediction = namedtuple("xrf_prediction", ("weights", "total"))
 xrf_peak = namedtuple('xrf_peak', ('name', 'amplitude', 'center', 'step',
@@ -25,6 +32,9 @@ xrf_peak = namedtuple('xrf_peak', ('name', 'amplitude', 'center', 'step',
 
 predict_methods = {'lstsq': lstsq, 'nnls': nnls}
 
+# number of unit-amplitude component spectra kept by each XRF_Model
+XRF_BASIS_CACHE_SIZE = 16
+
 # Note on units:  energies are in keV, lengths in cm
 
 
@@ -46,7 +56,8 @@ class XRF_Material:
         self.mu_total = self.mu_photo = None
 
     def calc_mu(self, energy):
-        "calculate mu for energy in keV"
+        """calculate mu for energy in keV, with values for each
+        material and energy array cached for the whole process"""
         # note material_mu works in eV!
         self.mu_total = material_mu(self.material, 1000*energy,
                                     density=self.density,
@@ -55,6 +66,15 @@ class XRF_Material:
                                     density=self.density,
                                     kind='photo')
 
+    def get_mu(self, energy, kind='total'):
+        """mu for energy in keV, calculated only if not already found:
+        changing the thickness does not need mu to be recalculated"""
+        if self.mu_total is None:
+            self.calc_mu(energy)
+        if kind == 'photo':
+            return self.mu_photo
+        return self.mu_total
+
     def absorbance(self, energy, thickness=None, kind='total'):
         """calculate absorbance (fraction absorbed)
 
@@ -69,14 +89,7 @@ class XRF_Material:
         """
         if thickness is None:
             thickness = self.thickness
-        if self.mu_total is None:
-            self.calc_mu(energy)
-        mu = self.mu_total
-        if kind == 'photo':
-            mu = self.mu_photo
-
-        t = 0.1*thickness
-        return (1.0 - np.exp(-t*mu))
+        return 1.0 - np.exp(-0.1*thickness*self.get_mu(energy, kind=kind))
 
     def transmission(self, energy, thickness=None, kind='total'):
         """calculate transmission (fraction transmitted through material)
@@ -90,17 +103,9 @@ class XRF_Material:
         -------
         fraction of X-rays transmitted through material
         """
-
         if thickness is None:
             thickness = self.thickness
-        if self.mu_total is None:
-            self.calc_mu(energy)
-        mu = self.mu_total
-        if kind == 'photo':
-            mu = self.mu_photo
-
-        t = 0.1*thickness
-        return np.exp(-t*mu)
+        return np.exp(-0.1*thickness*self.get_mu(energy, kind=kind))
 
 
 class XRF_Element:
@@ -254,8 +259,10 @@ class XRF_Model:
         self.use_pileup = False
         self.use_escape = False
         self.escape_scale = None
+        self.linear_amps = []
         self.script = ''
         self.mca = None
+        self._basis_cache = OrderedDict()
         if bgr is not None:
             self.add_background(bgr)
 
@@ -391,9 +398,13 @@ class XRF_Model:
         if params is None:
             params = self.params
         pars = params.valuesdict()
-        self.comps = {}
-        self.eigenvalues = {}
+        units, amps = self._unit_spectra(energy, pars)
+        return self._sum_spectrum(energy, pars, units, amps)
 
+    def _unit_spectra(self, energy, pars):
+        """spectra for components with unit amplitudes, and their amplitudes,
+        as dicts with keys of component names"""
+        units, amps = {}, {}
         det_noise = pars['det_noise']
         step = pars['peak_step']
         tail = pars['peak_tail']
@@ -444,26 +455,21 @@ class XRF_Model:
         #     self.calc_matrix_attenuation(energy)
         # atten *= self.matrix_atten
 
-        nlines = 0
-        for elem in self.elements:
-            comp = 0. * energy
+        # unit-amplitude spectra for elements and scatter peaks are cached,
+        # and recalculated only when parameters affecting their shapes change
+        shape_key = (energy.tobytes(), np.asarray(self.atten).tobytes(),
+                     np.asarray(self.escape_amp).tobytes(), self.count_time,
+                     det_noise, gamma)
+        elems = tuple(elem.symbol for elem in self.elements)
+        basis = self._cached_basis(('elements', elems, step, tail, beta) + shape_key,
+                                   self._element_basis, energy, det_noise,
+                                   step, tail, beta, gamma)
+        for i, elem in enumerate(self.elements):
             amp = pars.get('amp_%s' % elem.symbol.lower(), None)
             if amp is None:
                 continue
-            for key, line in elem.lines.items():
-                ecen = 0.001*line.energy
-                nlines += 1
-                line_amp = line.intensity * elem.mu * elem.fyields[line.initial_level]
-                sigma = self.det_sigma(ecen, det_noise)
-                comp += hypermet(energy, amplitude=line_amp, center=ecen,
-                                 sigma=sigma, step=step, tail=tail,
-                                 beta=beta, gamma=gamma)
-            comp *= amp * self.atten * self.count_time
-            comp += self.escape_amp * interp(energy-self.escape_energy, comp, energy)
-
-            self.comps[elem.symbol] = comp
-            self.eigenvalues[elem.symbol] = amp
-
+            units[elem.symbol] = basis[:, i]
+            amps[elem.symbol] = amp
 
         # scatter peaks for Rayleigh and Compton
         for peak in self.scatter:
@@ -471,24 +477,25 @@ class XRF_Model:
             amp  = pars.get('%s_amp' % p, None)
             if amp is None:
                 continue
-            ecen = pars['%s_center' % p]
-            step = pars['%s_step' % p]
-            tail = pars['%s_tail' % p]
-            beta = pars['%s_beta' % p]
-            sigma = pars['%s_sigmax' % p]
-            sigma *= self.det_sigma(ecen, det_noise)
-            comp = hypermet(energy, amplitude=1.0, center=ecen,
-                            sigma=sigma, step=step, tail=tail, beta=beta,
-                            gamma=gamma)
-            comp *= amp * self.atten * self.count_time
-            comp += self.escape_amp * interp(energy-self.escape_energy, comp, energy)
-            self.comps[p] = comp
-            self.eigenvalues[p] = amp
+            shape = [pars['%s_%s' % (p, attr)]
+                     for attr in ('center', 'step', 'tail', 'beta', 'sigmax')]
+            units[p] = self._cached_basis(('scatter', p, *shape) + shape_key,
+                                          self._scatter_basis, energy, det_noise,
+                                          *shape, gamma)
+            amps[p] = amp
 
         if self.bgr is not None:
-            bgr_amp = pars.get('background_amp', 0.0)
-            self.comps['background'] = bgr_amp * self.bgr
-            self.eigenvalues['background'] = bgr_amp
+            units['background'] = self.bgr
+            amps['background'] = pars.get('background_amp', 0.0)
+        return units, amps
+
+    def _sum_spectrum(self, energy, pars, units, amps):
+        "total spectrum from unit spectra and amplitudes, adding pileup"
+        self.comps = {}
+        self.eigenvalues = {}
+        for name, unit in units.items():
+            self.comps[name] = amps[name] * unit
+            self.eigenvalues[name] = amps[name]
 
         # calculate total spectrum
         total = 0. * energy
@@ -497,8 +504,7 @@ class XRF_Model:
 
         if self.use_pileup:
             pamp = pars.get('pileup_amp', 0.0)
-            npts = len(energy)
-            pileup = pamp*1.e-9*np.convolve(total, total*1.0, 'full')[:npts]
+            pileup = self._pileup(total, pamp, npts=self._pileup_npts())
             self.comps['pileup'] = pileup
             self.eigenvalues['pileup'] = pamp
             total += pileup
@@ -509,6 +515,130 @@ class XRF_Model:
         self.current_model = total
         return total
 
+    def _pileup_npts(self):
+        """number of points needed for the pileup spectrum: during a fit,
+        only up to the end of the fit range"""
+        if self.fit_in_progress:
+            return self.imax
+        return None
+
+    def _pileup(self, total, pamp, npts=None):
+        """pileup spectrum for a total spectrum, as the self-convolution
+        of total (computed with FFTs).  If npts is given, only the first
+        npts points, which depend only on total[:npts], are calculated."""
+        pileup = np.zeros(len(total))
+        if npts is None or npts > len(total):
+            npts = len(total)
+        if npts > 0:
+            spec = total[:npts]
+            pileup[:npts] = fftconvolve(spec, spec, mode='full')[:npts]
+        # remove negative round-off from the FFTs
+        return pamp*1.e-9*np.maximum(pileup, 0)
+
+    def _add_escape(self, energy, comps):
+        """add escape peaks to component spectra, for an array of shape
+        (npts,) or (npts, ncomps): the spectra shifted down by the escape
+        energy, scaled by escape_amp"""
+        if not np.any(self.escape_amp):
+            return comps
+        # linear interpolation of all spectra onto energy+escape_energy
+        # (extrapolating past the last point), as a 2-point stencil
+        xesc = energy - self.escape_energy
+        idx = np.clip(np.searchsorted(xesc, energy) - 1, 0, len(energy)-2)
+        frac = (energy - xesc[idx]) / (xesc[idx+1] - xesc[idx])
+        scale = np.asarray(self.escape_amp) * np.ones(len(energy))
+        if comps.ndim > 1:
+            frac, scale = frac[:, None], scale[:, None]
+        return comps + scale * ((1-frac)*comps[idx] + frac*comps[idx+1])
+
+    def _amplitude_names(self):
+        "names of amplitude Parameters for components"
+        names = {elem.symbol: 'amp_%s' % elem.symbol.lower()
+                 for elem in self.elements}
+        for peak in self.scatter:
+            names[peak.name] = '%s_amp' % peak.name
+        names['background'] = 'background_amp'
+        return names
+
+    def _solve_amplitudes(self, energy, pars, data):
+        """unit spectra and amplitudes for components, with amplitudes of
+        the components in self.linear_amps found by weighted non-negative
+        linear least-squares fit to data"""
+        units, amps = self._unit_spectra(energy, pars)
+        names = [name for name in units if name in self.linear_amps]
+        fit = slice(self.imin, self.imax)
+        weight = self.fit_weight[fit]
+        basis = np.array([units[name][fit]*weight for name in names]).T
+        btb = basis.T @ basis
+        fixed = 0. * energy
+        for name in units:
+            if name not in names:
+                fixed += amps[name] * units[name]
+
+        def solve(target):
+            vals = nnls_normal(btb, basis.T @ (target[fit]*weight))
+            amps.update(zip(names, vals))
+
+        solve(data - fixed)
+        if self.use_pileup:
+            # solve again, after removing pileup for the first solution
+            total = 0. * energy
+            for name, unit in units.items():
+                total += amps[name] * unit
+            solve(data - fixed - self._pileup(total, pars.get('pileup_amp', 0.0),
+                                              npts=self._pileup_npts()))
+        return units, amps
+
+    def __resid_separable(self, params, data, index):
+        pars = params.valuesdict()
+        self.best_en = (pars['cal_offset'] + pars['cal_slope'] * index +
+                        pars['cal_quad'] * index**2)
+        self.fit_iter += 1
+        units, amps = self._solve_amplitudes(self.best_en, pars, data)
+        model = self._sum_spectrum(self.best_en, pars, units, amps)
+        if callable(self.iter_callback):
+            self.iter_callback(iter=self.fit_iter, pars=pars)
+        return ((data - model) * self.fit_weight)[self.imin:self.imax]
+
+    def _cached_basis(self, key, calc, *args):
+        "unit-amplitude spectra for key, calculated as calc(*args) if needed"
+        basis = self._basis_cache.get(key, None)
+        if basis is None:
+            basis = calc(*args)
+            self._basis_cache[key] = basis
+            while len(self._basis_cache) > XRF_BASIS_CACHE_SIZE:
+                self._basis_cache.popitem(last=False)
+        else:
+            self._basis_cache.move_to_end(key)
+        return basis
+
+    def _element_basis(self, energy, det_noise, step, tail, beta, gamma):
+        """spectra for all elements with unit amplitudes, including
+        attenuation and escape peaks: array of shape (npts, nelems)"""
+        basis = np.zeros((len(energy), len(self.elements)))
+        for i, elem in enumerate(self.elements):
+            comp = 0. * energy
+            for key, line in elem.lines.items():
+                ecen = 0.001*line.energy
+                line_amp = line.intensity * elem.mu * elem.fyields[line.initial_level]
+                sigma = self.det_sigma(ecen, det_noise)
+                comp += hypermet(energy, amplitude=line_amp, center=ecen,
+                                 sigma=sigma, step=step, tail=tail,
+                                 beta=beta, gamma=gamma)
+            basis[:, i] = comp * self.atten * self.count_time
+        return self._add_escape(energy, basis)
+
+    def _scatter_basis(self, energy, det_noise, center, step, tail, beta,
+                       sigmax, gamma):
+        """spectrum for a scatter peak with unit amplitude, including
+        attenuation and escape peaks"""
+        sigma = sigmax * self.det_sigma(center, det_noise)
+        comp = hypermet(energy, amplitude=1.0, center=center,
+                        sigma=sigma, step=step, tail=tail, beta=beta,
+                        gamma=gamma)
+        comp *= self.atten * self.count_time
+        return self._add_escape(energy, comp)
+
     def __resid(self, params, data, index):
         pars = params.valuesdict()
         self.best_en = (pars['cal_offset'] + pars['cal_slope'] * index +
@@ -529,7 +659,44 @@ class XRF_Model:
         self.fit_weight = 1.0/fit_wt
 
     def fit_spectrum(self, mca, energy_min=None, energy_max=None,
-                     fit_toler=None, fit_step=None, max_nfev=None):
+                     fit_toler=None, fit_step=None, max_nfev=None,
+                     separable=False, reset_attenuation=True):
+        """fit XRF model to an MCA spectrum
+
+        Arguments:
+        ----------
+        mca          MCA group with energy and counts
+        energy_min   minimum energy for fit [model energy_min]
+        energy_max   maximum energy for fit [model energy_max]
+        fit_toler    fit tolerance [model fit_toler, 5.e-3]
+        fit_step     step size for finite differences [model fit_step, 1.e-4]
+        max_nfev     maximum number of function evaluations [model max_nfev, 1000]
+        separable    whether to solve varying amplitudes of elements,
+                     scatter peaks and background by linear least-squares
+                     at each step of the fit [False]
+        reset_attenuation  whether to recalculate attenuation and escape
+                     for the energies of the MCA [True].  This can be False
+                     for an MCA on the same energy grid as the previous fit.
+
+        Returns:
+        ---------
+        XRFFitResult
+
+        Notes:
+        ------
+        With `separable=True` (variable projection), only the parameters
+        for calibration, peak shapes, attenuation, escape and pileup are
+        varied by the non-linear fit.  For each set of their values, the
+        amplitudes, which enter the model linearly, are found by weighted
+        non-negative least-squares.  Uncertainties and correlations for all
+        variables are then found from the Jacobian at the best fit.
+
+        As pileup is not linear in the amplitudes, with pileup (see
+        add_pileup()) the amplitudes are found in two passes: first
+        without pileup, and then again after removing the pileup for the
+        first solution.  This is an approximation to variable projection
+        that is good when pileup is a small part of the spectrum.
+        """
         if fit_toler is not None:
             self.fit_toler = max(1.e-7, min(0.25, fit_toler))
         if fit_step is not None:
@@ -563,11 +730,12 @@ class XRF_Model:
         self.fit_iter = 0
 
         # reset attenuation calcs for matrix, detector, filters
-        self.matrix_atten = 1.0
-        self.escape_scale = None
-        self.detector.mu_total = None
-        for f in self.filters:
-            f.mu_total = None
+        if reset_attenuation or self.escape_scale is None:
+            self.matrix_atten = 1.0
+            self.escape_scale = None
+            self.detector.mu_total = None
+            for f in self.filters:
+                f.mu_total = None
 
         self.fit_in_progress = False
         self.init_fit = self.calc_spectrum(work_energy, params=self.params)
@@ -576,10 +744,23 @@ class XRF_Model:
 
         tol = self.fit_toler
         self.fit_in_progress = True
-        self.result = minimize(self.__resid, self.params, kws=userkws,
-                               method='leastsq', maxfev=self.max_nfev,
-                               scale_covar=True,
-                               gtol=tol, ftol=tol, epsfcn=self.fit_step)
+        if separable:
+            amp_names = self._amplitude_names()
+            self.linear_amps = [name for name, pname in amp_names.items()
+                                if pname in self.params and self.params[pname].vary]
+            params = self.params.copy()
+            for name in self.linear_amps:
+                params[amp_names[name]].vary = False
+            self.result = minimize(self.__resid_separable, params, kws=userkws,
+                                   method='leastsq', maxfev=self.max_nfev,
+                                   scale_covar=True,
+                                   gtol=tol, ftol=tol, epsfcn=self.fit_step)
+            self._finish_separable(work_counts, index)
+        else:
+            self.result = minimize(self.__resid, self.params, kws=userkws,
+                                   method='leastsq', maxfev=self.max_nfev,
+                                   scale_covar=True,
+                                   gtol=tol, ftol=tol, epsfcn=self.fit_step)
 
         self.fit_report = fit_report(self.result, min_correl=0.5)
         pars = self.result.params
@@ -600,6 +781,228 @@ class XRF_Model:
         self.transfer_matrix = np.array(tmat).transpose()
         return self.get_fitresult()
 
+    def _finish_separable(self, data, index):
+        """set amplitudes, statistics, and uncertainties for all variables
+        after a fit with separable=True, with the covariance found from
+        the Jacobian of the residual for all variables"""
+        result = self.result
+        params = result.params
+        pars = params.valuesdict()
+        energy = (pars['cal_offset'] + pars['cal_slope'] * index +
+                  pars['cal_quad'] * index**2)
+        units, amps = self._solve_amplitudes(energy, pars, data)
+        amp_names = self._amplitude_names()
+        for name in self.linear_amps:
+            params[amp_names[name]].value = amps[name]
+            params[amp_names[name]].vary = True
+
+        var_names = [name for name, par in params.items() if par.vary]
+        resid = self.__resid(params, data, index)
+        jac = np.zeros((len(resid), len(var_names)))
+        for i, name in enumerate(var_names):
+            par = params[name]
+            value = par.value
+            delta = np.sqrt(self.fit_step)*max(abs(value), 1.e-6)
+            if value + delta > par.max:
+                delta = -delta
+            par.value = value + delta
+            jac[:, i] = (self.__resid(params, data, index) - resid)/delta
+            par.value = value
+        params.update_constraints()
+
+        ndata, nvarys = len(resid), len(var_names)
+        result.var_names = var_names
+        result.nvarys = nvarys
+        result.nfree = ndata - nvarys
+        result.residual = resid
+        result.chisqr = (resid**2).sum()
+        result.redchi = result.chisqr / max(1, result.nfree)
+        neg2_loglikel = ndata * np.log(result.chisqr / ndata)
+        result.aic = neg2_loglikel + 2 * nvarys
+        result.bic = neg2_loglikel + np.log(ndata) * nvarys
+        result.init_vals = [params[name].value for name in var_names]
+        result.init_values = dict(zip(var_names, result.init_vals))
+        try:
+            result.covar = np.linalg.inv(jac.T @ jac) * result.redchi
+            result.errorbars = bool(np.all(np.diag(result.covar) >= 0))
+        except np.linalg.LinAlgError:
+            result.covar = None
+            result.errorbars = False
+        for par in params.values():
+            par.stderr, par.correl = None, None
+        if result.errorbars:
+            stderr = np.sqrt(np.diag(result.covar))
+            for i, name in enumerate(var_names):
+                params[name].stderr = stderr[i]
+                params[name].correl = {}
+                for j, name2 in enumerate(var_names):
+                    if i != j and stderr[i] > 0 and stderr[j] > 0:
+                        params[name].correl[name2] = (result.covar[i, j] /
+                                                      (stderr[i]*stderr[j]))
+
+    def fit_spectra(self, mcas, energy_min=None, energy_max=None,
+                    fit_toler=None, fit_step=None, max_nfev=None,
+                    separable=False, warm_start='previous', nworkers=1,
+                    callback=None):
+        """fit XRF model to a series of MCA spectra
+
+        Arguments:
+        ----------
+        mcas         list of MCA groups with energy and counts
+        energy_min   minimum energy for fit [model energy_min]
+        energy_max   maximum energy for fit [model energy_max]
+        fit_toler    fit tolerance [model fit_toler, 5.e-3]
+        fit_step     step size for finite differences [model fit_step, 1.e-4]
+        max_nfev     maximum number of function evaluations [model max_nfev, 1000]
+        separable    whether to use separable fits, as for fit_spectrum() [False]
+        warm_start   how to choose starting values for each fit: one of
+                     'previous' for the best-fit values of the previous
+                     spectrum, 'nearest' for those of the spectrum already
+                     fit that is most similar in shape, or None to start
+                     each fit from the model Parameters ['previous']
+        nworkers     number of worker processes to run the fits [1]
+        callback     function called as each fit is done, as
+                     callback(index=index, nmca=len(mcas), result=result)
+
+        Returns:
+        ---------
+        list of XRFFitResult, summary Group with
+           labels   list of MCA labels
+           names    list of names of amplitude Parameters
+           values   array (nmca, nnames) of best-fit amplitudes
+           stderr   array (nmca, nnames) of uncertainties (NaN if not found)
+           redchi   array (nmca,) of reduced chi-square
+           nfev     array (nmca,) of number of function evaluations
+           table    text table of amplitudes and uncertainties
+
+        Notes:
+        ------
+        The element line data and the attenuation calculations are
+        re-used for all spectra on the same energy grid.  For warm starts,
+        the amplitudes are scaled by the ratio of total counts.  With
+        nworkers > 1, the spectra are split into contiguous blocks, each
+        fit in order (and with warm starts) in a separate process.  The
+        model Parameters are not changed.
+
+        Fitting in worker processes needs a model that can be pickled:
+        if it cannot (as with an iter_callback from a GUI), a RuntimeWarning
+        is given and the spectra are fit in this process.  When the fits
+        are done in worker processes, the model itself is not fit, so that
+        its `result`, `mca`, `best_en`, `comps` and other fit outputs are
+        not set to those of the last spectrum, as for nworkers=1.
+        """
+        mcas = list(mcas)
+        nmca = len(mcas)
+        fit_kws = dict(energy_min=energy_min, energy_max=energy_max,
+                       fit_toler=fit_toler, fit_step=fit_step,
+                       max_nfev=max_nfev, separable=separable)
+        results = [None]*nmca
+
+        def save(index, result):
+            results[index] = result
+            if callable(callback):
+                callback(index=index, nmca=nmca, result=result)
+
+        nworkers = max(1, min(nworkers, nmca))
+        executor = None
+        if nworkers > 1:
+            try:
+                state = pickle.dumps(self)
+            except Exception as exc:
+                state = None
+                warnings.warn(f'fit_spectra: cannot send XRF model to worker '
+                              f'processes ({exc}), fitting spectra serially',
+                              RuntimeWarning)
+            if state is not None:
+                executor = ProcessPoolExecutor(max_workers=nworkers,
+                                               initializer=_xrf_worker_init,
+                                               initargs=(state,))
+        if executor is None:
+            for index, result in enumerate(self._fit_series(mcas, warm_start,
+                                                            fit_kws)):
+                save(index, result)
+        else:
+            bounds = np.linspace(0, nmca, nworkers+1).astype(int)
+            with executor:
+                futures = {}
+                for i0, i1 in zip(bounds[:-1], bounds[1:]):
+                    fut = executor.submit(_xrf_worker_fit, mcas[i0:i1],
+                                          warm_start, fit_kws)
+                    futures[fut] = i0
+                for fut in as_completed(futures):
+                    for i, result in enumerate(fut.result()):
+                        save(futures[fut] + i, result)
+        return results, self._fit_summary(mcas, results)
+
+    def _fit_series(self, mcas, warm_start, fit_kws):
+        """generate XRFFitResults for fits to a series of MCAs, each
+        started from the best-fit values for a previous MCA"""
+        params = self.params
+        done = []
+        last_energy = None
+        try:
+            for mca in mcas:
+                counts = np.asarray(mca.counts, dtype='float64')
+                shape = counts / max(1.e-12, counts.sum())
+                self.params = params.copy()
+                if warm_start and len(done) > 0:
+                    ref = done[-1]
+                    if warm_start == 'nearest':
+                        ref = min(done, key=lambda d: ((d[0]-shape)**2).sum())
+                    self._set_start(ref[2], counts.sum()/max(1.e-12, ref[1]))
+                energy = np.asarray(mca.energy)
+                same_energy = (last_energy is not None and
+                               energy.shape == last_energy.shape and
+                               (energy == last_energy).all())
+                result = self.fit_spectrum(mca, reset_attenuation=not same_energy,
+                                           **fit_kws)
+                last_energy = energy
+                done.append((shape, counts.sum(), result.params))
+                yield result
+        finally:
+            self.params = params
+
+    def _set_start(self, params, amp_scale):
+        """set starting values of variable Parameters from best-fit values,
+        with amplitudes scaled by amp_scale"""
+        amp_names = set(self._amplitude_names().values())
+        for name, par in self.params.items():
+            if not par.vary or par.expr is not None or name not in params:
+                continue
+            value = params[name].value
+            if name in amp_names:
+                value *= amp_scale
+            par.value = min(par.max, max(par.min, value))
+
+    def _fit_summary(self, mcas, results):
+        "summary Group of amplitudes and uncertainties for a list of fits"
+        amp_names = self._amplitude_names().values()
+        names = [name for name in amp_names if name in self.params]
+        nmca = len(results)
+        values = np.zeros((nmca, len(names)))
+        stderr = np.full((nmca, len(names)), np.nan)
+        labels = []
+        for i, (mca, result) in enumerate(zip(mcas, results)):
+            labels.append(getattr(mca, 'label', None) or
+                          getattr(mca, 'filename', None) or 'mca%d' % (i+1))
+            for j, name in enumerate(names):
+                par = result.params[name]
+                values[i, j] = par.value
+                if par.stderr is not None:
+                    stderr[i, j] = par.stderr
+        redchi = np.array([result.redchi for result in results])
+        nfev = np.array([result.nfev for result in results])
+
+        buff = ['# %s' % ' '.join(['label', 'redchi'] +
+                                  ['%s %s_stderr' % (n, n) for n in names])]
+        for i, label in enumerate(labels):
+            row = [label, gformat(redchi[i])]
+            for j in range(len(names)):
+                row.extend([gformat(values[i, j]), gformat(stderr[i, j])])
+            buff.append(' '.join(row))
+        return Group(labels=labels, names=names, values=values, stderr=stderr,
+                     redchi=redchi, nfev=nfev, table='\n'.join(buff))
+
     def get_fitresult(self, label='XRF fit result', script='# no script supplied'):
         """a simple compilation of fit settings results
         to be able to easily save and inspect"""
@@ -651,7 +1054,8 @@ class XRFFitResult(Group):
         tmp = {}
         for key, val in group2dict(self).items():
             if key in ('__name__', '__repr__', 'save', 'load', 'export',
-                       '_prep_decompose', 'decompose_mca', 'decompose_map'):
+                       '_prep_decompose', 'decompose_mca', 'decompose_map',
+                       'decompose_mapfile', '_map_solver'):
                 continue
             if key == 'mca':
                 val = val.dump_mcafile()
@@ -746,17 +1150,131 @@ class XRFFitResult(Group):
         pixel_time   count time in seconds for each pixel [1.0]
         method       decomposition method: one of `lstsq` for basic least-squares or
                      `nnls` for non-negative least-squares [`lstsq`]
+        nworkers     number of threads to use for decomposing blocks of rows [4]
 
         Returns:
         ---------
         dict of elements: weights maps (NY, NX) for all components used in the fit
+
+        Notes:
+        ------
+        For `lstsq`, the pseudo-inverse of the transfer matrix is calculated once
+        and applied to all pixels.  For `nnls`, a combinatorial active-set NNLS
+        solves all the pixels of a block together.  The map can also be an HDF5
+        dataset, which will then be read in blocks of rows.
         """
         method, scale = self._prep_decompose(scale, pixel_time, method)
         ny, nx, nchan = map.shape
+        w0, w1, solve = self._map_solver(nchan, method)
+        ncomps = self.transfer_matrix.shape[1]
+        result = np.zeros((ny, nx, ncomps), dtype='float32')
+
+        def decomp(i0, i1):
+            result[i0:i1] = solve(map[i0:i1, :, w0:w1]) * scale
+
+        # blocks of rows of up to ~2e7 values, with at least one per worker
+        nworkers = max(1, nworkers)
+        nrows = max(1, min(int(np.ceil(ny/nworkers)),
+                           int(2.e7/max(1, nx*(w1-w0)))))
+        blocks = [(i, min(ny, i+nrows)) for i in range(0, ny, nrows)]
+        if nworkers > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                list(executor.map(lambda block: decomp(*block), blocks))
+        else:
+            for block in blocks:
+                decomp(*block)
+        return {name: result[:,:,i] for i, name in enumerate(self.eigenvalues.keys())}
+
+    def decompose_mapfile(self, mapfile, det=None, scale=1.0, pixel_time=None,
+                          method='lstsq', parent='work', overwrite=False,
+                          nworkers=4, max_block=2.e7, callback=None):
+        """
+        Apply XRFFitResult to the XRF spectra of a GSEXRM_MapFile, decomposing
+        them into maps of elemental weights that are saved as work arrays.
+
+        The counts are read from the HDF5 file in blocks of rows aligned to the
+        HDF5 chunks, so that the full map of spectra is never held in memory.
+
+        Arguments:
+        ----------
+        mapfile      GSEXRM_MapFile, with XRF spectra on the same energy grid
+                     as the fitted data.
+        det          detector name or index [None - sum of all detectors]
+        scale        scale factor to apply to output weights [1]
+        pixel_time   count time in seconds for each pixel [None - from mapfile]
+        method       decomposition method: one of `lstsq` for basic least-squares or
+                     `nnls` for non-negative least-squares [`lstsq`]
+        parent       name of group for the work arrays ['work']
+        overwrite    whether to delete the whole `parent` group, including
+                     arrays from other fits, before writing [False]
+        nworkers     number of threads to use for decomposing blocks of rows [4]
+        max_block    approximate maximum number of values in a block of counts [2e7]
+        callback     function called after each block is written, as
+                     callback(row=row, maxrow=nrows, filename=mapfile.filename)
+
+        Returns:
+        ---------
+        list of names of work arrays, one for each component used in the fit
+
+        Notes:
+        ------
+        Existing work arrays with the same names in `parent` will be replaced,
+        and other arrays in `parent` are kept unless `overwrite` is True.
+        At most `nworkers` blocks are in memory at any time.
+        """
+        if pixel_time is None:
+            pixel_time = mapfile.pixeltime
+        method, scale = self._prep_decompose(scale, pixel_time, method)
+        counts = mapfile.get_detgroup(det)['counts']
+        ny, nx, nchan = counts.shape
+        w0, w1, solve = self._map_solver(nchan, method)
+
+        if overwrite and parent in mapfile.xrmmap:
+            del mapfile.xrmmap[parent]
+            mapfile.h5root.flush()
+        names, outputs = [], []
+        for i, name in enumerate(self.eigenvalues.keys()):
+            name = fix_varname(name)
+            mapfile.del_work_array(name, parent=parent)
+            mapfile.add_work_array(np.zeros((ny, nx), dtype='float32'), name,
+                                   parent=parent, order=i+1)
+            names.append(name)
+            outputs.append(mapfile.get_work_array(name, parent=parent))
+        mapfile.xrmmap[parent].attrs['orderby'] = 'order'
+
+        # blocks of whole HDF5 chunks of rows
+        chunkrows = 1 if counts.chunks is None else counts.chunks[0]
+        nrows = chunkrows*max(1, int(max_block/(chunkrows*nx*nchan)))
+        blocks = [(i, min(ny, i+nrows)) for i in range(0, ny, nrows)]
+
+        def decomp(i0, i1):
+            return i0, i1, solve(counts[i0:i1, :, w0:w1]) * scale
+
+        def save(i0, i1, weights):
+            for i, out in enumerate(outputs):
+                out[i0:i1, :] = weights[:, :, i]
+            mapfile.h5root.flush()
+            if callable(callback):
+                callback(row=i1, maxrow=ny, filename=mapfile.filename)
+
+        nworkers = max(1, nworkers)
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            pending = deque()
+            for block in blocks:
+                pending.append(executor.submit(decomp, *block))
+                if len(pending) >= nworkers:
+                    save(*pending.popleft().result())
+            while len(pending) > 0:
+                save(*pending.popleft().result())
+        return names
+
+    def _map_solver(self, nchan, method):
+        """channel range [w0, w1) and solver for decomposing blocks of map
+        spectra: solve(counts[:, :, w0:w1]) gives the (unscaled) weights"""
         nchanx, ncomps = self.transfer_matrix.shape
         nchanw = self.fit_window.shape[0]
         if nchan != nchanx or nchan != nchanw:
-            raise ValueError("map data has wrong shape ", map.shape)
+            raise ValueError("map data has wrong number of channels ", nchan)
 
         win = np.where(self.fit_window > 0)[0]
         w0 = max(0, win[0]-100)
@@ -764,42 +1282,33 @@ class XRFFitResult(Group):
 
         xfer = self.transfer_matrix[w0:w1, :]
         win = self.fit_window[w0:w1]
-        result = np.zeros((ny, nx, ncomps), dtype='float32')
-
-        def decomp_lstsq(i0, i1):
-            """very efficient lstsq"""
-            tmap = map[i0:i1, :, w0:w1].swapaxes(1, 2)
-            ny = tmap.shape[0]
-            win.shape = (win.shape[0], 1)
-            for iy in range(ny):
-                results = lstsq(xfer, win*tmap[iy])
-                for i in range(ncomps):
-                    result[i0+iy,:,i] = results[0][i] * scale
-
-        def decomp_nnls(i0, i1):
-            """need to explicitly loop of nx as well as ny"""
-            tmap = map[i0:i1, :, w0:w1]
-            ny = tmap.shape[0]
-            for iy in range(ny):
-                for ix in range(nx):
-                    results = nnls(xfer, win*tmap[iy,ix,:])
-                    for i in range(ncomps):
-                        result[i0+iy,ix,i] = results[0][i] * scale
-
-        decomp = decomp_lstsq
         if method == nnls:
-            decomp = decomp_nnls
-        # if we're going to use up more than ~1Gb per lstsq, do it in chunks
-        if (ny*nx*(w1-w0) > 1e8):
-            nchunks = 1+int(1.e-8*ny*nx*(w1-w0))
-            ns = int(ny/nchunks)
-            for i in range(nchunks):
-                ilast = (i+1)*ns
-                if i == nchunks-1: ilast = ny
-                decomp(i*ns, ilast)
+            xtx = xfer.T @ xfer
+            def _solve(counts):
+                return nnls_normal(xtx, xfer.T @ counts)
         else:
-            decomp(0, ny)
-        return {name: result[:,:,i] for i, name in enumerate(self.eigenvalues.keys())}
+            # pseudo-inverse, with the same singular value cutoff as lstsq
+            xinv = np.linalg.pinv(xfer, rcond=np.finfo(float).eps*max(xfer.shape))
+            def _solve(counts):
+                return xinv @ counts
+
+        def solve(tmap):
+            tmap = np.asarray(tmap, dtype='float64')
+            nrows, npix = tmap.shape[0], tmap.shape[1]
+            counts = (tmap*win).reshape((-1, w1-w0)).T
+            return _solve(counts).T.reshape((nrows, npix, ncomps))
+        return w0, w1, solve
+
+# XRF_Model held by each worker process for fit_spectra()
+_xrf_worker_state = {}
+
+def _xrf_worker_init(state):
+    _xrf_worker_state['model'] = pickle.loads(state)
+
+def _xrf_worker_fit(mcas, warm_start, fit_kws):
+    model = _xrf_worker_state['model']
+    return list(model._fit_series(mcas, warm_start, fit_kws))
+
 
 def xrf_model(xray_energy=None, energy_min=1500, energy_max=None, use_bgr=False, **kws):
     """create an XRF Peak
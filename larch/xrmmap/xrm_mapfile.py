@@ -8,6 +8,8 @@ import scipy.stats as stats
 import json
 import multiprocessing as mp
 from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import larch
 from larch.utils import debugtime, isotime
@@ -180,6 +182,13 @@ def toppath(pname, n=4):
     return '/'.join(words)
 
 
+def _read_maprow(args):
+    """read a GSEXRM_MapRow from the (args, kws) of MapFile._rowdata_args()"""
+    if args is None:
+        return None
+    args, kws = args
+    return GSEXRM_MapRow(*args, **kws)
+
 def remove_zigzag(map, zigzag=0):
     if zigzag == 0:
         return map
@@ -733,19 +742,25 @@ class GSEXRM_MapFile(object):
     def process_row(self, irow, flush=False, complete=False, offset=None,
                     nrows_expected=None, callback=None):
         row = self.read_rowdata(irow, offset=offset)
+        self.store_row(irow, row, flush=flush, complete=complete,
+                       nrows_expected=nrows_expected, callback=callback)
+
+    def store_row(self, irow, row, flush=False, complete=False,
+                  nrows_expected=None, callback=None):
+        """write a row of data, as read by read_rowdata(), to the HDF5 file"""
         if irow == 0:
             nmca, nchan = 0, 2048
             if row.counts is not None:
                 nmca, xnpts, nchan = row.counts.shape
             xrd2d_shape = None
             if row.xrd2d is not None:
-                xrd2d_shape = rows.xrd2d.shape
+                xrd2d_shape = row.xrd2d.shape
             self.build_schema(row.npts, nmca=nmca, nchan=nchan,
                               scaler_names=row.scaler_names,
                               scaler_addrs=row.scaler_addrs,
                               xrd2d_shape=xrd2d_shape, verbose=True,
                               nrows_expected=nrows_expected)
-        if row.read_ok:
+        if row is not None and row.read_ok:
             self.add_rowdata(row, callback=callback)
 
         if flush or complete:
@@ -760,8 +775,14 @@ class GSEXRM_MapFile(object):
 
 
     def process(self, maxrow=None, force=False, callback=None, offset=None,
-                force_no_dtc=False, all_mcas=None):
-        "look for more data from raw folder, process if needed"
+                force_no_dtc=False, all_mcas=None, nworkers=1, max_queue=None):
+        """look for more data from raw folder, process if needed
+
+        With nworkers > 1, rows are read from the raw files by a pool of
+        threads while the rows already read are written to the HDF5 file,
+        in order, by the calling thread.  At most max_queue rows
+        [default 2*nworkers] are held in memory waiting to be written.
+        """
         self.force_no_dtc = force_no_dtc
         if all_mcas is not None:
             self.all_mcas = all_mcas
@@ -784,15 +805,54 @@ class GSEXRM_MapFile(object):
 
         if force or self.folder_has_newdata():
             irow = self.last_row + 1
-            while irow < nrows:
-                flush = irow < 2 or (irow % 64 == 0)
-                complete = irow >= nrows-1
-                self.process_row(irow, flush=flush, offset=offset,
-                                 complete=complete, callback=callback)
-                irow  = irow + 1
+            if nworkers > 1:
+                # the first row sets up the HDF5 datasets, so is
+                # processed before the rows read by the pool of threads
+                if irow == 0 and nrows > 0:
+                    self.process_row(0, flush=True, offset=offset,
+                                     complete=(nrows == 1), callback=callback)
+                    irow = 1
+                self._process_rows(irow, nrows, offset=offset,
+                                   callback=callback, nworkers=nworkers,
+                                   max_queue=max_queue)
+            else:
+                while irow < nrows:
+                    flush = irow < 2 or (irow % 64 == 0)
+                    complete = irow >= nrows-1
+                    self.process_row(irow, flush=flush, offset=offset,
+                                     complete=complete, callback=callback)
+                    irow  = irow + 1
             if callable(callback):
                 callback(filename=self.filename, status='complete')
 
+    def _process_rows(self, irow, nrows, offset=None, callback=None,
+                      nworkers=4, max_queue=None):
+        """process rows irow to nrows-1, reading rows with a pool of
+        threads ahead of writing them to the HDF5 file"""
+        if max_queue is None:
+            max_queue = 2*nworkers
+        max_queue = max(1, max_queue)
+        pending = deque()
+        nextrow = irow
+        executor = ThreadPoolExecutor(max_workers=nworkers)
+        try:
+            while irow < nrows:
+                # rowdata arguments are set up here, as this may
+                # change the state of the MapFile
+                while nextrow < nrows and len(pending) < max_queue:
+                    args = self._rowdata_args(nextrow, offset=offset)
+                    pending.append(executor.submit(_read_maprow, args))
+                    nextrow += 1
+                row = pending.popleft().result()
+                flush = irow < 2 or (irow % 64 == 0)
+                complete = irow >= nrows-1
+                self.store_row(irow, row, flush=flush, complete=complete,
+                               callback=callback)
+                irow = irow + 1
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
 
     def set_roidata(self, row_start=0, row_end=None):
         if row_end is None:
@@ -853,6 +913,12 @@ class GSEXRM_MapFile(object):
         '''read a row worth of raw data from the Map Folder
         returns arrays of data
         '''
+        return _read_maprow(self._rowdata_args(irow, offset=offset))
+
+    def _rowdata_args(self, irow, offset=None):
+        '''arguments for GSEXRM_MapRow to read row irow from the Map Folder,
+        or None if the row is not available
+        '''
         if self.dimension is None or irow > len(self.rowdata):
             self.read_master()
 
@@ -913,20 +979,20 @@ class GSEXRM_MapFile(object):
         if offset is not None:
             ioffset = offset
         self.has_xrf = self.has_xrf and xrff != '_unused_'
-        return GSEXRM_MapRow(yval, xrff, xrdf, xpsf, sisf, self.folder,
-                             irow=irow, nrows_expected=self.nrows_expected,
-                             ixaddr=0, dimension=self.dimension,
-                             npts=self.npts,
-                             reverse=reverse,
-                             ioffset=ioffset,
-                             force_no_dtc=self.force_no_dtc,
-                             masterfile=self.masterfile, flip=self.flip,
-                             xrdcal=self.xrdcalfile,
-                             xrd2dmask=self.mask_xrd2d,
-                             xrd2dbkgd=self.bkgd_xrd2d, wdg=self.azwdgs,
-                             steps=self.qstps, has_xrf=self.has_xrf,
-                             has_xrd2d=self.has_xrd2d,
-                             has_xrd1d=self.has_xrd1d)
+        return ((yval, xrff, xrdf, xpsf, sisf, self.folder),
+                dict(irow=irow, nrows_expected=self.nrows_expected,
+                     ixaddr=0, dimension=self.dimension,
+                     npts=self.npts,
+                     reverse=reverse,
+                     ioffset=ioffset,
+                     force_no_dtc=self.force_no_dtc,
+                     masterfile=self.masterfile, flip=self.flip,
+                     xrdcal=self.xrdcalfile,
+                     xrd2dmask=self.mask_xrd2d,
+                     xrd2dbkgd=self.bkgd_xrd2d, wdg=self.azwdgs,
+                     steps=self.qstps, has_xrf=self.has_xrf,
+                     has_xrd2d=self.has_xrd2d,
+                     has_xrd1d=self.has_xrd1d))
 
 
     def add_rowdata(self, row, callback=None, flush=True):
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+""" Tests of XAFS background subtraction """
+from pathlib import Path
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import autobk, autobk_batch
+
+data_dir = Path(__file__).parent.parent.resolve() / 'examples' / 'xafsdata'
+
+
+def get_spectra():
+    cu = read_ascii(str(data_dir / 'cu_metal_rt.xdi'))
+    rng = np.random.default_rng(7)
+    energy = [cu.energy]*4
+    mu = [cu.mutrans*(1 + 0.05*i) + 1.e-3*rng.normal(size=len(cu.energy))
+          for i in range(4)]
+    fe = read_ascii(str(data_dir / 'fe2o3_rt1.xmu'))
+    energy.append(fe.energy)
+    mu.append(fe.mu)
+    return energy, mu
+
+
+def test_autobk_batch():
+    energy, mu = get_spectra()
+    kws = dict(rbkg=1.1, kweight=2, kmax=15, calc_uncertainties=True)
+    expected = []
+    for en, m in zip(energy, mu):
+        group = Group()
+        autobk(en, m, group=group, **kws)
+        expected.append(group)
+
+    for nworkers in (1, 2):
+        groups = autobk_batch(energy, mu, nworkers=nworkers, **kws)
+        assert len(groups) == len(expected)
+        for group, exp in zip(groups, expected):
+            assert_allclose(group.ek0, exp.ek0)
+            assert_allclose(group.k, exp.k)
+            assert_allclose(group.chi, exp.chi, rtol=1.e-5,
+                            atol=1.e-5*abs(exp.chi).max())
+            assert_allclose(group.bkg, exp.bkg, rtol=1.e-6)
+            assert_allclose(group.delta_chi, exp.delta_chi, rtol=1.e-3,
+                            atol=1.e-3*exp.delta_chi.max())
+            assert group.autobk_details.nspl == exp.autobk_details.nspl
+
+
+def test_autobk_batch_stack():
+    energy, mu = get_spectra()
+    stack = np.array(mu[:4])
+    groups = [Group() for _ in range(4)]
+    out = autobk_batch(energy[0], stack, groups=groups, ek0=8980.0,
+                       rbkg=1.0, kweight=1)
+    assert out is groups
+    group = Group()
+    autobk(energy[0], stack[2], group=group, ek0=8980.0, rbkg=1.0, kweight=1)
+    assert_allclose(groups[2].chi, group.chi, rtol=1.e-5,
+                    atol=1.e-5*abs(group.chi).max())
+    with pytest.raises(TypeError):
+        autobk_batch(energy[0], stack, rbkg=1.0, kwieght=1)
+
+
+def test_autobk_fast_resid():
+    cu = read_ascii(str(data_dir / 'cu_metal_rt.xdi'))
+    for kws in (dict(rbkg=1.0, kweight=2), dict(rbkg=1.2, kweight=1, kmax=14,
+                                                 clamp_lo=2, nclamp=5)):
+        slow, fast = Group(), Group()
+        autobk(cu.energy, cu.mutrans, group=slow, fast=False, **kws)
+        autobk(cu.energy, cu.mutrans, group=fast, fast=True, **kws)
+        assert_allclose(fast.chi, slow.chi, rtol=1.e-8,
+                        atol=1.e-8*abs(slow.chi).max())
+        assert_allclose(fast.bkg, slow.bkg, rtol=1.e-10)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+""" Tests of energy-dependent broadening """
+from pathlib import Path
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.io import read_ascii
+from larch.math.convolution1D import (conv, conv_sparse, glinbroad,
+                                      lin_gamma, atan_gamma)
+from larch.math.lineshapes import lorentzian
+from larch.xafs import pre_edge, xas_convolve
+
+data_dir = Path(__file__).parent.parent.resolve() / 'examples' / 'xafsdata'
+
+
+def get_spectrum():
+    energy = np.linspace(8950, 9100, 601)
+    mu = (1.0/(1 + np.exp(-(energy-8980)/2.0))
+          + 0.4*np.exp(-((energy-8990)/3.0)**2))
+    return energy, mu
+
+
+def test_conv_sparse():
+    energy, mu = get_spectrum()
+    for gammas in (lin_gamma(energy, 1.0, linbroad=[6.0, 8990, 9050]),
+                   atan_gamma(energy, e_cut=8975, gamma_hole=1.0,
+                              gamma_max=8)):
+        for kernel in ('gaussian', 'lorentzian'):
+            expected = conv(energy, mu, gammas, e_cut=8970, kernel=kernel)
+            assert_allclose(conv_sparse(energy, mu, gammas, e_cut=8970,
+                                        kernel=kernel),
+                            expected, rtol=0, atol=1.e-12)
+
+
+def test_glinbroad_stack():
+    energy, mu = get_spectrum()
+    gammas = lin_gamma(energy, 1.0, linbroad=[4.0, 8985, 9020])
+    stack = np.array([mu*(1 + 0.1*i) for i in range(5)])
+    out = glinbroad(energy, stack, gammas=gammas, e_cut=8960)
+    assert out.shape == stack.shape
+    for row, spectrum in zip(out, stack):
+        expected = glinbroad(energy, spectrum, gammas=gammas, e_cut=8960,
+                             fast=False)
+        assert_allclose(row, expected, rtol=0, atol=1.e-12)
+
+
+def test_xas_convolve_varwidth():
+    dat = read_ascii(str(data_dir / 'cu_metal_rt.xdi'))
+    pre_edge(dat.energy, dat.mutrans, group=dat)
+    xas_convolve(dat, esigma=0.5)
+    assert np.isfinite(dat.conv).all()
+    esigma = 0.5*lin_gamma(dat.energy, 1.0, linbroad=[8.0, 9000, 9100])
+    xas_convolve(dat, esigma=esigma, form='gaussian')
+    assert np.isfinite(dat.conv).all()
+    assert abs(dat.conv - dat.norm).max() < 0.25
+    # negligible broadening leaves the spectrum unchanged
+    npts = len(dat.energy)
+    xas_convolve(dat, esigma=1.e-3*(1 + np.arange(npts)/npts), form='gaussian')
+    assert_allclose(dat.conv, dat.norm, rtol=0, atol=1.e-4)
+
+
+def test_xas_convolve_lorentzian_tails():
+    dat = read_ascii(str(data_dir / 'cu_metal_rt.xdi'))
+    pre_edge(dat.energy, dat.mutrans, group=dat)
+    energy, npts = dat.energy, len(dat.energy)
+    for form in ('gaussian', 'lorentzian'):
+        # an array with a single value is the same as the scalar value
+        xas_convolve(dat, esigma=1.5, form=form)
+        scalar = dat.conv.copy()
+        xas_convolve(dat, esigma=np.full(npts, 1.5), form=form)
+        assert_allclose(dat.conv, scalar, rtol=0, atol=1.e-12)
+
+    # varying widths use a symmetric kernel, including Lorentzian tails:
+    # compare to the full kernel on a padded fine grid, away from the ends
+    xas_convolve(dat, esigma=1.5*(1 + 1.e-6*np.arange(npts)/npts),
+                 form='lorentzian')
+    step = 0.05
+    xfine = np.arange(energy[0]-200, energy[-1]+200, step)
+    yfine = np.interp(xfine, energy, dat.norm)
+    coefs = np.polyfit(energy[-npts//2:], dat.norm[-npts//2:], 1)
+    above = xfine > energy[-1]
+    yfine[above] = np.polyval(coefs, xfine[above])
+    kern = lorentzian(np.arange(-3000, 3001)*step, sigma=1.5)
+    expected = np.interp(energy, xfine,
+                         np.convolve(yfine, kern/kern.sum(), mode='same'))
+    inner = (energy > energy[0]+30) & (energy < energy[-1]-30)
+    assert abs(dat.conv - expected)[inner].max() < 0.01
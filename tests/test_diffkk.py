@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Tests of differential Kramers-Kronig transforms """
+from pathlib import Path
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.io import read_ascii
+from larch.xafs import diffkk
+from larch.xafs.diffkk import (kkmclf, kkmclr, kkmclf_sca, kkmclr_sca,
+                               kkmclf_fft, kkmclr_fft)
+
+data_dir = Path(__file__).parent.parent.resolve() / 'examples' / 'xafsdata'
+
+
+def get_fpp(npts=400):
+    energy = np.linspace(8800, 9400, npts)
+    fpp = (1.0/(1 + np.exp(-(energy-8980)/3.0))
+           + 0.3*np.exp(-((energy-8990)/5.0)**2))
+    return energy, fpp
+
+
+def test_kkmcl_forms():
+    energy, fpp = get_fpp()
+    for fsca, fvec, ffft in ((kkmclf_sca, kkmclf, kkmclf_fft),
+                             (kkmclr_sca, kkmclr, kkmclr_fft)):
+        expected = np.array(fsca(energy, fpp))
+        scale = abs(expected).max()
+        assert_allclose(fvec(energy, fpp), expected, rtol=0, atol=1.e-13*scale)
+        assert_allclose(ffft(energy, fpp), expected, rtol=0, atol=1.e-11*scale)
+
+
+def test_kkmcl_fft_uneven_grid():
+    energy, fpp = get_fpp()
+    energy[200:] += 0.3*np.arange(200)
+    assert_allclose(kkmclr_fft(energy, fpp), kkmclr(energy, fpp))
+
+
+def test_diffkk_how():
+    dat = read_ascii(str(data_dir / 'cu_10k.xmu'))
+    results = {}
+    for how in ('vector', 'fft'):
+        dkk = diffkk(dat.energy, dat.mu, z=29, edge='K',
+                     mback_kws={'e0': 8979, 'order': 4})
+        dkk.kk(how=how)
+        results[how] = dkk.fp
+    scale = abs(results['vector']).max()
+    assert_allclose(results['fft'], results['vector'], rtol=0,
+                    atol=1.e-10*scale)
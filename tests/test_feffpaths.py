@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+""" Tests of Feff Path calculations """
+import os
+import shutil
+from pathlib import Path
+from copy import deepcopy
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.interpolate import UnivariateSpline
+
+from larch.io import read_ascii
+from larch.fitting import (param, param_group, group2params, chi2_map,
+                            confidence_intervals)
+from larch.xafs import (autobk, feffpath, ff2chi, feffit_transform,
+                        feffit_dataset, feffit)
+from larch.xafs import feffdat
+from larch.xafs.feffdat import (calc_chi_paths, feffdata_store, PATH_PARS,
+                               SPLINE_ARRS, FeffDatFile, FeffDataStore,
+                               feffdata_stores_clear, read_feffdat_folder)
+from larch.xafs.pathparams import PathParamEvaluator, eval_pathparams
+
+base_dir = Path(__file__).parent.parent.resolve()
+feffit_dir = base_dir / 'examples' / 'feffit'
+
+
+def get_paths():
+    pars = param_group(amp=param(0.9, vary=True),
+                       del_e0=param(2.5, vary=True),
+                       theta=param(250, vary=True),
+                       sig2_1=param(0.004, vary=True),
+                       alpha=param(0.01, vary=True))
+    paths = []
+    for i in range(1, 6):
+        fname = feffit_dir / 'Feff_Cu' / f'feff{i:04d}.dat'
+        sigma2 = 'sig2_1' if i == 1 else 'sigma2_eins(300, theta)'
+        paths.append(feffpath(str(fname), s02='amp', e0='del_e0',
+                              sigma2=sigma2, deltar='alpha*reff'))
+    # different E0, third and fourth cumulants, and a different Feff k grid
+    paths.append(feffpath(str(feffit_dir / 'feff_feo01.dat'), s02='amp',
+                          e0=-1.0, sigma2=0.005, third=0.0004, fourth=1.e-5))
+    paths.append(feffpath(str(feffit_dir / 'Feff_ZnSe' / 'feff_znse.dat'),
+                          e0='del_e0 + 1', sigma2=0.006, ei=0.5))
+    paths.append(feffpath(str(feffit_dir / 'feff_feo02.dat'), use=False))
+    return pars, paths
+
+
+def test_ff2chi_vectorized():
+    pars, paths = get_paths()
+    k = 0.05*np.arange(361)
+    serial = ff2chi(paths, paramgroup=pars, k=k)
+    path_chis = [p.chi.copy() for p in paths]
+
+    batch = ff2chi(paths, paramgroup=pars, k=k, vectorize=True)
+    assert_allclose(batch.chi, serial.chi, rtol=1.e-10, atol=1.e-13)
+    for path, chi in zip(paths, path_chis):
+        assert_allclose(path.chi, chi, rtol=1.e-10, atol=1.e-13)
+
+
+def test_ff2chi_vectorized_default_k():
+    pars, paths = get_paths()
+    paths = paths[:5]
+    serial = ff2chi(paths, paramgroup=pars)
+    batch = ff2chi(paths, paramgroup=pars, vectorize=True)
+    assert len(batch.k) == len(serial.k)
+    assert_allclose(batch.chi, serial.chi, rtol=1.e-10, atol=1.e-13)
+
+
+def test_feffdata_store():
+    pars, paths = get_paths()
+    path = paths[0]
+    store = path.datastore
+    assert store is feffdata_store(path._feffdat.k)
+    # the same data is stored once, and copies share it
+    again = feffpath(path.filename)
+    copied = deepcopy(path)
+    assert again.datastore is store and again.datarow == path.datarow
+    assert copied.datastore is store and copied.datarow == path.datarow
+    assert copied._feffdat is path._feffdat
+    assert copied.sigma2 == path.sigma2 and copied.label == path.label
+
+    fdat = path._feffdat
+    q = np.linspace(-0.5, 22, 501)
+    rows = [p.datarow for p in paths[:5]]
+    qs = np.array([q, q + 0.1, q - 0.1, q, q + 0.05])
+    vals = store.interp(rows, qs)
+    derivs = store.interp(rows, qs, nu=1)
+    assert vals.shape == (len(SPLINE_ARRS), 5, len(q))
+    for i, p in enumerate(paths[:5]):
+        for j, attr in enumerate(SPLINE_ARRS):
+            spl = UnivariateSpline(p._feffdat.k, getattr(p._feffdat, attr), s=0)
+            scale = abs(getattr(p._feffdat, attr)).max()
+            assert_allclose(vals[j, i], spl(qs[i]), rtol=0, atol=1.e-12*scale)
+            assert_allclose(derivs[j, i], spl(qs[i], nu=1), rtol=0,
+                            atol=1.e-10*scale)
+    assert_allclose(store.values[:, path.datarow],
+                    [getattr(fdat, attr) for attr in SPLINE_ARRS])
+    for attr, spl in path.spline_coefs.items():
+        assert_allclose(spl(q), vals[SPLINE_ARRS.index(attr), 0])
+
+
+def test_feffdata_store_growth():
+    pars, paths = get_paths()
+    k = paths[0]._feffdat.k
+    paths = [p for p in paths if p.datastore is paths[0].datastore]
+    store = FeffDataStore(k, size=2)
+    rows = [store.add(p._feffdat) for p in paths]
+    assert rows == list(range(len(paths)))
+    assert store.values.shape == (len(SPLINE_ARRS), len(paths), len(k))
+    assert store.coefs.shape == (4, len(SPLINE_ARRS), len(paths), len(k)-1)
+    for row, path in zip(rows, paths):
+        assert_allclose(store.values[:, row],
+                        [getattr(path._feffdat, attr) for attr in SPLINE_ARRS])
+    assert_allclose(store.coefs, paths[0].datastore.coefs[:, :, rows])
+
+    # full or cleared stores are replaced for new paths only
+    feffdata_stores_clear()
+    new = feffdata_store(k)
+    assert new is not paths[0].datastore and new.nrows == 0
+    assert feffdata_store(k) is new
+    again = feffpath(paths[1].filename)
+    assert again.datastore is new
+    assert_allclose(again.datastore.values[:, again.datarow],
+                    paths[1].datastore.values[:, paths[1].datarow])
+
+
+def test_read_feffdat_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(feffdat, 'FEFFDAT_CACHE_DIR', str(tmp_path / 'cache'))
+    folder = tmp_path / 'feff'
+    folder.mkdir()
+    for i in range(1, 5):
+        shutil.copy(feffit_dir / 'Feff_Cu' / f'feff{i:04d}.dat', folder)
+    (folder / 'paths.dat').write_text('paths\n')
+    def states(fdats):
+        return {name: fdat.__getstate__() for name, fdat in fdats.items()}
+
+    parsed = {f'feff{i:04d}.dat': FeffDatFile(str(folder / f'feff{i:04d}.dat'),
+                                                use_cache=False)
+              for i in range(1, 5)}
+    out = read_feffdat_folder(str(folder))
+    assert out.paths_dat == 'paths\n'
+    assert states(out.feffdat) == states(parsed)
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+    feffdat._feffdat_caches.clear()
+    fname = str(folder / 'feff0002.dat')
+    assert feffdat.feffdat_cache_lookup(fname) is not None
+    assert FeffDatFile(fname).__getstate__() == parsed['feff0002.dat'].__getstate__()
+    entry = feffdat._read_feffdat_cache(feffdat._feffdat_cachefile(str(folder)))
+    assert set(entry['feff0002.dat']['header']) == set(feffdat.FEFFDAT_CACHE_ATTRS)
+    cached = read_feffdat_folder(str(folder))
+    assert states(cached.feffdat) == states(parsed)
+
+    # a new modification time with the same contents still uses the cache,
+    # changed contents do not
+    os.utime(fname, (1.e9, 1.e9))
+    assert feffdat.feffdat_cache_lookup(fname) is not None
+    shutil.copy(feffit_dir / 'Feff_Cu' / 'feff0005.dat', fname)
+    assert feffdat.feffdat_cache_lookup(fname) is None
+    path = feffpath(fname)
+    assert path.reff == FeffDatFile(fname, use_cache=False).reff
+    out = read_feffdat_folder(str(folder))
+    assert out.feffdat['feff0002.dat'].reff == path.reff
+    assert feffdat.feffdat_cache_lookup(fname) is not None
+
+
+def test_eval_pathparams():
+    pars, paths = get_paths()
+    # uses feffpath in the symbol table, evaluated with asteval
+    paths[2].deltar = 'alpha*feffpath.reff'
+    # depends on the Path Parameters of other paths
+    paths[3].sigma2 = 'sigma2_%s*2 + 0.001' % paths[0].hashkey
+    paths[4].e0 = 'e0_%s - 1' % paths[3].hashkey
+    k = 0.05*np.arange(361)
+    serial = ff2chi(paths, paramgroup=pars, k=k, compiled=False)
+    params = paths[0].params
+    active = [path for path in paths if path.use]
+    expected = np.array([[path.path_paramvals()[pname] for pname in PATH_PARS]
+                         for path in active])
+
+    evaluator = PathParamEvaluator(active, params)
+    assert_allclose(evaluator(params), expected, rtol=1.e-12)
+    fallback = [(ipath, PATH_PARS[ipar]) for ipath, ipar in evaluator.fallback]
+    assert fallback == [(2, 'deltar')]
+
+    vals = eval_pathparams(paths, params)
+    assert_allclose(vals[:-1], expected, rtol=1.e-12)
+    assert (vals[-1] == 0).all()
+
+    compiled = ff2chi(paths, paramgroup=params, k=k)
+    assert_allclose(compiled.chi, serial.chi, rtol=1.e-12, atol=1.e-15)
+
+    # changed values of variables are used
+    params['theta'].value = 300.0
+    vals = eval_pathparams(paths, params)
+    for ipath, path in enumerate(active):
+        assert_allclose(vals[ipath, PATH_PARS.index('sigma2')],
+                        path.path_paramvals()['sigma2'], rtol=1.e-12)
+
+
+def get_cudata():
+    data = read_ascii(str(base_dir / 'examples' / 'xafsdata' / 'cu_metal_rt.xdi'))
+    data.mu = data.mutrans
+    autobk(data, rbkg=1.1, kw=2)
+    return data
+
+
+def test_path_chi_derivs():
+    pars, paths = get_paths()
+    k = 0.05*np.arange(361)
+    ff2chi(paths, paramgroup=pars, k=k)
+    calc_chi_paths(paths, k=k, with_derivs=True)
+    for path in paths[:-1]:
+        vals = path.path_paramvals()
+        for ipar, pname in enumerate(PATH_PARS):
+            step = 1.e-6*max(abs(vals[pname]), 1.e-3)
+            path._calc_chi(k=k, **dict(vals, **{pname: vals[pname] + step}))
+            chi_plus = path.chi
+            path._calc_chi(k=k, **dict(vals, **{pname: vals[pname] - step}))
+            chi_minus = path.chi
+            deriv = (chi_plus - chi_minus)/(2*step)
+            assert_allclose(path.chi_derivs[ipar], deriv, rtol=1.e-4,
+                            atol=1.e-5*abs(deriv).max())
+
+
+def test_feffit_jacobian():
+    data = get_cudata()
+    pars, paths = get_paths()
+    pars.ss2 = param(expr='sig2_1*2')
+    paths[1].sigma2 = 'ss2'
+    for fitspace in ('r', 'k', 'q'):
+        trans = feffit_transform(kmin=3, kmax=17, kw=[1, 2], dk=4,
+                                 rmin=1.4, rmax=5.0, fitspace=fitspace)
+        dset = feffit_dataset(data=data, paths=paths, transform=trans)
+        params = group2params(pars)
+        dset.prepare_fit(params)
+        params.update_constraints()
+        var_names = [name for name, par in params.items() if par.vary]
+        jac = dset._jacobian(params, var_names)
+        for ivar, vname in enumerate(var_names):
+            value = params[vname].value
+            step = 1.e-6*max(abs(value), 1.e-3)
+            params[vname].value = value + step
+            params.update_constraints()
+            resid_plus = dset._residual(params)
+            params[vname].value = value - step
+            params.update_constraints()
+            resid_minus = dset._residual(params)
+            params[vname].value = value
+            params.update_constraints()
+            deriv = (resid_plus - resid_minus)/(2*step)
+            assert_allclose(jac[:, ivar], deriv, rtol=1.e-4,
+                            atol=1.e-6*abs(deriv).max())
+
+
+def test_feffit_vectorize_paths():
+    data = get_cudata()
+
+    results = []
+    for vectorize, jacobian in ((False, False), (True, False), (True, True)):
+        pars = param_group(amp=param(1, vary=True),
+                           del_e0=param(3, vary=True),
+                           sig2_1=param(0.002, vary=True),
+                           sig2_2=param(0.002, vary=True),
+                           alpha=param(0, vary=True))
+        paths = [feffpath(str(feffit_dir / 'feff0001.dat'), s02='amp',
+                          e0='del_e0', sigma2='sig2_1', deltar='alpha*reff'),
+                 feffpath(str(feffit_dir / 'feff0002.dat'), s02='amp',
+                          e0='del_e0', sigma2='sig2_2', deltar='alpha*reff')]
+        trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4,
+                                 window='kaiser', rmin=1.4, rmax=3.0)
+        dset = feffit_dataset(data=data, paths=paths, transform=trans)
+        results.append(feffit(pars, dset, vectorize_paths=vectorize,
+                              analytic_jacobian=jacobian))
+
+    serial = results[0]
+    for result in results[1:]:
+        assert_allclose(result.chi_square, serial.chi_square, rtol=1.e-6)
+        for name in ('amp', 'del_e0', 'sig2_1', 'sig2_2', 'alpha'):
+            assert_allclose(result.params[name].value, serial.params[name].value,
+                            rtol=0, atol=0.01*serial.params[name].stderr)
+            assert_allclose(result.params[name].stderr,
+                            serial.params[name].stderr, rtol=1.e-3)
+    assert results[2].nfev < serial.nfev
+
+
+def test_feffit_nworkers():
+    data = get_cudata()
+    results = []
+    for nworkers in (1, 2):
+        pars = param_group(amp=param(1, vary=True),
+                           del_e0=param(3, vary=True),
+                           sig2_1=param(0.002, vary=True),
+                           alpha=param(0, vary=True))
+        dsets = []
+        for kw in (1, 2, 3):
+            paths = [feffpath(str(feffit_dir / 'feff0001.dat'), s02='amp',
+                              e0='del_e0', sigma2='sig2_1',
+                              deltar='alpha*reff')]
+            trans = feffit_transform(kmin=3, kmax=17, kw=kw, dk=4,
+                                     window='kaiser', rmin=1.4, rmax=3.0)
+            dsets.append(feffit_dataset(data=data, paths=paths,
+                                        transform=trans))
+        results.append(feffit(pars, dsets, nworkers=nworkers))
+
+    serial, workers = results
+    assert_allclose(workers.chi_square, serial.chi_square, rtol=1.e-8)
+    for name in ('amp', 'del_e0', 'sig2_1', 'alpha'):
+        assert_allclose(workers.params[name].value, serial.params[name].value,
+                        rtol=1.e-8)
+
+
+def test_feffit_uncertainties():
+    data = get_cudata()
+    results = []
+    for exact in (True, False):
+        pars = param_group(amp=param(1, vary=True),
+                           del_e0=param(3, vary=True),
+                           theta=param(250, vary=True),
+                           sig2_1=param(0.002, vary=True),
+                           alpha=param(0, vary=True),
+                           amp_sig2=param(expr='amp*sig2_1 + del_e0/1000'))
+        paths = [feffpath(str(feffit_dir / 'Feff_Cu' / f'feff{i:04d}.dat'),
+                          s02='amp', e0='del_e0', deltar='alpha*reff',
+                          sigma2='sig2_1' if i == 1 else 'sigma2_eins(300, theta)')
+                 for i in range(1, 4)]
+        trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4,
+                                 window='kaiser', rmin=1.4, rmax=4.0)
+        dset = feffit_dataset(data=data, paths=paths, transform=trans)
+        results.append(feffit(pars, dset, exact_uncertainties=exact))
+
+    exact, linear = results
+    assert_allclose(linear.params['amp_sig2'].stderr,
+                    exact.params['amp_sig2'].stderr, rtol=1.e-4)
+    alpha_err = linear.params['alpha'].stderr
+    for ipath, path in enumerate(linear.datasets[0].paths.values()):
+        epath = list(exact.datasets[0].paths.values())[ipath]
+        for pname in ('s02', 'e0', 'deltar', 'sigma2'):
+            epar = epath.params[epath.pathpar_name(pname)]
+            par = path.params[path.pathpar_name(pname)]
+            assert par.stderr > 0
+            if pname == 'deltar':
+                assert_allclose(par.stderr, alpha_err*path._feffdat.reff,
+                                rtol=1.e-5)
+            elif pname != 'sigma2' or ipath == 0:
+                assert_allclose(par.stderr, epar.stderr, rtol=1.e-4)
+
+
+def test_feffit_uncertainties_shared_paths():
+    # the same Feff.dat used for data at several temperatures
+    results = []
+    for exact in (True, False):
+        pars = param_group(amp=param(1, vary=True),
+                           del_e0=param(2, vary=True),
+                           theta=param(250, min=10, vary=True),
+                           dr_off=param(0, vary=True),
+                           alpha=param(0, vary=True))
+        trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4,
+                                 window='kaiser', rmin=1.4, rmax=3.4)
+        dsets = []
+        for temp in (10, 50, 150):
+            data = read_ascii(str(base_dir / 'examples' / 'xafsdata' /
+                                  f'cu_{temp}k.xmu'))
+            autobk(data.energy, data.mu, group=data, rbkg=1.0, kw=2)
+            path = feffpath(str(feffit_dir / 'feff0001.dat'), s02='amp',
+                            e0='del_e0', deltar=f'dr_off + {temp}*alpha*reff',
+                            sigma2=f'sigma2_eins({temp}, theta)')
+            dsets.append(feffit_dataset(data=data, paths=[path],
+                                        transform=trans))
+        results.append(feffit(pars, dsets, exact_uncertainties=exact))
+
+    exact, linear = results
+    stderrs = []
+    for eds, ds in zip(exact.datasets, linear.datasets):
+        epath = list(eds.paths.values())[0]
+        path = list(ds.paths.values())[0]
+        for pname in ('s02', 'e0', 'deltar', 'sigma2'):
+            epar = epath.params[epath.pathpar_name(pname)]
+            par = path.params[path.pathpar_name(pname)]
+            assert_allclose(par.stderr, epar.stderr, rtol=1.e-4)
+        stderrs.append(path.params[path.pathpar_name('sigma2')].stderr)
+    assert stderrs[0] < stderrs[1] < stderrs[2]
+
+
+def test_feffit_chi2_map_nworkers():
+    data = get_cudata()
+    pars = param_group(amp=param(1, vary=True),
+                       del_e0=param(3, vary=True),
+                       sig2_1=param(0.002, vary=True),
+                       alpha=param(0, vary=True))
+    paths = [feffpath(str(feffit_dir / 'feff0001.dat'), s02='amp',
+                      e0='del_e0', sigma2='sig2_1', deltar='alpha*reff')]
+    trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4,
+                             window='kaiser', rmin=1.4, rmax=3.0)
+    out = feffit(pars, feffit_dataset(data=data, paths=paths, transform=trans))
+
+    done = []
+    def callback(xpts, ypts, chi2, ix, iy):
+        done.append((ix, iy))
+        assert np.isfinite(chi2).sum() == len(done)
+
+    serial = chi2_map(out, 'amp', 'sig2_1', nx=5, ny=5, callback=callback)
+    workers = chi2_map(out, 'amp', 'sig2_1', nx=5, ny=5, nworkers=2)
+    # grid points are done outward from the best fit
+    assert done[0] == (2, 2)
+    assert_allclose(serial[2][2, 2], out.chi_square, rtol=1.e-6)
+    assert serial[2].argmin() == 12
+    for a, b in zip(serial, workers):
+        assert_allclose(a, b, rtol=1.e-6)
+
+    ci = confidence_intervals(out, sigmas=(1, 2), p_names=['amp'],
+                              nworkers=2)
+    (p2, lo2), (p1, lo1), (p0, best), (_, hi1), (_, hi2) = ci['amp']
+    assert best == out.params['amp'].value
+    assert lo2 < lo1 < best < hi1 < hi2
+    assert_allclose(hi1 - lo1, 2*out.params['amp'].stderr, rtol=0.1)
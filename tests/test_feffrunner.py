@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+""" Tests of running Feff with FeffJobFarm """
+import os
+import json
+from pathlib import Path
+import pytest
+
+from larch.xafs.feffrunner import FeffJobFarm, feffinp_hashkey, FEFFJOB_FILE
+
+base_dir = Path(__file__).parent.parent.resolve()
+feffinp = (base_dir / 'examples' / 'feffit' / 'Feff_ZnSe' / 'feff.inp').read_text()
+
+
+def test_feffinp_hashkey():
+    key = feffinp_hashkey(feffinp)
+    edited = '* a new comment\n\n' + feffinp.replace(' ', '   ') + '\n\n'
+    assert feffinp_hashkey(edited) == key
+    assert feffinp_hashkey(feffinp, exe='feff6l') != key
+    assert feffinp_hashkey(feffinp.replace('0.000', '0.001', 1)) != key
+
+
+def test_feffjobfarm_cache(tmp_path):
+    # a completed calculation in the cache is returned without running Feff
+    key = feffinp_hashkey(feffinp, exe='feff6l')
+    folder = tmp_path / key
+    folder.mkdir()
+    (folder / 'feff.inp').write_text(feffinp)
+    for i in (2, 1):
+        (folder / f'feff{i:04d}.dat').write_text('')
+    (folder / FEFFJOB_FILE).write_text(json.dumps({'hashkey': key}))
+
+    with FeffJobFarm(nworkers=2, cachedir=str(tmp_path), exe='feff6l') as farm:
+        job = farm.submit('* same input\n' + feffinp)
+        assert job.done()
+        result = job.result()
+        assert result.cached and result.hashkey == key
+        assert result.folder == str(folder)
+        assert result.paths == [str(folder / 'feff0001.dat'),
+                                str(folder / 'feff0002.dat')]
+        results = farm.map([feffinp, str(folder / 'feff.inp')])
+        assert [r.folder for r in results] == [str(folder)]*2
+
+
+def test_feffjobfarm_failure(tmp_path):
+    with FeffJobFarm(nworkers=2, cachedir=str(tmp_path), exe='no_such_feff') as farm:
+        job = farm.submit(feffinp)
+        with pytest.raises(Exception):
+            job.result()
+        # failed calculations leave nothing in the cache, and can be retried
+        assert os.listdir(tmp_path) == []
+        assert farm.submit(feffinp) is not job
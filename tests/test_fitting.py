@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Tests of chi2_map and confidence_intervals for minimize() fits"""
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.fitting import (param, param_group, minimize, chi2_map,
+                           confidence_intervals)
+
+
+def residual(pars, data=None):
+    model = pars.amp*np.exp(-data.x/pars.decay) + pars.offset
+    return model - data.y
+
+
+def get_fit():
+    x = np.linspace(0, 10, 201)
+    noise = np.random.default_rng(7).normal(scale=0.02, size=len(x))
+    data = Group(x=x, y=3.0*np.exp(-x/2.5) + 0.2 + noise)
+    pars = param_group(amp=param(2, vary=True),
+                       decay=param(1, vary=True),
+                       offset=param(0, vary=True))
+    return minimize(residual, pars, kws={'data': data})
+
+
+def test_chi2_map():
+    out = get_fit()
+    xpts, ypts, chi2 = chi2_map(out, 'amp', 'decay', nx=7, ny=5, sigma=2,
+                                nworkers=2)
+    assert chi2.shape == (5, 7)
+    amp, decay = out.params['amp'], out.params['decay']
+    assert_allclose(xpts[[0, -1]], amp.value + 2*amp.stderr*np.array([-1, 1]))
+    assert_allclose(ypts[[0, -1]], decay.value + 2*decay.stderr*np.array([-1, 1]))
+    assert_allclose(chi2[2, 3], out.chi_square, rtol=1.e-6)
+    assert np.all(chi2 >= out.chi_square*(1 - 1.e-8))
+
+
+def test_confidence_intervals():
+    out = get_fit()
+    cold = confidence_intervals(out, sigmas=(1, 2), warm_start=False)
+    warm = confidence_intervals(out, sigmas=(1, 2))
+    for name in ('amp', 'decay', 'offset'):
+        assert len(warm[name]) == 5
+        assert_allclose([v for p, v in warm[name]],
+                        [v for p, v in cold[name]], rtol=1.e-4)
+        # 1-sigma interval is close to the estimated uncertainty
+        (_, lo1), (_, hi1) = warm[name][1], warm[name][3]
+        assert_allclose(hi1 - lo1, 2*out.params[name].stderr, rtol=0.05)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+""" Tests of linear combination fitting"""
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.optimize import lsq_linear
+
+from larch import Group
+from larch.math import lincombo_fit, lincombo_fitall, lincombo_solve
+
+energy = np.linspace(7000, 7200, 401)
+
+
+def get_groups(ncomps=6):
+    comps = []
+    for i in range(ncomps):
+        cen = 7050 + 12*i
+        norm = (1/(1 + np.exp(-(energy-cen)/3))
+                + 0.6*np.exp(-((energy-cen-8-i)/(4+i))**2)
+                + 0.1*np.sin((energy-7000)/(6+i)))
+        comps.append(Group(energy=energy, norm=norm, filename=f'std{i}'))
+    noise = np.random.default_rng(3).normal(scale=0.005, size=len(energy))
+    ydat = (0.5*comps[1].norm + 0.3*comps[3].norm + 0.2*comps[4].norm + noise)
+    return Group(energy=energy, norm=ydat, filename='unknown'), comps
+
+
+def test_lincombo_solve():
+    group, comps = get_groups()
+    ycomps = np.array([c.norm for c in comps]).T
+    ydat = group.norm + 0.2*comps[0].norm
+    gram, ycross = ycomps.T @ ycomps, ycomps.T @ ydat
+    lo, hi = np.zeros(6), np.full(6, 0.4)
+    wts = lincombo_solve(gram, ycross, lo, hi, sum_to_one=False)
+    assert_allclose(wts, lsq_linear(ycomps, ydat, bounds=(lo, hi)).x, atol=1.e-7)
+
+    # sum to one, with and without bounds
+    wts = lincombo_solve(gram, ycross, lo, hi, sum_to_one=True)
+    assert_allclose(wts.sum(), 1.0)
+    assert (wts >= 0).all() and (wts <= 0.4 + 1.e-12).all()
+    free = lincombo_solve(gram, ycross, -np.inf*np.ones(6), np.inf*np.ones(6))
+    fit = lincombo_fit(Group(energy=energy, norm=ydat), comps)
+    assert_allclose(free, list(fit.weights.values()), atol=1.e-6)
+
+    # bounds that cannot be met
+    assert lincombo_solve(gram, ycross, lo, np.full(6, 0.1)) is None
+
+
+def test_lincombo_fitall():
+    group, comps = get_groups()
+    kws = dict(minvals=[0]*6, maxvals=[1]*6, max_output=8)
+    results = lincombo_fitall(group, comps, **kws)
+    assert len(results) == 8
+    labels = [sorted(res.weights) for res in results]
+    assert ['std1', 'std3', 'std4'] in labels
+    three = results[labels.index(['std1', 'std3', 'std4'])]
+    redchis = [r.redchi for r in results]
+    assert redchis == sorted(redchis)
+
+    best = lincombo_fit(group, [comps[1], comps[3], comps[4]],
+                        weights=[0.3, 0.3, 0.4], minvals=[0]*3, maxvals=[1]*3)
+    assert_allclose(three.redchi, best.redchi, rtol=1.e-6)
+    for label, par in best.params.items():
+        assert_allclose(three.params[label].value, par.value, atol=1.e-6)
+        if par.stderr is not None and par.stderr > 0:
+            assert_allclose(three.params[label].stderr, par.stderr, rtol=1.e-3)
+    for attr in ('nvarys', 'nfev', 'chisqr', 'redchi', 'aic', 'bic'):
+        assert getattr(three.result, attr) is not None
+
+    # skipping combinations that cannot be among the best results
+    # does not change the results
+    full = lincombo_fitall(group, comps, minvals=[0]*6, maxvals=[1]*6,
+                           max_output=1000)
+    workers = lincombo_fitall(group, comps, nworkers=2, **kws)
+    for res, fres, wres in zip(results, full, workers):
+        assert sorted(res.weights) == sorted(fres.weights) == sorted(wres.weights)
+        assert_allclose([res.redchi, wres.redchi], fres.redchi, rtol=1.e-10)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+""" Tests of XAFS pre-edge subtraction and normalization """
+from pathlib import Path
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import (pre_edge, preedge, find_e0, pre_edge_batch,
+                        preedge_batch, find_e0_batch)
+
+data_dir = Path(__file__).parent.parent.resolve() / 'examples' / 'xafsdata'
+
+
+def get_stack(nspectra=12):
+    "spectra on a common energy grid, with shifted edges and noise"
+    cu = read_ascii(str(data_dir / 'cu_metal_rt.xdi'))
+    rng = np.random.default_rng(11)
+    mu = [np.interp(cu.energy + rng.integers(-6, 6), cu.energy, cu.mutrans)
+          * (1 + 0.05*rng.normal()) + 2.e-3*rng.normal(size=len(cu.energy))
+          for i in range(nspectra)]
+    return cu.energy, np.array(mu)
+
+
+def test_find_e0_batch():
+    energy, mu = get_stack()
+    expected = [find_e0(energy, m) for m in mu]
+    assert_allclose(find_e0_batch(energy, mu), expected)
+
+
+def test_preedge_batch():
+    energy, mu = get_stack()
+    mu[3, 50] = np.nan
+    e0 = np.full(len(mu), np.nan)
+    e0[5] = 8985.0
+    out = preedge_batch(energy, mu, e0=e0, nvict=1)
+    for i, m in enumerate(mu):
+        dat = preedge(energy, m, e0=None if np.isnan(e0[i]) else e0[i],
+                      nvict=1)
+        for attr in ('e0', 'pre1', 'pre2', 'norm1', 'norm2',
+                     'nnorm'):
+            assert out[attr][i] == dat[attr]
+        for attr in ('edge_step', 'norm', 'pre_edge', 'post_edge',
+                     'precoefs'):
+            assert_allclose(out[attr][i], dat[attr], rtol=1.e-10, atol=1.e-12)
+        assert_allclose(out['norm_coefs'][i], dat['norm_coefs'], rtol=1.e-8)
+
+
+def test_pre_edge_batch():
+    energy, mu = get_stack()
+    groups = pre_edge_batch(energy, mu, nnorm=2)
+    assert len(groups) == len(mu)
+    for grp, m in zip(groups, mu):
+        ref = Group(energy=energy, mu=m)
+        pre_edge(ref, nnorm=2)
+        assert grp.e0 == ref.e0
+        assert (grp.atsym, grp.edge) == (ref.atsym, ref.edge)
+        assert_allclose(grp.edge_step, ref.edge_step, rtol=1.e-10)
+        for attr in ('norm', 'flat', 'dmude', 'd2mude', 'pre_edge',
+                     'post_edge'):
+            assert_allclose(getattr(grp, attr), getattr(ref, attr),
+                            rtol=1.e-10, atol=1.e-12)
+        assert_allclose(grp.flat_alt, ref.flat_alt, rtol=1.e-6)
+        for attr in ('pre1', 'pre2', 'norm1', 'norm2', 'nnorm', 'norm_c0',
+                     'norm_c1', 'norm_c2', 'pre_slope', 'pre_offset'):
+            assert_allclose(getattr(grp.pre_edge_details, attr),
+                            getattr(ref.pre_edge_details, attr), rtol=1.e-8)
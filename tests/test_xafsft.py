@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+""" Tests of XAFS Fourier transforms """
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.xafs import xftf_fast, xftr_fast, ftwindow
+from larch.xafs.xafsft import (set_fft_workers, ftwindow_cache_info,
+                               ftwindow_cache_clear, set_ftwindow_cache_size)
+from larch.xafs.xafsutils import FT_WINDOWS_SHORT
+
+
+def ref_xftf(chi, nfft=2048, kstep=0.05):
+    cchi = np.zeros(nfft, dtype='complex128')
+    cchi[:len(chi)] = chi
+    return (kstep/np.sqrt(np.pi)) * np.fft.fft(cchi)[:nfft//2]
+
+def ref_xftr(chir, nfft=2048, kstep=0.05):
+    cchi = np.zeros(nfft, dtype='complex128')
+    cchi[:len(chir)] = chir
+    return (4*np.sqrt(np.pi)/kstep) * np.fft.ifft(cchi)[:nfft//2]
+
+
+def test_xft_fast():
+    rng = np.random.default_rng(3)
+    chi = rng.normal(size=321)
+    chir = rng.normal(size=400) + 1j*rng.normal(size=400)
+    for workers in (None, 2):
+        set_fft_workers(workers)
+        for nfft in (1024, 2048):
+            # repeated calls with shorter input must not see stale data
+            for npts in (321, 200):
+                assert_allclose(xftf_fast(chi[:npts], nfft=nfft, kstep=0.05),
+                                ref_xftf(chi[:npts], nfft=nfft, kstep=0.05),
+                                rtol=0, atol=1.e-12)
+                assert_allclose(xftr_fast(chir[:npts], nfft=nfft, kstep=0.05),
+                                ref_xftr(chir[:npts], nfft=nfft, kstep=0.05),
+                                rtol=0, atol=1.e-12)
+                assert_allclose(xftr_fast(chi[:npts], nfft=nfft, kstep=0.05),
+                                ref_xftr(chi[:npts], nfft=nfft, kstep=0.05),
+                                rtol=0, atol=1.e-12)
+            assert_allclose(xftf_fast(chir, nfft=nfft, workers=1),
+                            ref_xftf(chir, nfft=nfft), rtol=0, atol=1.e-12)
+    set_fft_workers(None)
+
+
+def test_ftwindow_cache():
+    k = 0.05*np.arange(401)
+    ftwindow_cache_clear()
+    set_ftwindow_cache_size(0)
+    expected = {win: ftwindow(k, xmin=2, xmax=15, dx=3, window=win)
+                for win in FT_WINDOWS_SHORT}
+    assert ftwindow_cache_info().currsize == 0
+
+    set_ftwindow_cache_size(4)
+    for win in FT_WINDOWS_SHORT:
+        fwin = ftwindow(k, xmin=2, xmax=15, dx=3, window=win)
+        assert_allclose(fwin, expected[win], rtol=0, atol=0)
+        assert not fwin.flags.writeable
+        assert ftwindow(0.05*np.arange(401), xmin=2, xmax=15, dx=3,
+                        window=win) is fwin
+    info = ftwindow_cache_info()
+    assert (info.hits, info.misses) == (6, 6)
+    assert info.currsize == info.maxsize == 4
+
+    # windows on non-uniform grids are not cached
+    x = np.array([0.0, 0.5, 1.5, 2.0, 3.5, 4.0, 5.5, 6.0, 7.0])
+    fwin = ftwindow(x, xmin=1, xmax=6, dx=1)
+    assert fwin.flags.writeable
+    assert ftwindow_cache_info().misses == 6
+
+    set_ftwindow_cache_size()
+    ftwindow_cache_clear()
+    assert ftwindow_cache_info() == (0, 0, 256, 0)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+""" Tests of XRF Model and decomposition of XRF spectra and maps """
+import warnings
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+import h5py
+from scipy.optimize import nnls
+
+from larch.math import nnls_batch, interp
+from larch.math.lineshapes import gaussian
+from larch import Group
+from larch.xrf import xrf_model
+from larch.xrf.xrf_model import XRFFitResult, XRF_Element, XRF_Material
+from larch.xrmmap.xrm_mapfile import GSEXRM_MapFile
+
+
+def make_fitresult(nchan=512, ncomps=6):
+    energy = np.linspace(1, 20, nchan)
+    centers = np.linspace(3, 17, ncomps)
+    xfer = np.array([gaussian(energy, center=c, sigma=0.5) +
+                     0.3*gaussian(energy, center=c+1.0, sigma=0.5)
+                     for c in centers]).T
+    fit_window = np.zeros(nchan)
+    fit_window[40:480] = 1.0
+    eigenvalues = {f'comp{i}': 1.0 for i in range(ncomps)}
+    return XRFFitResult(transfer_matrix=xfer, fit_window=fit_window,
+                        eigenvalues=eigenvalues, count_time=1.0)
+
+
+def make_model(elements=('Ca', 'Mn', 'Fe', 'Cu', 'Zn', 'Pb')):
+    model = xrf_model(xray_energy=20.0, count_time=10.0, energy_min=1.5,
+                      energy_max=19.0)
+    model.set_detector(thickness=0.4, material='Si', cal_offset=-0.01,
+                       cal_slope=0.01, noise=0.05)
+    model.add_scatter_peak(name='elastic', center=20.0, amplitude=1e5)
+    model.add_scatter_peak(name='compton', center=19.0, amplitude=1e5,
+                           sigmax=1.5)
+    model.add_filter('beryllium', 0.025)
+    model.add_escape(scale=0.25)
+    for elem in elements:
+        model.add_element(elem, amplitude=500)
+    return model
+
+
+def make_map(result, ny=9, nx=7):
+    rng = np.random.default_rng(5)
+    ncomps = result.transfer_matrix.shape[1]
+    weights = np.maximum(0, rng.normal(loc=20, scale=30, size=(ny, nx, ncomps)))
+    counts = weights @ result.transfer_matrix.T
+    return counts + rng.normal(scale=2.0, size=counts.shape)
+
+
+def test_nnls_batch():
+    result = make_fitresult()
+    counts = make_map(result).reshape((-1, 512)).T
+    xfer = result.transfer_matrix
+    out = nnls_batch(xfer, counts)
+    for i in range(counts.shape[1]):
+        assert_allclose(out[:, i], nnls(xfer, counts[:, i])[0],
+                        rtol=1.e-8, atol=1.e-8)
+    assert_allclose(nnls_batch(xfer, counts[:, 3]), out[:, 3])
+
+    # solutions with active constraints, stopped before they are optimal
+    rng = np.random.default_rng(1)
+    amat = rng.random((50, 6))
+    bvec = amat @ np.array([1.0, -2.0, 0.5, -1.0, 3.0, -0.5])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert_allclose(nnls_batch(amat, bvec), nnls(amat, bvec)[0],
+                        rtol=1.e-8, atol=1.e-10)
+    with pytest.warns(RuntimeWarning, match='maximum number of iterations'):
+        nnls_batch(amat, bvec, maxiter=1)
+
+
+def test_decompose_map():
+    result = make_fitresult()
+    xmap = make_map(result)
+    ny, nx, nchan = xmap.shape
+    win = np.where(result.fit_window > 0)[0]
+    w0, w1 = max(0, win[0]-100), min(nchan-1, win[-1]+100)
+    xfer = result.transfer_matrix[w0:w1]
+    fwin = result.fit_window[w0:w1]
+    names = list(result.eigenvalues.keys())
+    for method, solver in (('lstsq', lambda b: np.linalg.lstsq(xfer, b, rcond=None)[0]),
+                           ('nnls', lambda b: nnls(xfer, b)[0])):
+        expected = np.array([[solver(fwin*xmap[iy, ix, w0:w1])
+                              for ix in range(nx)] for iy in range(ny)])
+        for nworkers in (1, 3):
+            maps = result.decompose_map(xmap, scale=2.0, method=method,
+                                        nworkers=nworkers)
+            assert list(maps.keys()) == names
+            for i, name in enumerate(names):
+                assert maps[name].shape == (ny, nx)
+                assert_allclose(maps[name], 2*expected[:, :, i], rtol=1.e-5,
+                                atol=1.e-4*abs(expected).max())
+
+
+def test_decompose_mapfile(tmp_path):
+    result = make_fitresult()
+    xmap = make_map(result, ny=11, nx=6)
+    ny, nx, nchan = xmap.shape
+    # minimal map file, with only the summed detector counts
+    mapfile = GSEXRM_MapFile.__new__(GSEXRM_MapFile)
+    mapfile.filename = str(tmp_path / 'xrfmap.h5')
+    mapfile.h5root = h5py.File(mapfile.filename, 'w')
+    mapfile.xrmmap = mapfile.h5root.create_group('xrmmap')
+    mapfile.version = '2.1.0'
+    mapfile._pixeltime = 0.5
+    mcasum = mapfile.xrmmap.create_group('mcasum')
+    mcasum.create_dataset('counts', data=xmap, chunks=(2, nx, nchan))
+
+    expected = result.decompose_map(xmap, scale=3.0, pixel_time=0.5,
+                                    method='nnls', nworkers=1)
+    rows = []
+    def callback(row=None, maxrow=None, filename=None):
+        rows.append(row)
+        assert maxrow == ny
+
+    for nworkers in (1, 3):
+        rows.clear()
+        names = result.decompose_mapfile(mapfile, scale=3.0, method='nnls',
+                                         max_block=4*nx*nchan,
+                                         nworkers=nworkers, callback=callback)
+        assert names == list(expected.keys())
+        assert rows == [4, 8, 11]
+        for name in names:
+            assert_allclose(mapfile.get_work_array(name)[()], expected[name],
+                            rtol=1.e-5, atol=1.e-3)
+
+    # arrays from other fits are kept, unless overwriting the group
+    mapfile.add_work_array(np.zeros((ny, nx)), 'other_fit', order=10)
+    result.decompose_mapfile(mapfile, max_block=4*nx*nchan)
+    assert mapfile.get_work_array('other_fit') is not None
+    result.decompose_mapfile(mapfile, max_block=4*nx*nchan, overwrite=True)
+    assert mapfile.get_work_array('other_fit') is None
+    assert sorted(mapfile.xrmmap['work'].keys()) == sorted(names)
+    mapfile.h5root.close()
+
+
+def test_calc_spectrum_cache():
+    energy = np.linspace(-0.01, 20.47, 2048)
+    model = make_model()
+    model.calc_spectrum(energy)
+    for name, value in (('amp_fe', 800), ('elastic_amp', 2e5),
+                        ('peak_tail', 0.05), ('elastic_center', 19.9),
+                        ('det_noise', 0.07), ('amp_cu', 10)):
+        model.params[name].value = value
+        total = model.calc_spectrum(energy)
+        comps = {key: val.copy() for key, val in model.comps.items()}
+        model._basis_cache.clear()
+        assert_allclose(total, model.calc_spectrum(energy), rtol=1.e-12)
+        for key, val in model.comps.items():
+            assert_allclose(comps[key], val, rtol=1.e-12)
+
+
+def test_fit_spectrum_separable():
+    energy = np.linspace(-0.01, 20.47, 2048)
+    elements = ('Ca', 'Mn', 'Fe', 'Cu', 'Zn', 'Pb')
+    true = make_model(elements)
+    amps = {'amp_ca': 50, 'amp_mn': 120, 'amp_fe': 300, 'amp_cu': 80,
+            'amp_zn': 150, 'amp_pb': 200, 'elastic_amp': 300,
+            'compton_amp': 600, 'det_noise': 0.06, 'peak_tail': 0.05}
+    for name, val in amps.items():
+        true.params[name].value = val
+    mca = Group(energy=energy, counts=true.calc_spectrum(energy))
+
+    model = make_model(elements)
+    result = model.fit_spectrum(mca, separable=True, fit_toler=1.e-7)
+    assert result.nvarys == len([p for p in model.params.values() if p.vary])
+    assert result.nfree == result.ndata - result.nvarys
+    assert result.covar.shape == (result.nvarys, result.nvarys)
+    assert result.transfer_matrix.shape == (2048, len(elements) + 2)
+    # the scatter peaks at the edge of the spectrum are poorly determined
+    for name, val in amps.items():
+        if name.startswith('amp_') or name == 'det_noise':
+            assert_allclose(result.params[name].value, val, rtol=2.e-2)
+        assert result.params[name].stderr > 0
+    assert result.redchi < 0.1
+
+
+def test_pileup_escape():
+    energy = np.linspace(-0.01, 20.47, 2048)
+    model = make_model(('Fe', 'Zn'))
+    model.add_pileup(scale=1.0)
+    model.calc_spectrum(energy)
+
+    # pileup from FFTs matches the direct self-convolution
+    spectrum = sum(comp for name, comp in model.comps.items()
+                   if name != 'pileup')
+    direct = 1.e-9*np.convolve(spectrum, spectrum, 'full')[:len(energy)]
+    assert_allclose(model.comps['pileup'], direct, rtol=1.e-8,
+                    atol=1.e-12*direct.max())
+    window = model._pileup(spectrum, 1.0, npts=1000)
+    assert_allclose(window[:1000], direct[:1000], rtol=1.e-8,
+                    atol=1.e-12*direct.max())
+    assert (window[1000:] == 0).all()
+
+    # escape peaks for all elements at once match interpolating each one
+    comps = np.array([model.comps['Fe'], model.comps['Zn']]).T
+    escape = model._add_escape(energy, comps)
+    for i in range(2):
+        shifted = interp(energy-model.escape_energy, comps[:, i], energy)
+        assert_allclose(escape[:, i], comps[:, i] + model.escape_amp*shifted,
+                        rtol=1.e-10, atol=1.e-10*comps.max())
+
+
+def test_fit_spectra():
+    energy = np.linspace(-0.01, 20.47, 2048)
+    true = make_model(('Fe', 'Zn'))
+    mcas = []
+    for i, scale in enumerate((1.0, 1.2, 1.5)):
+        true.params['amp_fe'].value = 300*scale
+        true.params['amp_zn'].value = 200*scale
+        mcas.append(Group(energy=energy, label='mca%d' % i,
+                          counts=true.calc_spectrum(energy)))
+
+    model = make_model(('Fe', 'Zn'))
+    start = model.params.valuesdict()
+    results, summary = model.fit_spectra(mcas, warm_start='nearest')
+    assert model.params.valuesdict() == start
+    assert len(results) == 3
+    assert summary.labels == ['mca0', 'mca1', 'mca2']
+    assert summary.names[:2] == ['amp_fe', 'amp_zn']
+    assert summary.values.shape == summary.stderr.shape == (3, 4)
+    assert_allclose(summary.values[:, 0], [300, 360, 450], rtol=2.e-2)
+    assert_allclose(summary.values[:, 1], [200, 240, 300], rtol=2.e-2)
+    assert len(summary.table.split('\n')) == 4
+
+    _, summary2 = model.fit_spectra(mcas, nworkers=2)
+    assert_allclose(summary2.values[:, :2], summary.values[:, :2], rtol=2.e-2)
+
+    # a model that cannot be pickled is fit serially, with a warning
+    model.iter_callback = lambda iter=0, pars=None: None
+    with pytest.warns(RuntimeWarning, match='fitting spectra serially'):
+        _, summary3 = model.fit_spectra(mcas[:2], nworkers=2)
+    assert_allclose(summary3.values[:, :2], summary.values[:2, :2], rtol=2.e-2)
+
+
+def test_xraydb_cache():
+    import xraydb
+    from larch.xray import xraydb_cache
+    xraydb_cache.xraydb_cache_clear()
+    energy = np.linspace(1.0, 20.0, 1024)
+    mu = xraydb_cache.material_mu('Si', 1000*energy, kind='photo')
+    assert_allclose(mu, xraydb.material_mu('Si', 1000*energy, kind='photo'))
+    assert xraydb_cache.material_mu('Si', 1000*energy, kind='photo') is mu
+    assert not mu.flags.writeable
+    lines = xraydb_cache.xray_lines('Pb', 'L3')
+    assert lines == xraydb.xray_lines('Pb', 'L3')
+    lines.clear()
+    assert len(xraydb_cache.xray_lines('Pb', 'L3')) > 0
+
+    # elements built from cached lookups are the same
+    elem1 = XRF_Element('Pb', xray_energy=20)
+    elem2 = XRF_Element('Pb', xray_energy=20)
+    assert elem1.lines == elem2.lines and elem1.fyields == elem2.fyields
+
+    # only the thickness changes for the attenuation of a material
+    mat = XRF_Material('Si', thickness=0.5)
+    trans = mat.transmission(energy)
+    assert_allclose(mat.transmission(energy, thickness=1.0), trans**2)
+    assert_allclose(mat.absorbance(energy), 1 - trans)
+
+    assert len(xraydb_cache._xraydb_cache) > 0
+    xraydb_cache.xraydb_cache_clear()
+    assert len(xraydb_cache._xraydb_cache) == 0
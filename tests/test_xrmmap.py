@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+""" Tests of XRF map file processing """
+import time
+import numpy as np
+
+from larch.xrmmap import xrm_mapfile
+from larch.xrmmap.xrm_mapfile import GSEXRM_MapFile
+
+
+class RowRecorder(GSEXRM_MapFile):
+    """MapFile that records rows written instead of reading raw files"""
+    def __init__(self, nrows=0):
+        self.args_order = []
+        self.written = []
+        self.rowdata = list(range(nrows))
+        self.status = None
+        self.dimension = 2
+        self.write_access = True
+        self.last_row = -1
+
+    def check_hostid(self):
+        return True
+
+    def reset_flags(self):
+        pass
+
+    def folder_has_newdata(self):
+        return True
+
+    def read_rowdata(self, irow, offset=None):
+        return 'row%d' % irow
+
+    def _rowdata_args(self, irow, offset=None):
+        self.args_order.append(irow)
+        return irow
+
+    def store_row(self, irow, row, flush=False, complete=False,
+                  nrows_expected=None, callback=None):
+        self.written.append((irow, row, flush, complete))
+
+
+def _slow_reader(monkeypatch):
+    delays = np.random.default_rng(7).uniform(0, 0.005, size=200)
+    def read_row(irow):
+        time.sleep(delays[irow])
+        return 'row%d' % irow
+    monkeypatch.setattr(xrm_mapfile, '_read_maprow', read_row)
+
+
+def test_process_rows_in_order(monkeypatch):
+    _slow_reader(monkeypatch)
+    nrows = 150
+    expected = [(i, 'row%d' % i, i < 2 or i % 64 == 0, i == nrows-1)
+                for i in range(nrows)]
+    for nworkers, max_queue in ((2, None), (4, 3), (3, 1)):
+        mapfile = RowRecorder()
+        mapfile._process_rows(0, nrows, nworkers=nworkers, max_queue=max_queue)
+        assert mapfile.written == expected
+        assert mapfile.args_order == list(range(nrows))
+
+
+def test_process_from_first_row(monkeypatch):
+    _slow_reader(monkeypatch)
+    for nrows in (1, 2, 150):
+        expected = [(i, 'row%d' % i, i < 2 or i % 64 == 0, i == nrows-1)
+                    for i in range(nrows)]
+        mapfile = RowRecorder(nrows=nrows)
+        mapfile.process(nworkers=4)
+        assert mapfile.written == expected
+        # the first row is read serially, to set up the HDF5 datasets,
+        # and the rest by the pool of threads
+        assert mapfile.args_order == list(range(1, nrows))